@@ -0,0 +1,266 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+from db_handler import get_db_connection, BUCKET_PREFIX, rollup_buckets
+
+# Сводные таблицы аналитики обновляются инкрементально: каждый вызов
+# refresh_analytics дочитывает только сообщения с id больше сохраненного.
+# Сводки не удаляются вместе со старыми сообщениями, поэтому история
+# за 90 дней доступна и после очистки messages. Дочитывает сводки процесс
+# слушателя раз в ANALYTICS_REFRESH_SECONDS, веб-сервер их только читает и
+# не берет блокировку записи на каждый запрос страницы.
+ANALYTICS_BATCH_SIZE = 5000
+ANALYTICS_REFRESH_SECONDS = 15
+ANALYTICS_PERIODS = {
+    "hour": (timedelta(hours=1), "minute"),
+    "today": (timedelta(hours=24), "hour"),
+    "week": (timedelta(days=7), "day"),
+    "month": (timedelta(days=30), "day"),
+    "quarter": (timedelta(days=90), "day"),
+}
+
+_refresh_lock = threading.Lock()
+
+def init_analytics():
+    """Создает сводные таблицы аналитики"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        # Счетчики по корзинам времени (минута, час, сутки)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS message_rollups (
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                incoming_count INTEGER NOT NULL DEFAULT 0,
+                outgoing_count INTEGER NOT NULL DEFAULT 0,
+                user_count INTEGER NOT NULL DEFAULT 0,
+                chats_opened INTEGER NOT NULL DEFAULT 0,
+                chats_closed INTEGER NOT NULL DEFAULT 0,
+                response_count INTEGER NOT NULL DEFAULT 0,
+                response_seconds REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (granularity, bucket)
+            ) WITHOUT ROWID
+        ''')
+
+        # Пользователи корзины - для уникальных пользователей за период
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rollup_users (
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                username TEXT NOT NULL,
+                PRIMARY KEY (granularity, bucket, username)
+            ) WITHOUT ROWID
+        ''')
+
+        # Состояние пользователя между обновлениями: текущий чат и ожидание ответа
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rollup_user_state (
+                username TEXT PRIMARY KEY,
+                chat_id INTEGER,
+                last_timestamp TEXT,
+                waiting_since TEXT
+            )
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rollup_user_state_last ON rollup_user_state(last_timestamp)')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rollup_watermark (
+                name TEXT PRIMARY KEY,
+                last_message_id INTEGER NOT NULL
+            )
+        ''')
+        conn.commit()
+
+def _new_counters():
+    return {
+        "incoming_count": 0, "outgoing_count": 0, "chats_opened": 0,
+        "chats_closed": 0, "response_count": 0, "response_seconds": 0.0
+    }
+
+def _refresh_batch(cursor, batch_size):
+    """Обрабатывает одну пачку новых сообщений, возвращает их количество"""
+    row = cursor.execute("SELECT last_message_id FROM rollup_watermark WHERE name = 'messages'").fetchone()
+    last_id = row[0] if row else 0
+
+    cursor.execute('''
+        SELECT id, username, timestamp, message_type, chat_id
+        FROM messages
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (last_id, batch_size))
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+
+    usernames = {row["username"] for row in rows if row["username"]}
+    states = {}
+    for name in usernames:
+        state = cursor.execute('''
+            SELECT chat_id, last_timestamp, waiting_since FROM rollup_user_state WHERE username = ?
+        ''', (name,)).fetchone()
+        states[name] = dict(state) if state else {"chat_id": None, "last_timestamp": None, "waiting_since": None}
+
+    counters = {}
+    users = set()
+
+    def bump(timestamp, field, value=1):
+        for key in rollup_buckets(timestamp):
+            if key not in counters:
+                counters[key] = _new_counters()
+            counters[key][field] += value
+
+    for row in rows:
+        timestamp = row["timestamp"]
+        is_incoming = row["message_type"] == 'incoming'
+        bump(timestamp, "incoming_count" if is_incoming else "outgoing_count")
+
+        username = row["username"]
+        if not username:
+            continue
+        for granularity, bucket in rollup_buckets(timestamp):
+            users.add((granularity, bucket, username))
+
+        state = states[username]
+        if row["chat_id"] is not None and row["chat_id"] != state["chat_id"]:
+            # Новый чат пользователя закрывает предыдущий в момент его последней активности
+            if state["chat_id"] is not None:
+                bump(state["last_timestamp"], "chats_closed")
+            bump(timestamp, "chats_opened")
+            state["chat_id"] = row["chat_id"]
+            state["waiting_since"] = None
+
+        if is_incoming:
+            if state["waiting_since"] is None:
+                state["waiting_since"] = timestamp
+        elif state["waiting_since"] is not None:
+            waited = datetime.fromisoformat(timestamp) - datetime.fromisoformat(state["waiting_since"])
+            bump(timestamp, "response_count")
+            bump(timestamp, "response_seconds", max(waited.total_seconds(), 0))
+            state["waiting_since"] = None
+        state["last_timestamp"] = timestamp
+
+    cursor.executemany('''
+        INSERT INTO message_rollups (granularity, bucket, incoming_count, outgoing_count,
+                                     chats_opened, chats_closed, response_count, response_seconds)
+        VALUES (:granularity, :bucket, :incoming_count, :outgoing_count,
+                :chats_opened, :chats_closed, :response_count, :response_seconds)
+        ON CONFLICT(granularity, bucket) DO UPDATE SET
+            incoming_count = incoming_count + excluded.incoming_count,
+            outgoing_count = outgoing_count + excluded.outgoing_count,
+            chats_opened = chats_opened + excluded.chats_opened,
+            chats_closed = chats_closed + excluded.chats_closed,
+            response_count = response_count + excluded.response_count,
+            response_seconds = response_seconds + excluded.response_seconds
+    ''', [dict(values, granularity=granularity, bucket=bucket) for (granularity, bucket), values in counters.items()])
+
+    cursor.executemany('INSERT OR IGNORE INTO rollup_users (granularity, bucket, username) VALUES (?, ?, ?)', users)
+    cursor.executemany('''
+        UPDATE message_rollups
+        SET user_count = (SELECT COUNT(*) FROM rollup_users u
+                          WHERE u.granularity = message_rollups.granularity AND u.bucket = message_rollups.bucket)
+        WHERE granularity = ? AND bucket = ?
+    ''', {(granularity, bucket) for granularity, bucket, _ in users})
+
+    cursor.executemany('''
+        INSERT OR REPLACE INTO rollup_user_state (username, chat_id, last_timestamp, waiting_since)
+        VALUES (?, ?, ?, ?)
+    ''', [(name, state["chat_id"], state["last_timestamp"], state["waiting_since"]) for name, state in states.items()])
+
+    cursor.execute('''
+        INSERT INTO rollup_watermark (name, last_message_id) VALUES ('messages', ?)
+        ON CONFLICT(name) DO UPDATE SET last_message_id = excluded.last_message_id
+    ''', (rows[-1]["id"],))
+    return len(rows)
+
+def refresh_analytics(batch_size=ANALYTICS_BATCH_SIZE):
+    """Дочитывает новые сообщения в сводные таблицы, возвращает число обработанных"""
+    processed = 0
+    with _refresh_lock, get_db_connection() as conn:
+        cursor = conn.cursor()
+        # Без новых сообщений транзакция записи не открывается
+        pending = cursor.execute('''
+            SELECT (SELECT MAX(id) FROM messages) >
+                   COALESCE((SELECT last_message_id FROM rollup_watermark WHERE name = 'messages'), 0)
+        ''').fetchone()[0]
+        if not pending:
+            return 0
+        while True:
+            # IMMEDIATE не дает двум процессам обработать одну пачку дважды
+            conn.execute('BEGIN IMMEDIATE')
+            count = _refresh_batch(cursor, batch_size)
+            conn.commit()
+            processed += count
+            if count < batch_size:
+                break
+    return processed
+
+async def refresh_periodically(executor=None, interval=ANALYTICS_REFRESH_SECONDS):
+    """Дочитывает сводки раз в interval секунд в executor (у слушателя - поток-писатель очереди)"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(executor, refresh_analytics)
+        except Exception as e:
+            print(f"Ошибка обновления аналитики: {e}")
+
+def rebuild_analytics():
+    """Полностью пересчитывает сводные таблицы аналитики"""
+    with get_db_connection() as conn:
+        for table in ('message_rollups', 'rollup_users', 'rollup_user_state', 'rollup_watermark'):
+            conn.execute(f'DELETE FROM {table}')
+        conn.commit()
+    processed = refresh_analytics()
+    print(f"Аналитика пересчитана: {processed} сообщений")
+    return processed
+
+def get_analytics(period="today", now=None):
+    """Возвращает итоги и ряд по корзинам за период из сводных таблиц"""
+    span, granularity = ANALYTICS_PERIODS[period]
+    now = now or datetime.now()
+    start = (now - span).isoformat()[:BUCKET_PREFIX[granularity]]
+    end = now.isoformat()[:BUCKET_PREFIX[granularity]]
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT bucket, incoming_count, outgoing_count, user_count, chats_opened, chats_closed,
+                   response_count, response_seconds
+            FROM message_rollups
+            WHERE granularity = ? AND bucket BETWEEN ? AND ?
+            ORDER BY bucket
+        ''', (granularity, start, end))
+        series = [dict(row) for row in cursor.fetchall()]
+
+        # Период всегда заканчивается сейчас, поэтому уникальные пользователи -
+        # это те, чья последняя активность попадает в период
+        cursor.execute('''
+            SELECT COUNT(*) FROM rollup_user_state WHERE last_timestamp >= ?
+        ''', ((now - span).isoformat(),))
+        unique_users = cursor.fetchone()[0]
+
+    totals = _new_counters()
+    for point in series:
+        for field in totals:
+            totals[field] += point[field]
+        point["avg_response_seconds"] = (point["response_seconds"] / point["response_count"]
+                                         if point["response_count"] else None)
+
+    return {
+        "period": period,
+        "granularity": granularity,
+        "incoming_count": totals["incoming_count"],
+        "outgoing_count": totals["outgoing_count"],
+        "total_messages": totals["incoming_count"] + totals["outgoing_count"],
+        "unique_users": unique_users,
+        "chats_opened": totals["chats_opened"],
+        "chats_closed": totals["chats_closed"],
+        "avg_response_seconds": (totals["response_seconds"] / totals["response_count"]
+                                 if totals["response_count"] else None),
+        "series": series
+    }
+
+init_analytics()
\ No newline at end of file
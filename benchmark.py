@@ -0,0 +1,1107 @@
+import os
+import sys
+import time
+import asyncio
+import sqlite3
+import random
+import tracemalloc
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from contextlib import contextmanager, redirect_stdout
+
+# Бенчмарки работают с временной БД, а не с рабочей pulseai.db
+SCRATCH_DIR = tempfile.mkdtemp(prefix="pulseai_bench_")
+os.environ.setdefault("PULSEAI_DB", os.path.join(SCRATCH_DIR, "pulseai.db"))
+os.environ.setdefault("PULSEAI_NOTIFY_SOCKET", os.path.join(SCRATCH_DIR, "notify.sock"))
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import db_handler
+import notifier
+from ingest import IngestQueue
+
+class QueryCounter:
+    """Считает SQL запросы, выполненные через db_handler.get_db_connection"""
+    def __init__(self):
+        self.count = 0
+        self._original = db_handler.get_db_connection
+
+    def _trace(self, statement):
+        if statement.lstrip().upper().startswith("SELECT"):
+            self.count += 1
+
+    def __enter__(self):
+        original = self._original
+
+        @contextmanager
+        def counted_connection():
+            with original() as conn:
+                conn.set_trace_callback(self._trace)
+                try:
+                    yield conn
+                finally:
+                    conn.set_trace_callback(None)
+
+        db_handler.get_db_connection = counted_connection
+        return self
+
+    def __exit__(self, *exc):
+        db_handler.get_db_connection = self._original
+
+class FakeWebSocket:
+    """Заглушка WebSocket, которая только считает полученные сообщения"""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.received = 0
+        self.received_bytes = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+        self.received_bytes += len(text.encode("utf-8"))
+
+def seed_messages(count=2000):
+    """Заполняет временную БД сообщениями текущей смены"""
+    import web_app
+    shift_name = web_app.current_shift_name()
+    for i in range(count):
+        username = f"user_{i % 50}"
+        if i % 2:
+            db_handler.add_outgoing(f"Відповідь {i}", shift_name, username)
+        else:
+            db_handler.add_incoming(f"Повідомлення {i}", shift_name, username)
+
+async def _run_ws_fanout(socket_count, ticks):
+    import web_app
+
+    manager = web_app.ConnectionManager()
+    web_app.manager = manager
+
+    sockets = [FakeWebSocket(delay=1.0 if i == 0 else 0.0) for i in range(socket_count)]
+    senders = []
+    for ws in sockets:
+        await manager.connect(ws)
+        senders.append(asyncio.create_task(manager.sender(ws)))
+
+    # Тик: одно новое сообщение слушателя и проверка статистики, как в snapshot_producer
+    broadcasts = 0
+    with QueryCounter() as counter:
+        started = time.perf_counter()
+        for i in range(ticks):
+            manager.broadcast(web_app.live_state.message({"type": "new_message", "message": f"Повідомлення {i}"}))
+            broadcasts += 1
+            delta = await web_app.refresh_live_state()
+            if delta:
+                manager.broadcast(delta)
+                broadcasts += 1
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - started
+
+    await asyncio.sleep(0.1)
+    for task in senders:
+        task.cancel()
+
+    delivered = sum(ws.received for ws in sockets[1:])
+    return {
+        "sockets": socket_count,
+        "queries_per_tick": counter.count / ticks,
+        "ms_per_tick": elapsed / ticks * 1000,
+        "bytes_per_tick": sockets[-1].received_bytes / ticks,
+        "delivered": delivered,
+        "expected": (socket_count - 1) * broadcasts,
+        "dropped": manager.dropped_messages
+    }
+
+def bench_ws_fanout(socket_counts=(1, 10, 100, 500), ticks=12):
+    """Количество запросов к БД и байт на тик рассылки при росте числа сокетов"""
+    import json
+    # Прежний протокол рассылал полный снимок со всеми закрытыми чатами каждый тик
+    full_snapshot = len(json.dumps({"type": "update", "data": {
+        "chat_stats": db_handler.get_detailed_chat_statistics()}}).encode("utf-8"))
+    print(f"WebSocket рассылка: запросы к БД и байт на тик (полный снимок был бы {full_snapshot} байт)")
+    print(f"{'сокетов':>8} {'запросов/тик':>13} {'мс/тик':>8} {'байт/тик':>9} {'доставлено':>11} {'сброшено':>9}")
+    results = []
+    for socket_count in socket_counts:
+        result = asyncio.run(_run_ws_fanout(socket_count, ticks))
+        results.append(result)
+        print(f"{result['sockets']:>8} {result['queries_per_tick']:>13.1f} {result['ms_per_tick']:>8.2f} "
+              f"{result['bytes_per_tick']:>9.0f} {result['delivered']:>5}/{result['expected']:<5} {result['dropped']:>9}")
+    return results
+
+def _publish_messages(channel, count):
+    notifier.attach_queue(channel)
+    for i in range(count):
+        db_handler.add_incoming(f"Повідомлення {i}", "bench_shift", f"user_{i % 10}")
+        time.sleep(0.005)
+
+def bench_notify_latency(count=200):
+    """Задержка от записи сообщения слушателем до получения веб-процессом"""
+    channel = multiprocessing.Queue()
+    notifier.attach_queue(channel)
+    latencies = []
+    done = threading.Event()
+
+    def on_event(event):
+        stored_at = datetime.fromisoformat(event["timestamp"]).timestamp()
+        latencies.append((time.time() - stored_at) * 1000)
+        if len(latencies) >= count:
+            done.set()
+
+    notifier.subscribe(on_event)
+    producer = multiprocessing.Process(target=_publish_messages, args=(channel, count))
+    producer.start()
+    done.wait(timeout=60)
+    producer.join()
+    channel.put(None)
+    notifier.attach_queue(None)
+
+    latencies.sort()
+    result = {
+        "events": len(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "max_ms": latencies[-1]
+    }
+    print("Уведомления слушатель -> веб: задержка от записи до доставки")
+    print(f"  событий: {result['events']}, p50: {result['p50_ms']:.2f} мс, "
+          f"p99: {result['p99_ms']:.2f} мс, max: {result['max_ms']:.2f} мс")
+    return result
+
+@contextmanager
+def unpooled_connection():
+    """Прежнее поведение: новое соединение без настроек на каждый вызов"""
+    conn = sqlite3.connect(db_handler.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def _ingest(count):
+    started = time.perf_counter()
+    for i in range(count):
+        db_handler.add_incoming(f"Повідомлення {i}", "bench_ingest", f"user_{i % 100}")
+    return count / (time.perf_counter() - started)
+
+def bench_ingest(count=2000):
+    """Сообщений в секунду через add_incoming: без пула и с пулом соединений"""
+    original_path = db_handler.DB_PATH
+    pooled = db_handler.get_db_connection
+
+    db_handler.DB_PATH = os.path.join(SCRATCH_DIR, "ingest_unpooled.db")
+    db_handler.get_db_connection = unpooled_connection
+    with unpooled_connection() as conn:
+        conn.execute("PRAGMA journal_mode = DELETE")
+    db_handler.init_database()
+    before = _ingest(count)
+
+    db_handler.DB_PATH = os.path.join(SCRATCH_DIR, "ingest_pooled.db")
+    db_handler.get_db_connection = pooled
+    db_handler.init_database()
+    after = _ingest(count)
+
+    db_handler.DB_PATH = original_path
+    print("Запись входящих сообщений")
+    print(f"  без пула (rollback journal): {before:8.0f} сообщ/с")
+    print(f"  пул + WAL:                   {after:8.0f} сообщ/с  (x{after / before:.1f})")
+    return {"before_per_sec": before, "after_per_sec": after}
+
+async def _measure_loop_lag(lags, stop):
+    """Записывает, насколько позже положенного просыпается цикл событий"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + 0.001
+        await asyncio.sleep(0.001)
+        lags.append((loop.time() - expected) * 1000)
+
+async def _run_ingest_burst(use_queue, count):
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_measure_loop_lag(lags, stop))
+    ingest = IngestQueue() if use_queue else None
+    if ingest:
+        ingest.start()
+
+    started = time.perf_counter()
+    for i in range(count):
+        if ingest:
+            ingest.put_incoming(f"Повідомлення {i}", "bench_burst", f"user_{i % 100}")
+        else:
+            db_handler.add_incoming(f"Повідомлення {i}", "bench_burst", f"user_{i % 100}")
+        if i % 20 == 0:
+            # Между событиями Telethon цикл получает управление
+            await asyncio.sleep(0)
+    if ingest:
+        await ingest.close()
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await monitor
+    lags.sort()
+    return {
+        "rows_per_sec": count / elapsed,
+        "lag_p99_ms": lags[int(len(lags) * 0.99) - 1] if lags else 0.0,
+        "lag_max_ms": lags[-1] if lags else 0.0
+    }
+
+def bench_ingest_queue(count=5000):
+    """Всплеск входящих: запись из цикла событий против очереди отложенной записи"""
+    direct = asyncio.run(_run_ingest_burst(False, count))
+    queued = asyncio.run(_run_ingest_burst(True, count))
+    print(f"Всплеск из {count} входящих в цикле событий")
+    print(f"{'режим':>14} {'строк/с':>9} {'лаг p99, мс':>12} {'лаг max, мс':>12}")
+    for name, result in (("синхронно", direct), ("очередь", queued)):
+        print(f"{name:>14} {result['rows_per_sec']:>9.0f} {result['lag_p99_ms']:>12.2f} {result['lag_max_ms']:>12.2f}")
+    return {"direct": direct, "queued": queued}
+
+WORDS = ("привіт", "скутер", "не", "їде", "заряд", "батарея", "оплата", "поїздка", "зона", "парковка",
+         "дякую", "допоможіть", "здравствуйте", "самокат", "блокування", "гроші", "повернення", "карта",
+         "помилка", "додаток", "замок", "швидкість", "колесо", "тариф", "підписка", "знижка")
+
+def generate_messages(count, seed=42, start=None):
+    """Генерирует строки messages со случайным украинским текстом"""
+    rng = random.Random(seed)
+    start = start or datetime(2025, 1, 1)
+    for i in range(count):
+        timestamp = start + timedelta(seconds=i * 3)
+        shift_prefix = "day" if 9 <= timestamp.hour < 21 else "night"
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        if rng.random() < 0.1:
+            # Номера самокатов встречаются редко - это самые избирательные запросы
+            text += f" P{rng.randrange(20000)}"
+        yield (
+            f"user_{rng.randrange(5000)}",
+            text,
+            timestamp.isoformat(),
+            "incoming" if rng.random() < 0.6 else "outgoing",
+            f"{shift_prefix}_{timestamp.strftime('%Y-%m-%d')}",
+            rng.randint(1, 20),
+            db_handler.to_epoch_ms(timestamp)
+        )
+
+def fill_database(path, count):
+    """Создает отдельную БД и заполняет ее count сгенерированными сообщениями"""
+    original_path = db_handler.DB_PATH
+    db_handler.DB_PATH = path
+    db_handler.init_database()
+    with db_handler.get_db_connection() as conn:
+        existing = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        if existing < count:
+            user_ids = db_handler.intern_users(conn.cursor(), [f"user_{i}" for i in range(5000)])
+            conn.executemany('''
+                INSERT INTO messages (username, message, timestamp, message_type, shift_name, chat_id,
+                                      timestamp_ms, user_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (row + (user_ids[row[0]],) for row in generate_messages(count - existing, seed=existing)))
+            conn.commit()
+    db_handler.DB_PATH = original_path
+
+def _time_query(run, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+def bench_search(count=1_000_000, queries=("P1234", "P777", "скутер", "батар", "оплата карта", "підписк знижк")):
+    """Поиск: LIKE со сканированием таблицы против FTS5 с bm25"""
+    path = os.path.join(SCRATCH_DIR, f"search_{count}.db")
+    started = time.perf_counter()
+    fill_database(path, count)
+    print(f"Поиск по {count} сообщениям (заполнение {time.perf_counter() - started:.0f} с)")
+
+    original_path = db_handler.DB_PATH
+    db_handler.DB_PATH = path
+    results = []
+
+    def like_search(query):
+        with db_handler.get_db_connection() as conn:
+            conn.execute('''
+                SELECT username, message, timestamp, message_type, shift_name, chat_id
+                FROM messages WHERE message LIKE ? ORDER BY timestamp DESC LIMIT 100
+            ''', (f"%{query}%",)).fetchall()
+
+    print(f"{'запрос':>16} {'LIKE, мс':>10} {'FTS5, мс':>10}")
+    for query in queries:
+        like_ms = _time_query(lambda: like_search(query))
+        fts_ms = _time_query(lambda: db_handler.search_messages(query))
+        results.append({"query": query, "like_ms": like_ms, "fts_ms": fts_ms})
+        print(f"{query:>16} {like_ms:>10.2f} {fts_ms:>10.2f}")
+
+    db_handler.DB_PATH = original_path
+    return results
+
+def bench_export(count=200_000):
+    """Пиковая память экспорта: весь CSV в StringIO против потоковой выдачи"""
+    import web_app
+    path = os.path.join(SCRATCH_DIR, f"export_{count}.db")
+    fill_database(path, count)
+    original_path = db_handler.DB_PATH
+    db_handler.DB_PATH = path
+
+    def buffered():
+        rows = [row for chunk in db_handler.iter_messages(chunk_size=count) for row in chunk]
+        output = "".join(web_app.export_chunks("csv", [rows]))
+        return len(output.encode("utf-8"))
+
+    def streamed():
+        return sum(len(part) for part in web_app.encode_stream(
+            web_app.export_chunks("csv", db_handler.iter_messages()), compress=False))
+
+    print(f"Экспорт {count} сообщений в CSV")
+    results = {}
+    for name, run in (("в памяти", buffered), ("потоком", streamed)):
+        tracemalloc.start()
+        started = time.perf_counter()
+        size = run()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {"bytes": size, "seconds": elapsed, "peak_mb": peak / 1024 / 1024}
+        print(f"  {name:>9}: {size / 1024 / 1024:6.1f} МБ за {elapsed:5.1f} с, пик памяти {peak / 1024 / 1024:7.1f} МБ")
+
+    db_handler.DB_PATH = original_path
+    return results
+
+def bench_filters(keyword_count=5000, count=20_000):
+    """Фильтры: цикл по списку ключевых слов против скомпилированного MessageFilter"""
+    rng = random.Random(7)
+    keywords = list(db_handler.DEFAULT_EXCLUDED_KEYWORDS)
+    while len(keywords) < keyword_count:
+        if rng.random() < 0.1:
+            # Часть правил - номера самокатов, чтобы фильтр реально срабатывал
+            keywords.append(f"P{rng.randrange(20000)}")
+        else:
+            keywords.append(f"{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.randrange(100000)}")
+    users = list(db_handler.DEFAULT_EXCLUDED_USERS)
+    messages = [(username, text) for username, text, *_ in generate_messages(count)]
+
+    def loop_filter(username, message):
+        if username in users:
+            return True
+        for keyword in keywords:
+            if keyword in message:
+                return True
+        return message.startswith(db_handler.EXCLUDED_PREFIXES) or len(message) > db_handler.MAX_MESSAGE_LENGTH
+
+    started = time.perf_counter()
+    compiled = db_handler.MessageFilter(users, keywords)
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    results = {}
+    print(f"Фильтрация {count} сообщений, {len(keywords)} ключевых слов (компиляция {compile_ms:.0f} мс)")
+    for name, run in (("цикл", loop_filter), ("regex", lambda u, m: compiled.match(u, m) is not None)):
+        started = time.perf_counter()
+        excluded = sum(1 for username, message in messages if run(username, message))
+        elapsed = time.perf_counter() - started
+        results[name] = {"excluded": excluded, "us_per_message": elapsed / count * 1e6}
+        print(f"  {name:>6}: {elapsed / count * 1e6:8.1f} мкс/сообщение, отфильтровано {excluded}")
+    return results
+
+def bench_analytics(count=1_000_000):
+    """Аналитика за 90 дней: группировка сырых сообщений против сводных таблиц"""
+    import analytics
+    path = os.path.join(SCRATCH_DIR, f"analytics_{count}.db")
+    fill_database(path, count)
+    original_path = db_handler.DB_PATH
+    db_handler.DB_PATH = path
+    analytics.init_analytics()
+
+    started = time.perf_counter()
+    processed = analytics.refresh_analytics()
+    elapsed = time.perf_counter() - started
+    print(f"Аналитика по {count} сообщениям: первичный расчет {processed / elapsed:.0f} сообщений/с")
+
+    with db_handler.get_db_connection() as conn:
+        last = datetime.fromisoformat(conn.execute("SELECT MAX(timestamp) FROM messages").fetchone()[0])
+    since = (last - timedelta(days=90)).isoformat()
+
+    def raw_scan():
+        with db_handler.get_db_connection() as conn:
+            conn.execute('''
+                SELECT substr(timestamp, 1, 10) AS bucket,
+                       SUM(message_type = 'incoming'), SUM(message_type = 'outgoing'),
+                       COUNT(DISTINCT username)
+                FROM messages WHERE timestamp >= ? GROUP BY bucket
+            ''', (since,)).fetchall()
+
+    raw_ms = _time_query(raw_scan)
+    rollup_ms = _time_query(lambda: analytics.get_analytics("quarter", now=last))
+    print(f"  90 дней: messages {raw_ms:.1f} мс, сводные таблицы {rollup_ms:.2f} мс")
+
+    db_handler.DB_PATH = original_path
+    return {"refresh_per_second": processed / elapsed, "raw_ms": raw_ms, "rollup_ms": rollup_ms}
+
+def _writer_latency(stop, latencies, errors):
+    """Пишет по сообщению каждые 10 мс и замеряет, сколько ждет каждая запись"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            db_handler.store_messages([('incoming', "пульс", "bench", "writer", datetime.now())])
+        except sqlite3.OperationalError:
+            # busy_timeout истек - слушатель потерял бы эту пачку
+            errors.append(1)
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.01)
+    db_handler.close_db_connection()
+
+def bench_retention(count=200_000):
+    """Очистка: один DELETE против переноса в архив пачками, задержка параллельной записи"""
+    import shutil
+    source = os.path.join(SCRATCH_DIR, f"retention_{count}.db")
+    fill_database(source, count)
+    original_path = db_handler.DB_PATH
+    results = {}
+
+    def single_delete():
+        with db_handler.get_db_connection() as conn:
+            conn.execute('DELETE FROM messages WHERE timestamp_ms < ?',
+                         (db_handler.to_epoch_ms(datetime.now() - timedelta(days=30)),))
+            conn.commit()
+
+    def batched():
+        db_handler.cleanup_old_messages(30)
+
+    print(f"Очистка {count} устаревших сообщений при параллельной записи")
+    for name, run in (("один DELETE", single_delete), ("пачками", batched)):
+        path = os.path.join(SCRATCH_DIR, f"retention_{name.replace(' ', '_')}.db")
+        shutil.copy(source, path)
+        db_handler.DB_PATH = path
+        db_handler.reset_session_tracker()
+
+        stop = threading.Event()
+        latencies = []
+        errors = []
+        writer = threading.Thread(target=_writer_latency, args=(stop, latencies, errors))
+        writer.start()
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        writer.join()
+
+        latencies.sort()
+        results[name] = {
+            "seconds": elapsed,
+            "writes": len(latencies),
+            "failed_writes": len(errors),
+            "write_p99_ms": latencies[int(len(latencies) * 0.99)] if latencies else None,
+            "write_max_ms": latencies[-1] if latencies else None,
+            "file_mb": os.path.getsize(path) / 1024 / 1024
+        }
+        print(f"  {name:>12}: {elapsed:5.1f} с, записей {len(latencies)} (ошибок {len(errors)}), "
+              f"p99 {results[name]['write_p99_ms']:.1f} мс, max {results[name]['write_max_ms']:.1f} мс, "
+              f"файл {results[name]['file_mb']:.1f} МБ")
+
+    db_handler.DB_PATH = original_path
+    db_handler.reset_session_tracker()
+    return results
+
+def _write_shift_files(directory, count):
+    """Раскладывает сгенерированные сообщения по JSON файлам смен в формате Learning"""
+    import json
+    os.makedirs(directory, exist_ok=True)
+    shifts = {}
+    for username, text, timestamp, message_type, shift_name, chat_id, _ in generate_messages(count):
+        shifts.setdefault(shift_name, {"incoming": [], "outgoing": []})[message_type].append(
+            {"username": username, "message": text, "timestamp": timestamp, "chat_id": chat_id})
+    for shift_name, data in shifts.items():
+        with open(os.path.join(directory, f"{shift_name}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+    return len(shifts)
+
+def bench_migrate(count=100_000):
+    """Импорт JSON смен: add_message на каждую строку против пакетного импорта"""
+    import migrate_to_sqlite
+    directory = os.path.join(SCRATCH_DIR, "Learning")
+    files = _write_shift_files(directory, count)
+    original_path = db_handler.DB_PATH
+    results = {}
+
+    def per_row():
+        for filename in sorted(os.listdir(directory)):
+            _, _, rows = migrate_to_sqlite.read_shift_file(os.path.join(directory, filename))
+            for username, message, _, message_type, shift_name, chat_id, _, _ in rows:
+                db_handler.add_message(message, shift_name, username, message_type, chat_id)
+
+    print(f"Импорт {count} сообщений из {files} файлов смен")
+    for name, run in (("построчно", per_row),
+                      ("пакетно", lambda: migrate_to_sqlite.migrate_json_to_sqlite(directory)),
+                      ("повторно", lambda: migrate_to_sqlite.migrate_json_to_sqlite(directory))):
+        db_handler.DB_PATH = os.path.join(SCRATCH_DIR, "migrate_per_row.db" if name == "построчно" else "migrate.db")
+        db_handler.init_database()
+        db_handler.reset_user_ids()
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        results[name] = count / elapsed
+        print(f"  {name:>10}: {elapsed:6.1f} с, {count / elapsed:8.0f} строк/с")
+
+    db_handler.DB_PATH = original_path
+    db_handler.reset_user_ids()
+    return results
+
+# Набор замеров на синтетическом трафике слушателя
+SUITE_SIZES = (10_000, 1_000_000, 10_000_000)
+SUITE_SPAN = timedelta(days=30)
+SUITE_REQUESTS = 50
+SUITE_RESULTS_DIR = "benchmark_results"
+SPAM_MESSAGES = (
+    "✉️ PULSE <admin@rideatom.com>\nSubaccount: Cherkasy (ID: 1932). PULSE Vehicle number P{n} moving!",
+    "Alert! Subaccount: Cherkasy (ID: 1932). Vehicle P{n} located in no-go zone!",
+    "Група ворожих БпЛА курсом на Черкаси",
+)
+
+def _shift_name(timestamp):
+    return ("day_" if 9 <= timestamp.hour < 21 else "night_") + timestamp.strftime("%Y-%m-%d")
+
+def _support_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12))).capitalize()
+
+def generate_traffic(count, seed=7, end=None):
+    """События слушателя для store_messages: чаты поддержки, спам PULSE и прощания операторов.
+
+    Время идет с равным шагом и заканчивается в end (по умолчанию сейчас),
+    поэтому текущая смена всегда заполнена. Отфильтрованный спам и закрытия
+    чатов не становятся строками, их доля около 15%.
+    """
+    rng = random.Random(seed)
+    step = min(3.0, SUITE_SPAN.total_seconds() / count)
+    timestamp = (end or datetime.now()) - timedelta(seconds=step * count)
+    users = max(50, count // 40)
+    waiting = {}
+    open_chats = []
+    for _ in range(count):
+        timestamp += timedelta(seconds=step)
+        shift = _shift_name(timestamp)
+        roll = rng.random()
+        if roll < 0.12:
+            text = rng.choice(SPAM_MESSAGES).format(n=rng.randrange(1000))
+            yield ('incoming', text, shift, rng.choice(("GmailBot", "pulse_alerts")), timestamp)
+        elif open_chats and roll < 0.7:
+            index = rng.randrange(len(open_chats))
+            username = open_chats[index]
+            if waiting[username] and rng.random() < 0.3:
+                # Оператор прощается - слушатель закрывает чат
+                yield ('outgoing', rng.choice(db_handler.GREETINGS), shift, username, timestamp)
+                yield ('close', None, None, username, timestamp)
+                open_chats[index] = open_chats[-1]
+                open_chats.pop()
+                del waiting[username]
+            elif waiting[username]:
+                yield ('outgoing', _support_text(rng), shift, username, timestamp)
+                waiting[username] = rng.random() < 0.5
+            else:
+                yield ('incoming', _support_text(rng), shift, username, timestamp)
+                waiting[username] = True
+        else:
+            username = f"user_{rng.randrange(users)}"
+            if username not in waiting:
+                open_chats.append(username)
+            waiting[username] = True
+            yield ('incoming', _support_text(rng), shift, username, timestamp)
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"p50_ms": None, "p99_ms": None}
+    return {
+        "p50_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    }
+
+def _fill_with_traffic(count):
+    """Пишет трафик пачками слушателя через store_messages, замеряет каждую пачку"""
+    from ingest import INGEST_BATCH_SIZE
+    latencies = []
+    started = time.perf_counter()
+    batch = []
+    # Слушатель печатает каждое отфильтрованное сообщение - здесь это только шум
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        for item in generate_traffic(count):
+            batch.append(item)
+            if len(batch) >= INGEST_BATCH_SIZE:
+                batch_started = time.perf_counter()
+                db_handler.store_messages(batch)
+                latencies.append((time.perf_counter() - batch_started) * 1000)
+                batch = []
+        if batch:
+            db_handler.store_messages(batch)
+    elapsed = time.perf_counter() - started
+    with db_handler.get_db_connection() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    return dict({"events": count, "rows": rows, "seconds": elapsed, "events_per_sec": count / elapsed},
+                **{f"batch_{key}": value for key, value in _percentiles(latencies).items()})
+
+def _time_requests(client, urls, repeat):
+    latencies = []
+    started = time.perf_counter()
+    for i in range(repeat):
+        request_started = time.perf_counter()
+        response = client.get(urls[i % len(urls)])
+        response.read()
+        latencies.append((time.perf_counter() - request_started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{urls[i % len(urls)]}: HTTP {response.status_code}")
+    return dict({"requests": repeat, "requests_per_sec": repeat / (time.perf_counter() - started)},
+                **_percentiles(latencies))
+
+def _time_websocket(client, repeat):
+    """Задержка от записи сообщения до его получения клиентом /ws"""
+    latencies = []
+    with client.websocket_connect("/ws") as websocket:
+        for i in range(repeat):
+            text = f"Перевірка зв'язку {i}"
+            started = time.perf_counter()
+            db_handler.store_messages([('incoming', text, _shift_name(datetime.now()), "bench_ws", datetime.now())])
+            while True:
+                event = websocket.receive_json()
+                if event.get("type") == "new_message" and event.get("message") == text:
+                    break
+            latencies.append((time.perf_counter() - started) * 1000)
+    return dict({"messages": repeat}, **_percentiles(latencies))
+
+def _release_notify_socket():
+    """После TestClient читатель уведомлений привязан к закрытому циклу - следующие записи не должны до него доходить"""
+    path = f"{notifier.NOTIFY_SOCKET_PATH}.{os.getpid()}"
+    if os.path.exists(path):
+        os.remove(path)
+
+def _bench_endpoints(repeat):
+    """Гоняет основные эндпоинты через TestClient с входом администратора"""
+    from fastapi.testclient import TestClient
+    import web_app
+
+    with db_handler.get_db_connection() as conn:
+        usernames = [row[0] for row in conn.execute(
+            "SELECT username FROM users WHERE username LIKE 'user_%' LIMIT 20")]
+
+    with TestClient(web_app.app) as client:
+        response = client.post("/login", data={"username": "admin", "password": web_app.USERS["admin"]["password"]},
+                               follow_redirects=False)
+        client.cookies.set("session_token", response.cookies["session_token"])
+        endpoints = {
+            "/api/stats": _time_requests(client, ["/api/stats"], repeat),
+            "/search": _time_requests(client, [f"/search?q={word}" for word in ("скутер", "оплата карта", "батар")],
+                                      repeat),
+            "/chat/{username}": _time_requests(client, [f"/chat/{name}" for name in usernames], repeat),
+            "/export/csv": _time_requests(client, ["/export/csv"], max(3, repeat // 10)),
+            "/ws": _time_websocket(client, repeat),
+        }
+    _release_notify_socket()
+    return endpoints
+
+def _print_suite_comparison(results, previous_path):
+    """Печатает изменение p50 эндпоинтов относительно прошлого запуска"""
+    import json
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"Сравнение с {previous_path} (p50, мс):")
+    for size, stage in results["sizes"].items():
+        before_stage = previous.get("sizes", {}).get(size)
+        if not before_stage:
+            continue
+        for endpoint, metrics in stage["endpoints"].items():
+            before = before_stage["endpoints"].get(endpoint, {}).get("p50_ms")
+            if before and metrics["p50_ms"]:
+                print(f"  {size:>9} {endpoint:<18} {before:9.2f} -> {metrics['p50_ms']:9.2f} "
+                      f"({(metrics['p50_ms'] / before - 1) * 100:+.0f}%)")
+
+def bench_suite(sizes=SUITE_SIZES, repeat=SUITE_REQUESTS):
+    """Синтетический трафик слушателя в БД 10k/1M/10M строк, замер записи и эндпоинтов, итог в JSON"""
+    import json
+    original_path = db_handler.DB_PATH
+    results = {"started_at": datetime.now().isoformat(), "sizes": {}}
+    print(f"{'строк':>10} {'эндпоинт':<18} {'в секунду':>10} {'p50, мс':>9} {'p99, мс':>9}")
+
+    for size in sizes:
+        db_handler.DB_PATH = os.path.join(SCRATCH_DIR, f"suite_{size}.db")
+        db_handler.init_database()
+        db_handler.reset_session_tracker()
+        db_handler.reset_user_ids()
+
+        ingest = _fill_with_traffic(size)
+        endpoints = _bench_endpoints(repeat)
+        results["sizes"][str(size)] = {"ingest": ingest, "endpoints": endpoints}
+
+        print(f"{size:>10} {'запись (пачки)':<18} {ingest['events_per_sec']:>10.0f} "
+              f"{ingest['batch_p50_ms']:>9.2f} {ingest['batch_p99_ms']:>9.2f}")
+        for endpoint, metrics in endpoints.items():
+            rate = f"{metrics['requests_per_sec']:.1f}" if "requests_per_sec" in metrics else "-"
+            print(f"{'':>10} {endpoint:<18} {rate:>10} "
+                  f"{metrics['p50_ms']:>9.2f} {metrics['p99_ms']:>9.2f}")
+
+    db_handler.DB_PATH = original_path
+    db_handler.reset_session_tracker()
+    db_handler.reset_user_ids()
+
+    os.makedirs(SUITE_RESULTS_DIR, exist_ok=True)
+    previous = sorted(name for name in os.listdir(SUITE_RESULTS_DIR) if name.endswith(".json"))
+    path = os.path.join(SUITE_RESULTS_DIR, f"suite_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {path}")
+    if previous:
+        _print_suite_comparison(results, os.path.join(SUITE_RESULTS_DIR, previous[-1]))
+    return results
+
+def bench_dashboard(shift_sizes=(1_000, 10_000, 100_000), repeat=20):
+    """Время отрисовки дашборда без кэша при росте числа сообщений текущей смены"""
+    from fastapi.testclient import TestClient
+    import web_app
+    original_path = db_handler.DB_PATH
+    results = {}
+    print("Отрисовка / без кэша чтения")
+    for size in shift_sizes:
+        db_handler.DB_PATH = os.path.join(SCRATCH_DIR, f"dashboard_{size}.db")
+        db_handler.init_database()
+        db_handler.reset_session_tracker()
+        db_handler.reset_user_ids()
+        shift = _shift_name(datetime.now())
+        now = datetime.now()
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            db_handler.store_messages([('incoming' if i % 2 else 'outgoing', f"Повідомлення {i}", shift,
+                                        f"user_{i % 500}", now - timedelta(milliseconds=size - i))
+                                       for i in range(size)])
+
+        with TestClient(web_app.app) as client:
+            response = client.post("/login", data={"username": "admin",
+                                                   "password": web_app.USERS["admin"]["password"]},
+                                   follow_redirects=False)
+            client.cookies.set("session_token", response.cookies["session_token"])
+            latencies = []
+            for _ in range(repeat):
+                web_app.response_cache.clear()
+                started = time.perf_counter()
+                client.get("/").read()
+                latencies.append((time.perf_counter() - started) * 1000)
+        _release_notify_socket()
+        results[size] = _percentiles(latencies)
+        print(f"  {size:>8} сообщений смены: p50 {results[size]['p50_ms']:6.2f} мс, p99 {results[size]['p99_ms']:6.2f} мс")
+
+    db_handler.DB_PATH = original_path
+    db_handler.reset_session_tracker()
+    db_handler.reset_user_ids()
+    return results
+
+LOAD_SEARCH_CLIENTS = 8
+LOAD_HEALTH_PROBES = 200
+LOAD_PROBE_INTERVAL = 0.005
+
+async def _inline_db(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+def _serve_web(port, workers):
+    """Веб-сервер в отдельном процессе с пулом БД из workers потоков; 0 - запросы прямо в цикле событий, как раньше"""
+    import uvicorn
+    import web_app
+    from concurrent.futures import ThreadPoolExecutor
+    if workers:
+        web_app.DB_EXECUTOR_WORKERS = workers
+        web_app.db_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pulseai-db")
+    else:
+        web_app.run_db = _inline_db
+    uvicorn.run(web_app.app, host="127.0.0.1", port=port, log_level="warning")
+
+async def _probe_health(client, probes):
+    """Задержка /health от момента, когда запрос должен был уйти"""
+    latencies = []
+    for _ in range(probes):
+        await asyncio.sleep(LOAD_PROBE_INTERVAL)
+        started = time.perf_counter()
+        response = await client.get("/health")
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"/health: HTTP {response.status_code}")
+    return _percentiles(latencies)
+
+async def _hammer_search(client, stop, counter):
+    words = ("скутер", "оплата карта", "батар", "не їде", "зона парковка")
+    while not stop.is_set():
+        await client.get("/search", params={"q": words[counter[0] % len(words)]})
+        counter[0] += 1
+
+async def _run_load(base_url, clients, probes):
+    import httpx
+    import web_app
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        for _ in range(100):
+            try:
+                await client.get("/health")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        response = await client.post("/login", data={"username": "admin",
+                                                     "password": web_app.USERS["admin"]["password"]})
+        client.cookies.set("session_token", response.cookies["session_token"])
+        idle = await _probe_health(client, probes)
+        stop = asyncio.Event()
+        counter = [0]
+        hammers = [asyncio.create_task(_hammer_search(client, stop, counter)) for _ in range(clients)]
+        started = time.perf_counter()
+        loaded = await _probe_health(client, probes)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*hammers)
+    return {"idle": idle, "loaded": loaded, "searches_per_sec": counter[0] / elapsed}
+
+def bench_db_executor(count=200_000, clients=LOAD_SEARCH_CLIENTS, probes=LOAD_HEALTH_PROBES,
+                      worker_counts=(1, 4, 0)):
+    """p99 /health, пока clients клиентов непрерывно гоняют /search, при разном размере пула БД (0 - без пула)"""
+    import socket
+    original_path = db_handler.DB_PATH
+    db_handler.DB_PATH = os.path.join(SCRATCH_DIR, f"load_{count}.db")
+    db_handler.init_database()
+    db_handler.reset_session_tracker()
+    db_handler.reset_user_ids()
+    _fill_with_traffic(count)
+    db_handler.close_db_connection()
+
+    print(f"/health под нагрузкой {clients} клиентов /search, {count} строк")
+    results = {}
+    for workers in worker_counts:
+        mode = f"пул БД {workers}" if workers else "в цикле событий"
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = multiprocessing.Process(target=_serve_web, args=(port, workers))
+        server.start()
+        try:
+            results[mode] = result = asyncio.run(_run_load(f"http://127.0.0.1:{port}", clients, probes))
+        finally:
+            server.terminate()
+            server.join()
+        print(f"  {mode:<16} без нагрузки p99 {result['idle']['p99_ms']:7.2f} мс, "
+              f"под нагрузкой p50 {result['loaded']['p50_ms']:7.2f} мс, p99 {result['loaded']['p99_ms']:7.2f} мс, "
+              f"поиск {result['searches_per_sec']:.0f} запросов/с")
+
+    db_handler.DB_PATH = original_path
+    db_handler.reset_session_tracker()
+    db_handler.reset_user_ids()
+    return results
+
+class FakePeer:
+    """Сущность Telegram для бенчмарка кэша имен"""
+    def __init__(self, peer_id):
+        self.id = peer_id
+        self.username = f"client_{peer_id}"
+        self.first_name = None
+
+async def _resolve_burst(peers, events, delay):
+    """Обрабатывает пачку событий (peer id) одновременно, как обработчики Telethon"""
+    lookups = [0]
+
+    def fetcher(peer_id):
+        async def fetch():
+            lookups[0] += 1
+            await asyncio.sleep(delay)
+            return FakePeer(peer_id)
+        return fetch
+
+    async def handle(peer_id):
+        if peers is None:
+            return (await fetcher(peer_id)()).username
+        return await peers.resolve(peer_id, None, fetcher(peer_id))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle(peer_id) for peer_id in events))
+    return lookups[0], time.perf_counter() - started
+
+def bench_peer_cache(messages=5000, peer_count=50, delay=0.02):
+    """Запросы сущностей Telegram на пачку сообщений без кэша, с кэшем и после перезапуска"""
+    from peer_cache import PeerCache
+    rng = random.Random(5)
+    events = [rng.randrange(peer_count) for _ in range(messages)]
+    peers = PeerCache()
+    print(f"Имена собеседников: {messages} сообщений от {peer_count} клиентов, запрос сущности {delay * 1000:.0f} мс")
+    for label, cache in (("без кэша", None), ("с кэшем", peers), ("повторно", peers)):
+        lookups, elapsed = asyncio.run(_resolve_burst(cache, events, delay))
+        print(f"  {label:<18} запросов {lookups:>6}, {elapsed * 1000:8.1f} мс")
+    peers.flush()
+    restarted = PeerCache()
+    loaded = restarted.load()
+    lookups, elapsed = asyncio.run(_resolve_burst(restarted, events, delay))
+    print(f"  {'после перезапуска':<18} запросов {lookups:>6}, {elapsed * 1000:8.1f} мс (загружено {loaded})")
+
+class FakeMessage:
+    """Сообщение Telegram для заглушки клиента"""
+    def __init__(self, message_id, peer, out, date, text):
+        self.id = message_id
+        self.out = out
+        self.date = date
+        self.message = text
+        self.sender = None if out else peer
+        self.sender_id = peer.id
+        self.action = None
+        self._peer = peer
+
+    async def get_sender(self):
+        return self._peer
+
+class FakeDialog:
+    def __init__(self, peer, messages):
+        self.id = peer.id
+        self.entity = peer
+        self.messages = messages
+
+    @property
+    def message(self):
+        return self.messages[-1] if self.messages else None
+
+    @property
+    def date(self):
+        return self.message.date
+
+class FakeTelegramClient:
+    """Заглушка TelegramClient для catchup: диалоги в памяти и задержка на каждую страницу ответа"""
+    PAGE_SIZE = 100
+
+    def __init__(self, dialogs, delay=0.02):
+        self.dialogs = dialogs
+        self.delay = delay
+        self.requests = 0
+
+    async def iter_dialogs(self):
+        for dialog in self.dialogs:
+            yield dialog
+
+    async def iter_messages(self, entity, min_id=None, offset_date=None, reverse=False, limit=None):
+        dialog = next(dialog for dialog in self.dialogs if dialog.entity is entity)
+        messages = [message for message in dialog.messages
+                    if (min_id is None or message.id > min_id) and (offset_date is None or message.date > offset_date)]
+        for start in range(0, min(len(messages), limit or len(messages)), self.PAGE_SIZE):
+            self.requests += 1
+            await asyncio.sleep(self.delay)
+            for message in messages[start:start + self.PAGE_SIZE]:
+                yield message
+
+def _fake_dialogs(dialog_count, per_dialog, end):
+    """Диалоги поддержки: в каждом per_dialog сообщений, через одно входящее и исходящее"""
+    from datetime import timezone
+    rng = random.Random(11)
+    dialogs = []
+    message_id = 0
+    for peer_id in range(1, dialog_count + 1):
+        peer = FakePeer(peer_id)
+        messages = []
+        for i in range(per_dialog):
+            message_id += 1
+            date = (end - timedelta(seconds=(per_dialog - i) * 30)).astimezone(timezone.utc)
+            messages.append(FakeMessage(message_id, peer, i % 2 == 1, date, _support_text(rng)))
+        dialogs.append(FakeDialog(peer, messages))
+    return dialogs
+
+def bench_catchup(dialog_count=200, per_dialog=300, missed=100, concurrencies=(1, 4, 16), delay=0.1):
+    """Догрузка пропущенного после перезапуска: время при разном числе параллельных диалогов и повторный запуск"""
+    original_path = db_handler.DB_PATH
+    dialogs = _fake_dialogs(dialog_count, per_dialog, datetime.now())
+
+    print(f"Догрузка: {dialog_count} диалогов, пропущено по {missed} сообщений, "
+          f"страница {FakeTelegramClient.PAGE_SIZE} за {delay * 1000:.0f} мс")
+    for concurrency in concurrencies:
+        db_handler.DB_PATH = os.path.join(SCRATCH_DIR, f"catchup_{concurrency}.db")
+        db_handler.init_database()
+        db_handler.reset_session_tracker()
+        db_handler.reset_user_ids()
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            # До остановки слушатель успел сохранить все, кроме последних missed сообщений каждого диалога
+            db_handler.store_messages([
+                item
+                for dialog in dialogs
+                for message in dialog.messages[:-missed]
+                for item in _live_items(message, dialog)
+            ])
+            client = FakeTelegramClient(dialogs, delay)
+            started = time.perf_counter()
+            fetched, stored = asyncio.run(_run_catchup(client, concurrency))
+            elapsed = time.perf_counter() - started
+            # Повторный запуск ничего не догружает, а живые дубли уже сохраненного отбрасываются
+            _, repeated = asyncio.run(_run_catchup(client, concurrency))
+            duplicates = db_handler.store_messages(_live_items(dialogs[0].messages[-1], dialogs[0]))
+        print(f"  параллельно {concurrency:>3}: {fetched} диалогов, сохранено {stored} за {elapsed:.2f} с "
+              f"({client.requests} запросов), повторно {repeated}, дубль вживую {duplicates}")
+
+    db_handler.DB_PATH = original_path
+    db_handler.reset_session_tracker()
+    db_handler.reset_user_ids()
+
+    for tz in ("UTC", "Europe/Kyiv", "America/New_York"):
+        _catchup_new_dialog(tz, missed, delay)
+
+def _catchup_new_dialog(tz, missed, delay):
+    """Диалог, которого нет в dialog_state, догружается от самого нового сообщения в БД при любом поясе"""
+    original_path = db_handler.DB_PATH
+    original_tz = os.environ.get("TZ")
+    os.environ["TZ"] = tz
+    time.tzset()
+    try:
+        db_handler.DB_PATH = os.path.join(SCRATCH_DIR, f"catchup_tz_{tz.replace('/', '_')}.db")
+        db_handler.init_database()
+        db_handler.reset_session_tracker()
+        db_handler.reset_user_ids()
+        dialogs = _fake_dialogs(2, missed * 3, datetime.now().replace(microsecond=0))
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            # Второго диалога в БД нет совсем, его сообщения новее сохраненных - только последние missed
+            db_handler.store_messages([
+                item for message in dialogs[0].messages[:-missed] for item in _live_items(message, dialogs[0])
+            ])
+            client = FakeTelegramClient(dialogs, delay)
+            fetched, stored = asyncio.run(_run_catchup(client, 4))
+        print(f"  пояс {tz}: {fetched} диалогов, сохранено {stored} из {2 * missed}")
+    finally:
+        if original_tz is None:
+            os.environ.pop("TZ", None)
+        else:
+            os.environ["TZ"] = original_tz
+        time.tzset()
+        db_handler.DB_PATH = original_path
+        db_handler.reset_session_tracker()
+        db_handler.reset_user_ids()
+
+async def _run_catchup(client, concurrency):
+    """Догрузка с записью через поток-писатель IngestQueue, как в слушателе"""
+    from catchup import catch_up
+    from peer_cache import PeerCache
+    ingest = IngestQueue()
+    try:
+        return await catch_up(client, PeerCache(), ingest.write, concurrency)
+    finally:
+        ingest.executor.shutdown(wait=True)
+
+def _live_items(message, dialog):
+    from catchup import message_items
+    return message_items(message, dialog.id, dialog.entity.username)
+
+BENCHMARKS = {
+    "ws": bench_ws_fanout,
+    "notify": bench_notify_latency,
+    "ingest": bench_ingest,
+    "burst": bench_ingest_queue,
+    "search": bench_search,
+    "export": bench_export,
+    "filters": bench_filters,
+    "analytics": bench_analytics,
+    "retention": bench_retention,
+    "migrate": bench_migrate,
+    "suite": bench_suite,
+    "dashboard": bench_dashboard,
+    "load": bench_db_executor,
+    "peers": bench_peer_cache,
+    "catchup": bench_catchup,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    print(f"Временная БД: {db_handler.DB_PATH}")
+    seed_messages()
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Неизвестный бенчмарк: {name}. Доступны: {', '.join(BENCHMARKS)}")
+            continue
+        BENCHMARKS[name]()
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import timezone
+
+import db_handler
+from ingest import get_shift_name
+
+# Догрузка сообщений, пропущенных, пока слушатель был остановлен. Для
+# каждого диалога в dialog_state хранится последний сохраненный id сообщения
+# Telegram; все более новые сообщения запрашиваются, но одновременно не
+# больше чем из CATCHUP_CONCURRENCY диалогов. Диалоги, которых еще нет в
+# dialog_state, догружаются начиная со времени самого нового сообщения в БД.
+# Сообщения проходят те же фильтры в store_messages, а уже сохраненные
+# (например, пришедшие вживую во время догрузки) отбрасываются по ключу
+# (peer_id, tg_message_id).
+#
+# Сообщения запрашиваются страницами по CATCHUP_MAX_MESSAGES, пока диалог не
+# будет догружен целиком: иначе живые сообщения сдвинули бы dialog_state за
+# недогруженный промежуток.
+#
+# От клиента нужны только iter_dialogs() и iter_messages(entity, min_id=,
+# offset_date=, reverse=True, limit=), поэтому вместо TelegramClient можно
+# передать заглушку с теми же методами.
+CATCHUP_CONCURRENCY = 4
+CATCHUP_MAX_MESSAGES = 1000
+CATCHUP_BATCH_SIZE = 500
+
+def message_items(message, peer_id, username):
+    """Элементы для store_messages из сообщения Telegram, как у живых обработчиков"""
+    # Telethon отдает время в UTC, живые обработчики пишут местное время
+    timestamp = message.date.astimezone().replace(tzinfo=None)
+    text = message.message or ""
+    kind = 'outgoing' if message.out else 'incoming'
+    items = [(kind, text, get_shift_name(timestamp), username, timestamp, peer_id, message.id)]
+    if message.out and db_handler.is_greeting_message(text):
+        items.append(('close', None, None, username, timestamp))
+    return items
+
+async def fetch_dialog(client, dialog, peers, min_id=None, since=None, limit=CATCHUP_MAX_MESSAGES):
+    """Все сообщения диалога новее min_id (или since) от старых к новым в виде элементов store_messages"""
+    items = []
+    pages = 0
+    while True:
+        if min_id:
+            messages = client.iter_messages(dialog.entity, min_id=min_id, reverse=True, limit=limit)
+        else:
+            messages = client.iter_messages(dialog.entity, offset_date=since, reverse=True, limit=limit)
+        pages += 1
+        count = 0
+        async for message in messages:
+            count += 1
+            min_id = message.id
+            # Служебные сообщения (вход в группу, закрепление) живые обработчики тоже не видят как текст
+            if getattr(message, 'action', None):
+                continue
+            if message.out:
+                username = await peers.resolve(dialog.id, dialog.entity, None)
+            else:
+                username = await peers.resolve(message.sender_id, message.sender, message.get_sender)
+            items.extend(message_items(message, dialog.id, username))
+        if count < limit:
+            break
+    if pages > 1:
+        print(f"Диалог {dialog.id}: догружено {len(items)} элементов за {pages} страниц")
+    return items
+
+async def catch_up(client, peers, write, concurrency=CATCHUP_CONCURRENCY, batch_size=CATCHUP_BATCH_SIZE):
+    """Догружает пропущенное во всех диалогах; write(items) - корутина записи пачки.
+
+    Возвращает (число догруженных диалогов, число сохраненных сообщений).
+    """
+    loop = asyncio.get_running_loop()
+    last_ids, newest = await loop.run_in_executor(None, db_handler.get_catchup_state)
+    # Самое новое сообщение в БД - граница для диалогов, которых еще нет в dialog_state;
+    # в БД местное время, Telethon сравнивает offset_date в UTC
+    since = newest.astimezone(timezone.utc) if newest else None
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(dialog, min_id):
+        async with semaphore:
+            try:
+                return await fetch_dialog(client, dialog, peers, min_id, since)
+            except Exception as e:
+                print(f"Ошибка догрузки диалога {dialog.id}: {e}")
+                return []
+
+    tasks = []
+    async for dialog in client.iter_dialogs():
+        if dialog.message is None:
+            continue
+        last_id = last_ids.get(dialog.id)
+        if last_id is not None:
+            if dialog.message.id <= last_id:
+                continue
+        elif since is None or dialog.date <= since:
+            # Первый запуск на пустой БД историю не переносит
+            continue
+        tasks.append(asyncio.ensure_future(fetch(dialog, last_id)))
+
+    stored = 0
+    # Пишет один писатель по мере готовности диалогов: порядок внутри диалога сохраняется
+    for task in asyncio.as_completed(tasks):
+        items = await task
+        for start in range(0, len(items), batch_size):
+            stored += await write(items[start:start + batch_size])
+    return len(tasks), stored
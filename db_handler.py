@@ -1,14 +1,47 @@
 import sqlite3
 import os
+import threading
+import time
+import calendar
 from datetime import datetime, timedelta
 from contextlib import contextmanager
+from collections import Counter
 import json
+import re
+import hashlib
+import notifier
+import metrics
 
-DB_PATH = "pulseai.db"
+DB_PATH = os.environ.get("PULSEAI_DB", "pulseai.db")
 CHAT_TIMEOUT_MINUTES = 5
 
+# Настройки соединений: WAL позволяет читать дашборду, пока слушатель пишет
+# auto_vacuum идет первым: после включения WAL режим новой БД уже не поменять,
+# а существующую БД переводит enable_incremental_vacuum
+DB_PRAGMAS = (
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000"
+)
+DB_CACHED_STATEMENTS = 256
+
+# Версия схемы в PRAGMA user_version, миграции в _migrate_schema
+SCHEMA_VERSION = 3
+
+# Миллисекунды из ISO строки 'YYYY-MM-DDTHH:MM:SS.ffffff' - как to_epoch_ms
+_EPOCH_MS_SQL = "CAST(strftime('%s', {column}) AS INTEGER) * 1000 + CAST(substr({column}, 21, 3) AS INTEGER)"
+
 # Фильтры
-EXCLUDED_USERS = [
+FILTERS_CONFIG_PATH = "filters_config.json"
+FILTERS_RELOAD_SECONDS = 2.0
+EXCLUDED_PREFIXES = ('✉️', '🛵', '❗️')
+MAX_MESSAGE_LENGTH = 1500
+
+DEFAULT_EXCLUDED_USERS = [
     'news_chrkssy',
     'GmailBot',
     'NewsChannel',
@@ -16,7 +49,7 @@ EXCLUDED_USERS = [
     'news_updates'
 ]
 
-EXCLUDED_KEYWORDS = [
+DEFAULT_EXCLUDED_KEYWORDS = [
     '✉️ PULSE <admin@rideatom.com>',
     'Alert! Subaccount:',
     'Vehicle number',
@@ -28,6 +61,9 @@ EXCLUDED_KEYWORDS = [
     'курсом на'
 ]
 
+EXCLUDED_USERS = list(DEFAULT_EXCLUDED_USERS)
+EXCLUDED_KEYWORDS = list(DEFAULT_EXCLUDED_KEYWORDS)
+
 GREETINGS = [
     "Гарного дня😊", "Гарного дня!", "Гарного вечора!", "Гарного вечора😊",
     "Доброї ночі!", "Доброї ночі😊", "Будь ласка, Гарного дня😊", "Будь ласка, Гарного дня!",
@@ -37,7 +73,7 @@ GREETINGS = [
 
 def init_database():
     """Создает таблицы базы данных"""
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_db_connection() as conn:
         cursor = conn.cursor()
         
         # Таблица сообщений
@@ -50,7 +86,19 @@ def init_database():
                 message_type TEXT,
                 shift_name TEXT,
                 chat_id INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                timestamp_ms INTEGER,
+                user_id INTEGER,
+                peer_id INTEGER,
+                tg_message_id INTEGER
+            )
+        ''')
+        
+        # Справочник пользователей: в messages хранится целый user_id
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT NOT NULL UNIQUE
             )
         ''')
         
@@ -63,35 +111,652 @@ def init_database():
             )
         ''')
         
+        _migrate_schema(cursor)
+        
+        # Индексы под формы запросов; rowid в конце индекса дает порядок (время, id)
+        # Сообщения смены по типу: дашборд, экспорт смены
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_shift_type_time ON messages(shift_name, message_type, timestamp_ms)')
+        # История чата пользователя
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_time ON messages(user_id, timestamp_ms)')
+        # Последние сообщения, экспорт за период, очистка
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_time ON messages(timestamp_ms)')
+        # Активные и закрытые чаты по времени последней активности
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_active_chats_activity ON active_chats(last_activity)')
+        # Сообщение Telegram сохраняется один раз: id уникален внутри диалога.
+        # id идет первым - удаление из личного чата приходит без диалога
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_telegram_message ON messages(tg_message_id, peer_id)
+            WHERE tg_message_id IS NOT NULL
+        ''')
+        cursor.execute('DROP INDEX IF EXISTS idx_peer_message')
+        cursor.execute('DROP INDEX IF EXISTS idx_username')
+        
+        # Сообщения, вставленные в обход store_messages/add_message, получают ключи здесь
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS messages_fill_keys AFTER INSERT ON messages
+            WHEN new.timestamp_ms IS NULL OR (new.user_id IS NULL AND new.username IS NOT NULL) BEGIN
+                INSERT OR IGNORE INTO users (username) SELECT new.username WHERE new.username IS NOT NULL;
+                UPDATE messages SET
+                    timestamp_ms = {_EPOCH_MS_SQL.format(column='new.timestamp')},
+                    user_id = (SELECT user_id FROM users WHERE username = new.username)
+                WHERE id = new.id;
+            END
+        ''')
+        
+        # Срабатывания правил фильтрации (пишет слушатель, читает админка)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS filter_hits (
+                rule TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                last_hit TEXT
+            )
+        ''')
+        
+        # Последний сохраненный id сообщения Telegram по диалогам - откуда догружать после перезапуска
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS dialog_state (
+                peer_id INTEGER PRIMARY KEY,
+                last_message_id INTEGER NOT NULL
+            )
+        ''')
+        
+        # Сессии веб-интерфейса общие для всех процессов веб-сервера
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS web_sessions (
+                token_hash BLOB PRIMARY KEY,
+                username TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_web_sessions_expires ON web_sessions(expires_at)')
+        
+        # Имена собеседников Telegram по peer id: кэш слушателя между перезапусками
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS peer_names (
+                peer_id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                resolved_at REAL NOT NULL
+            )
+        ''')
+        
+        _init_search_index(cursor)
+        _init_shift_stats(cursor)
+        _init_chat_metrics(cursor)
+        
+        conn.commit()
+
+def _column_names(cursor, table, schema='main'):
+    cursor.execute(f'PRAGMA {schema}.table_info({table})')
+    return {row[1] for row in cursor.fetchall()}
+
+def _migrate_schema(cursor):
+    """Приводит существующую БД к SCHEMA_VERSION (PRAGMA user_version)"""
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    
+    if version < 1:
+        # v1: время в миллисекундах и целочисленный user_id вместо сравнения строк
+        columns = _column_names(cursor, 'messages')
+        if 'timestamp_ms' not in columns:
+            cursor.execute('ALTER TABLE messages ADD COLUMN timestamp_ms INTEGER')
+        if 'user_id' not in columns:
+            cursor.execute('ALTER TABLE messages ADD COLUMN user_id INTEGER')
         
-        # Создаем индексы для быстрого поиска
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_username ON messages(username)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON messages(timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_shift ON messages(shift_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_type ON messages(message_type)')
+        cursor.execute('''
+            INSERT OR IGNORE INTO users (username)
+            SELECT DISTINCT username FROM messages WHERE username IS NOT NULL
+        ''')
+        cursor.execute(f'''
+            UPDATE messages SET
+                timestamp_ms = {_EPOCH_MS_SQL.format(column='timestamp')},
+                user_id = (SELECT user_id FROM users WHERE users.username = messages.username)
+            WHERE timestamp_ms IS NULL OR user_id IS NULL
+        ''')
         
+        # Одиночные индексы заменены составными под реальные запросы
+        for index in ('idx_username_timestamp', 'idx_timestamp', 'idx_shift', 'idx_type'):
+            cursor.execute(f'DROP INDEX IF EXISTS {index}')
+    
+    if version < 2:
+        # v2: триггер удаления пересоздается в _init_shift_stats без перебора чатов смены
+        cursor.execute('DROP TRIGGER IF EXISTS shift_stats_delete')
+    
+    if version < 3:
+        # v3: ключ сообщения Telegram (диалог, id) для защиты от повторной записи
+        columns = _column_names(cursor, 'messages')
+        if 'peer_id' not in columns:
+            cursor.execute('ALTER TABLE messages ADD COLUMN peer_id INTEGER')
+        if 'tg_message_id' not in columns:
+            cursor.execute('ALTER TABLE messages ADD COLUMN tg_message_id INTEGER')
+    
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+def _table_exists(cursor, name, schema='main'):
+    cursor.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = ?", (name,))
+    return cursor.fetchone() is not None
+
+def _init_search_index(cursor, schema='main'):
+    """Создает полнотекстовый индекс FTS5 по сообщениям и триггеры синхронизации"""
+    exists = _table_exists(cursor, 'messages_fts', schema)
+    
+    # unicode61 приводит к нижнему регистру и кириллицу, prefix ускоряет поиск по началу слова
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.messages_fts USING fts5(
+            message,
+            content='messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {schema}.messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {schema}.messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {schema}.messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+            INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+        END
+    ''')
+    
+    if not exists:
+        # Индексируем сообщения, сохраненные до появления индекса
+        cursor.execute(f"INSERT INTO {schema}.messages_fts(messages_fts) VALUES ('rebuild')")
+
+def _init_shift_stats(cursor):
+    """Создает агрегаты смен, обновляемые триггерами при вставке сообщений"""
+    exists = _table_exists(cursor, 'shift_totals')
+    
+    # Счетчики смены по типу сообщения и пользователю
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shift_stats (
+            shift_name TEXT,
+            message_type TEXT,
+            username TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            first_timestamp TEXT,
+            last_timestamp TEXT,
+            PRIMARY KEY (shift_name, message_type, username)
+        )
+    ''')
+    
+    # Различные чаты смены - нужны только для подсчета chat_count
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shift_chats (
+            shift_name TEXT,
+            username TEXT,
+            chat_id INTEGER,
+            PRIMARY KEY (shift_name, username, chat_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Итоги смены, читаются одной строкой
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shift_totals (
+            shift_name TEXT PRIMARY KEY,
+            incoming_count INTEGER NOT NULL DEFAULT 0,
+            outgoing_count INTEGER NOT NULL DEFAULT 0,
+            user_count INTEGER NOT NULL DEFAULT 0,
+            chat_count INTEGER NOT NULL DEFAULT 0,
+            first_timestamp TEXT,
+            last_timestamp TEXT
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS shift_stats_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO shift_totals (shift_name, first_timestamp, last_timestamp)
+            VALUES (new.shift_name, new.timestamp, new.timestamp)
+            ON CONFLICT(shift_name) DO NOTHING;
+            
+            UPDATE shift_totals SET user_count = user_count + 1
+            WHERE shift_name = new.shift_name AND NOT EXISTS (
+                SELECT 1 FROM shift_stats
+                WHERE shift_name = new.shift_name AND username = COALESCE(new.username, '')
+            );
+            
+            UPDATE shift_totals SET chat_count = chat_count + 1
+            WHERE shift_name = new.shift_name AND NOT EXISTS (
+                SELECT 1 FROM shift_chats
+                WHERE shift_name = new.shift_name AND username = COALESCE(new.username, '')
+                  AND chat_id = COALESCE(new.chat_id, 0)
+            );
+            
+            INSERT OR IGNORE INTO shift_chats (shift_name, username, chat_id)
+            VALUES (new.shift_name, COALESCE(new.username, ''), COALESCE(new.chat_id, 0));
+            
+            INSERT INTO shift_stats (shift_name, message_type, username, message_count, first_timestamp, last_timestamp)
+            VALUES (new.shift_name, new.message_type, COALESCE(new.username, ''), 1, new.timestamp, new.timestamp)
+            ON CONFLICT(shift_name, message_type, username) DO UPDATE SET
+                message_count = message_count + 1,
+                first_timestamp = MIN(first_timestamp, excluded.first_timestamp),
+                last_timestamp = MAX(last_timestamp, excluded.last_timestamp);
+            
+            UPDATE shift_totals SET
+                incoming_count = incoming_count + (new.message_type = 'incoming'),
+                outgoing_count = outgoing_count + (new.message_type = 'outgoing'),
+                first_timestamp = MIN(first_timestamp, new.timestamp),
+                last_timestamp = MAX(last_timestamp, new.timestamp)
+            WHERE shift_name = new.shift_name;
+        END
+    ''')
+    
+    # При удалении уменьшаем счетчики; first/last и chat_count точно пересчитывает rebuild_shift_stats
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS shift_stats_delete AFTER DELETE ON messages BEGIN
+            UPDATE shift_stats SET message_count = message_count - 1
+            WHERE shift_name = old.shift_name AND message_type = old.message_type
+              AND username = COALESCE(old.username, '');
+            
+            DELETE FROM shift_stats
+            WHERE shift_name = old.shift_name AND message_type = old.message_type
+              AND username = COALESCE(old.username, '') AND message_count <= 0;
+            
+            UPDATE shift_totals SET
+                incoming_count = incoming_count - (old.message_type = 'incoming'),
+                outgoing_count = outgoing_count - (old.message_type = 'outgoing'),
+                user_count = user_count - NOT EXISTS (
+                    SELECT 1 FROM shift_stats
+                    WHERE shift_name = old.shift_name AND username = COALESCE(old.username, '')
+                )
+            WHERE shift_name = old.shift_name;
+            
+            -- IN, а не EXISTS: иначе SQLite проверяет условие на каждой строке чатов смены
+            DELETE FROM shift_chats WHERE shift_name IN (
+                SELECT shift_name FROM shift_totals
+                WHERE shift_name = old.shift_name AND incoming_count + outgoing_count <= 0
+            );
+            DELETE FROM shift_totals
+            WHERE shift_name = old.shift_name AND incoming_count + outgoing_count <= 0;
+        END
+    ''')
+    
+    # (username, shift_name): проверка "есть ли пользователь в смене" в триггерах и счетчики пользователя
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shift_stats_user_shift ON shift_stats(username, shift_name)')
+    cursor.execute('DROP INDEX IF EXISTS idx_shift_stats_user')
+    
+    if not exists:
+        _rebuild_shift_stats(cursor)
+
+def _rebuild_shift_stats(cursor):
+    """Пересчитывает агрегаты смен из таблицы messages"""
+    cursor.execute('DELETE FROM shift_stats')
+    cursor.execute('DELETE FROM shift_chats')
+    cursor.execute('DELETE FROM shift_totals')
+    
+    cursor.execute('''
+        INSERT INTO shift_stats (shift_name, message_type, username, message_count, first_timestamp, last_timestamp)
+        SELECT shift_name, message_type, COALESCE(username, ''), COUNT(*), MIN(timestamp), MAX(timestamp)
+        FROM messages
+        GROUP BY shift_name, message_type, COALESCE(username, '')
+    ''')
+    cursor.execute('''
+        INSERT INTO shift_chats (shift_name, username, chat_id)
+        SELECT DISTINCT shift_name, COALESCE(username, ''), COALESCE(chat_id, 0)
+        FROM messages
+    ''')
+    cursor.execute('''
+        INSERT INTO shift_totals (shift_name, incoming_count, outgoing_count, user_count, chat_count,
+                                  first_timestamp, last_timestamp)
+        SELECT m.shift_name,
+               SUM(m.message_type = 'incoming'),
+               SUM(m.message_type = 'outgoing'),
+               COUNT(DISTINCT COALESCE(m.username, '')),
+               (SELECT COUNT(*) FROM shift_chats c WHERE c.shift_name = m.shift_name),
+               MIN(m.timestamp),
+               MAX(m.timestamp)
+        FROM messages m
+        GROUP BY m.shift_name
+    ''')
+
+def rebuild_shift_stats():
+    """Полностью пересчитывает shift_stats/shift_totals из сообщений"""
+    with get_db_connection() as conn:
+        _rebuild_shift_stats(conn.cursor())
+        conn.commit()
+        count = conn.execute('SELECT COUNT(*) FROM shift_totals').fetchone()[0]
+    print(f"Статистика смен пересчитана: {count} смен")
+    return count
+
+def _init_chat_metrics(cursor):
+    """Создает метрики скорости ответа, обновляемые триггером при вставке сообщений"""
+    exists = _table_exists(cursor, 'chat_metrics')
+    
+    # Одна строка на чат: первый ответ, ответы, закрытие
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_metrics (
+            username TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            shift_name TEXT,
+            opened_at TEXT,
+            first_incoming_at TEXT,
+            first_response_seconds REAL,
+            waiting_since TEXT,
+            reply_count INTEGER NOT NULL DEFAULT 0,
+            reply_seconds REAL NOT NULL DEFAULT 0,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_timestamp TEXT,
+            closed_at TEXT,
+            close_seconds REAL,
+            PRIMARY KEY (username, chat_id)
+        )
+    ''')
+    
+    # Задержка каждого ответа оператора - от первого неотвеченного входящего
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reply_latencies (
+            message_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            shift_name TEXT,
+            seconds REAL NOT NULL
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_metrics_insert AFTER INSERT ON messages
+        WHEN new.username IS NOT NULL AND new.chat_id IS NOT NULL BEGIN
+            -- Новый чат пользователя закрывает предыдущие по таймауту
+            UPDATE chat_metrics SET
+                closed_at = last_timestamp,
+                close_seconds = (julianday(last_timestamp) - julianday(opened_at)) * 86400
+            WHERE username = new.username AND chat_id < new.chat_id AND closed_at IS NULL
+              AND NOT EXISTS (SELECT 1 FROM chat_metrics WHERE username = new.username AND chat_id = new.chat_id);
+            
+            INSERT INTO chat_metrics (username, chat_id, shift_name, opened_at, last_timestamp)
+            VALUES (new.username, new.chat_id, new.shift_name, new.timestamp, new.timestamp)
+            ON CONFLICT(username, chat_id) DO NOTHING;
+            
+            INSERT INTO reply_latencies (message_id, username, chat_id, shift_name, seconds)
+            SELECT new.id, new.username, new.chat_id, new.shift_name,
+                   (julianday(new.timestamp) - julianday(waiting_since)) * 86400
+            FROM chat_metrics
+            WHERE new.message_type = 'outgoing' AND username = new.username AND chat_id = new.chat_id
+              AND waiting_since IS NOT NULL;
+            
+            UPDATE chat_metrics SET
+                first_incoming_at = COALESCE(first_incoming_at,
+                    CASE WHEN new.message_type = 'incoming' THEN new.timestamp END),
+                first_response_seconds = CASE
+                    WHEN first_response_seconds IS NULL AND new.message_type = 'outgoing' AND waiting_since IS NOT NULL
+                    THEN (julianday(new.timestamp) - julianday(first_incoming_at)) * 86400
+                    ELSE first_response_seconds END,
+                reply_count = reply_count + (new.message_type = 'outgoing' AND waiting_since IS NOT NULL),
+                reply_seconds = reply_seconds + CASE
+                    WHEN new.message_type = 'outgoing' AND waiting_since IS NOT NULL
+                    THEN (julianday(new.timestamp) - julianday(waiting_since)) * 86400
+                    ELSE 0 END,
+                waiting_since = CASE WHEN new.message_type = 'incoming' THEN COALESCE(waiting_since, new.timestamp) END,
+                message_count = message_count + 1,
+                last_timestamp = new.timestamp
+            WHERE username = new.username AND chat_id = new.chat_id;
+        END
+    ''')
+    
+    # Перцентили по смене читаются из индекса через OFFSET, без сортировки
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reply_latencies_shift ON reply_latencies(shift_name, seconds)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reply_latencies_chat ON reply_latencies(username, chat_id, seconds)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_metrics_first ON chat_metrics(shift_name, first_response_seconds)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_metrics_close ON chat_metrics(shift_name, close_seconds)')
+    
+    if not exists:
+        _rebuild_chat_metrics(cursor)
+
+def _rebuild_chat_metrics(cursor):
+    """Пересчитывает метрики чатов оконными запросами по messages"""
+    cursor.execute('DELETE FROM chat_metrics')
+    cursor.execute('DELETE FROM reply_latencies')
+    
+    # Ответ - исходящее сразу после входящего; ждать начали с первого входящего серии
+    cursor.execute('''
+        WITH ordered AS (
+            SELECT id, username, chat_id, shift_name, timestamp, message_type,
+                   LAG(message_type) OVER (PARTITION BY username, chat_id ORDER BY id) AS prev_type
+            FROM messages
+            WHERE username IS NOT NULL AND chat_id IS NOT NULL
+        ), runs AS (
+            SELECT *, MAX(CASE WHEN message_type = 'incoming' AND prev_type IS NOT 'incoming' THEN timestamp END)
+                      OVER (PARTITION BY username, chat_id ORDER BY id ROWS UNBOUNDED PRECEDING) AS waiting_since
+            FROM ordered
+        )
+        INSERT INTO reply_latencies (message_id, username, chat_id, shift_name, seconds)
+        SELECT id, username, chat_id, shift_name, (julianday(timestamp) - julianday(waiting_since)) * 86400
+        FROM runs
+        WHERE message_type = 'outgoing' AND prev_type = 'incoming'
+    ''')
+    
+    cursor.execute('''
+        WITH chats AS (
+            SELECT username, chat_id, MIN(user_id) AS user_id, COUNT(*) AS message_count,
+                   MIN(id) AS first_id, MAX(id) AS last_id,
+                   MIN(CASE WHEN message_type = 'incoming' THEN id END) AS first_incoming_id,
+                   MAX(CASE WHEN message_type = 'outgoing' THEN id END) AS last_outgoing_id
+            FROM messages
+            WHERE username IS NOT NULL AND chat_id IS NOT NULL
+            GROUP BY username, chat_id
+        )
+        INSERT INTO chat_metrics (username, chat_id, shift_name, opened_at, first_incoming_at, waiting_since,
+                                  message_count, last_timestamp)
+        SELECT c.username, c.chat_id, f.shift_name, f.timestamp, i.timestamp,
+               CASE WHEN l.message_type = 'incoming' THEN (
+                   SELECT MIN(timestamp) FROM messages w
+                   WHERE w.user_id = c.user_id AND w.chat_id = c.chat_id AND w.id > COALESCE(c.last_outgoing_id, 0)
+               ) END,
+               c.message_count, l.timestamp
+        FROM chats c
+        JOIN messages f ON f.id = c.first_id
+        JOIN messages l ON l.id = c.last_id
+        LEFT JOIN messages i ON i.id = c.first_incoming_id
+    ''')
+    
+    cursor.execute('''
+        UPDATE chat_metrics SET
+            reply_count = r.reply_count,
+            reply_seconds = r.reply_seconds,
+            first_response_seconds = (SELECT seconds FROM reply_latencies WHERE message_id = r.first_reply_id)
+        FROM (
+            SELECT username, chat_id, COUNT(*) AS reply_count, SUM(seconds) AS reply_seconds,
+                   MIN(message_id) AS first_reply_id
+            FROM reply_latencies
+            GROUP BY username, chat_id
+        ) AS r
+        WHERE chat_metrics.username = r.username AND chat_metrics.chat_id = r.chat_id
+    ''')
+    
+    # Все чаты, кроме последнего у пользователя, закрыты по таймауту
+    cursor.execute('''
+        UPDATE chat_metrics SET
+            closed_at = last_timestamp,
+            close_seconds = (julianday(last_timestamp) - julianday(opened_at)) * 86400
+        WHERE EXISTS (
+            SELECT 1 FROM chat_metrics later
+            WHERE later.username = chat_metrics.username AND later.chat_id > chat_metrics.chat_id
+        )
+    ''')
+
+def rebuild_chat_metrics():
+    """Полностью пересчитывает chat_metrics/reply_latencies из сообщений"""
+    with get_db_connection() as conn:
+        _rebuild_chat_metrics(conn.cursor())
         conn.commit()
+        count = conn.execute('SELECT COUNT(*) FROM chat_metrics').fetchone()[0]
+    print(f"Метрики чатов пересчитаны: {count} чатов")
+    return count
+
+def _close_chat_metrics(cursor, closes):
+    """Отмечает закрытие чатов прощанием оператора: (closed_at, username, chat_id)"""
+    cursor.executemany('''
+        UPDATE chat_metrics SET
+            closed_at = ?1,
+            close_seconds = (julianday(?1) - julianday(opened_at)) * 86400
+        WHERE username = ?2 AND chat_id = ?3 AND closed_at IS NULL
+    ''', closes)
+
+# Пул соединений: одно постоянное соединение на поток процесса
+_pool = threading.local()
+
+_open_connections = 0
+
+def open_connection_count():
+    """Количество открытых соединений пула в процессе"""
+    return _open_connections
+
+def _open_connection():
+    """Открывает соединение и применяет настройки производительности"""
+    global _open_connections
+    conn = sqlite3.connect(DB_PATH, cached_statements=DB_CACHED_STATEMENTS)
+    _open_connections += 1
+    conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _pooled_connection():
+    """Возвращает соединение текущего потока, открывая его при необходимости"""
+    conn = getattr(_pool, "conn", None)
+    # После fork или смены DB_PATH соединение родителя использовать нельзя
+    if conn is None or _pool.pid != os.getpid() or _pool.path != DB_PATH:
+        conn = _open_connection()
+        _pool.conn = conn
+        _pool.pid = os.getpid()
+        _pool.path = DB_PATH
+    return conn
+
+def close_db_connection():
+    """Закрывает соединение текущего потока"""
+    global _open_connections
+    conn = getattr(_pool, "conn", None)
+    if conn is not None and _pool.pid == os.getpid():
+        conn.close()
+        _open_connections -= 1
+    _pool.conn = None
+
+# Отдельное соединение только для PRAGMA data_version: оно ничего не пишет,
+# поэтому номер меняется после фиксации в любом соединении любого процесса
+_version_conn = None
+_version_owner = None
+_version_lock = threading.Lock()
+
+def data_version():
+    """Номер версии данных БД для сброса кэшей чтения"""
+    global _version_conn, _version_owner
+    with _version_lock:
+        owner = (os.getpid(), DB_PATH)
+        if _version_owner != owner:
+            _version_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            _version_owner = owner
+        return _version_conn.execute('PRAGMA data_version').fetchone()[0]
 
 @contextmanager
 def get_db_connection():
     """Контекстный менеджер для работы с БД"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = _pooled_connection()
     try:
         yield conn
     finally:
-        conn.close()
+        # Незафиксированные изменения не должны утечь в следующий вызов
+        if conn.in_transaction:
+            conn.rollback()
+
+def _keyword_pattern(keywords):
+    """Собирает из ключевых слов одно регулярное выражение в виде префиксного дерева.
+
+    Общие префиксы проверяются один раз, поэтому поиск в сообщении почти
+    не зависит от количества слов - как у автомата Ахо-Корасик.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = None
+    
+    def build(node):
+        terminal = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and not terminal:
+            return branches[0]
+        pattern = '(?:' + '|'.join(branches) + ')'
+        return pattern + '?' if terminal else pattern
+    
+    return build(trie)
+
+class MessageFilter:
+    """Скомпилированные фильтры сообщений со счетчиками срабатываний правил"""
+    def __init__(self, users, keywords):
+        self.users = frozenset(users)
+        self.keywords = tuple(keyword for keyword in keywords if keyword)
+        self.pattern = re.compile(_keyword_pattern(self.keywords)) if self.keywords else None
+        self.hits = Counter()
+    
+    def match(self, username, message):
+        """Возвращает сработавшее правило или None"""
+        if username in self.users:
+            rule = f"user:{username}"
+        elif self.pattern is not None and (found := self.pattern.search(message)):
+            rule = f"keyword:{found.group(0)}"
+        elif message.startswith(EXCLUDED_PREFIXES):
+            rule = "prefix:" + next(prefix for prefix in EXCLUDED_PREFIXES if message.startswith(prefix))
+        elif len(message) > MAX_MESSAGE_LENGTH:
+            rule = "length"
+        else:
+            return None
+        self.hits[rule] += 1
+        return rule
+    
+    def take_hits(self):
+        """Возвращает накопленные срабатывания и обнуляет их"""
+        hits, self.hits = self.hits, Counter()
+        return hits
+
+_message_filter = MessageFilter(EXCLUDED_USERS, EXCLUDED_KEYWORDS)
+_filters_mtime = None
+_filters_checked_at = 0.0
 
 def load_filters_config():
-    """Загружает конфигурацию фильтров из файла"""
+    """Загружает конфигурацию фильтров из файла и пересобирает фильтр"""
+    global EXCLUDED_USERS, EXCLUDED_KEYWORDS, _message_filter, _filters_mtime
     try:
-        with open("filters_config.json", "r", encoding="utf-8") as f:
+        _filters_mtime = os.stat(FILTERS_CONFIG_PATH).st_mtime
+        with open(FILTERS_CONFIG_PATH, "r", encoding="utf-8") as f:
             config = json.load(f)
-            global EXCLUDED_USERS, EXCLUDED_KEYWORDS
-            EXCLUDED_USERS = config.get("excluded_users", EXCLUDED_USERS)
-            EXCLUDED_KEYWORDS = config.get("excluded_keywords", EXCLUDED_KEYWORDS)
+            EXCLUDED_USERS = config.get("excluded_users", DEFAULT_EXCLUDED_USERS)
+            EXCLUDED_KEYWORDS = config.get("excluded_keywords", DEFAULT_EXCLUDED_KEYWORDS)
+    except FileNotFoundError:
+        _filters_mtime = None
+        EXCLUDED_USERS = list(DEFAULT_EXCLUDED_USERS)
+        EXCLUDED_KEYWORDS = list(DEFAULT_EXCLUDED_KEYWORDS)
+    except ValueError as e:
+        # Файл в процессе записи или испорчен - оставляем текущие фильтры
+        print(f"Ошибка чтения {FILTERS_CONFIG_PATH}: {e}")
+        return
+    
+    message_filter = MessageFilter(EXCLUDED_USERS, EXCLUDED_KEYWORDS)
+    message_filter.hits = _message_filter.hits
+    _message_filter = message_filter
+
+def _reload_filters_if_changed():
+    """Перечитывает конфигурацию, если файл изменился (не чаще раза в FILTERS_RELOAD_SECONDS)"""
+    global _filters_checked_at
+    now = time.monotonic()
+    if now - _filters_checked_at < FILTERS_RELOAD_SECONDS:
+        return
+    _filters_checked_at = now
+    try:
+        mtime = os.stat(FILTERS_CONFIG_PATH).st_mtime
     except FileNotFoundError:
-        pass
+        mtime = None
+    if mtime != _filters_mtime:
+        load_filters_config()
+        print("Конфигурация фильтров перезагружена")
 
 def save_filters_config():
     """Сохраняет конфигурацию фильтров в файл"""
@@ -99,93 +764,456 @@ def save_filters_config():
         "excluded_users": EXCLUDED_USERS,
         "excluded_keywords": EXCLUDED_KEYWORDS
     }
-    with open("filters_config.json", "w", encoding="utf-8") as f:
+    with open(FILTERS_CONFIG_PATH, "w", encoding="utf-8") as f:
         json.dump(config, f, ensure_ascii=False, indent=2)
+    load_filters_config()
+
+def match_filter_rule(username, message):
+    """Возвращает правило, по которому сообщение отфильтровано, или None"""
+    _reload_filters_if_changed()
+    return _message_filter.match(username, message)
 
 def should_exclude_message(username, message):
     """Проверяет фильтры"""
-    if username in EXCLUDED_USERS:
-        return True
-    
-    for keyword in EXCLUDED_KEYWORDS:
-        if keyword in message:
-            return True
-    
-    if message.startswith(('✉️', '🛵', '❗️')):
-        return True
-    
-    if len(message) > 1500:
-        return True
-    
-    return False
+    return match_filter_rule(username, message) is not None
+
+def _flush_filter_hits(cursor, now):
+    """Добавляет накопленные срабатывания фильтров в таблицу filter_hits"""
+    hits = _message_filter.take_hits()
+    if not hits:
+        return
+    cursor.executemany('''
+        INSERT INTO filter_hits (rule, hits, last_hit) VALUES (?, ?, ?)
+        ON CONFLICT(rule) DO UPDATE SET hits = hits + excluded.hits, last_hit = excluded.last_hit
+    ''', [(rule, count, now.isoformat()) for rule, count in hits.items()])
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def get_filter_hits():
+    """Возвращает счетчики срабатываний правил фильтрации"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT rule, hits, last_hit FROM filter_hits ORDER BY hits DESC')
+        return [dict(row) for row in cursor.fetchall()]
+
+def _session_key(token):
+    # В БД лежит только хэш токена: по копии БД чужую сессию не открыть
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def create_web_session(token, username, expires_at):
+    """Сохраняет сессию веб-интерфейса и заодно удаляет истекшие"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM web_sessions WHERE expires_at <= ?', (time.time(),))
+        cursor.execute('INSERT INTO web_sessions (token_hash, username, expires_at) VALUES (?, ?, ?)',
+                       (_session_key(token), username, expires_at))
+        conn.commit()
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def get_web_session(token):
+    """Возвращает {username, expires_at} действующей сессии или None"""
+    with get_db_connection() as conn:
+        row = conn.execute('''
+            SELECT username, expires_at FROM web_sessions WHERE token_hash = ? AND expires_at > ?
+        ''', (_session_key(token), time.time())).fetchone()
+        return dict(row) if row else None
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def delete_web_session(token):
+    """Удаляет сессию (выход из системы)"""
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM web_sessions WHERE token_hash = ?', (_session_key(token),))
+        conn.commit()
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def count_web_sessions():
+    """Число действующих сессий веб-интерфейса во всех процессах"""
+    with get_db_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM web_sessions WHERE expires_at > ?', (time.time(),)).fetchone()[0]
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def load_peer_names(limit):
+    """Последние limit имен собеседников: [(peer_id, имя, когда получено)] от старых к новым"""
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT peer_id, name, resolved_at FROM peer_names ORDER BY resolved_at DESC LIMIT ?
+        ''', (limit,)).fetchall()
+    return [tuple(row) for row in reversed(rows)]
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def save_peer_names(rows, retention_days):
+    """Сохраняет имена [(peer_id, имя, когда получено)] и удаляет не обновлявшиеся retention_days дней"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO peer_names (peer_id, name, resolved_at) VALUES (?, ?, ?)
+            ON CONFLICT(peer_id) DO UPDATE SET name = excluded.name, resolved_at = excluded.resolved_at
+        ''', rows)
+        cursor.execute('DELETE FROM peer_names WHERE resolved_at < ?', (time.time() - retention_days * 86400,))
+        conn.commit()
 
 def is_greeting_message(message):
     """Проверяет, является ли сообщение прощальным"""
     return message.strip() in GREETINGS
 
+class ChatSession:
+    """Текущий чат пользователя: номер и время последней активности"""
+    __slots__ = ("chat_id", "last_activity")
+
+    def __init__(self, chat_id, last_activity):
+        self.chat_id = chat_id
+        self.last_activity = last_activity
+
+class ChatSessionTracker:
+    """Определяет границы чатов в памяти и отложенно пишет active_chats.
+
+    Строится из таблицы active_chats при первом обращении, дальше каждое
+    сообщение решается одним обращением к словарю, а измененные сессии
+    сохраняются одним executemany в транзакции пачки сообщений.
+    """
+    def __init__(self, timeout_minutes=CHAT_TIMEOUT_MINUTES):
+        self.timeout = timedelta(minutes=timeout_minutes)
+        self.sessions = {}
+        self.dirty = set()
+
+    def load(self, cursor):
+        """Восстанавливает сессии из таблицы active_chats"""
+        cursor.execute('SELECT username, chat_id, last_activity FROM active_chats')
+        self.sessions = {
+            row['username']: ChatSession(row['chat_id'], datetime.fromisoformat(row['last_activity']))
+            for row in cursor.fetchall()
+        }
+        self.dirty.clear()
+
+    def touch(self, username, now):
+        """Продлевает текущий чат пользователя или открывает новый"""
+        session = self.sessions.get(username)
+        if session is None:
+            session = self.sessions[username] = ChatSession(1, now)
+        else:
+            if now - session.last_activity >= self.timeout:
+                session.chat_id += 1
+            session.last_activity = now
+        self.dirty.add(username)
+        return session.chat_id
+
+    def close(self, username, now):
+        """Отмечает чат закрытым, сдвигая последнюю активность за таймаут"""
+        session = self.sessions.get(username)
+        if session is None:
+            return
+        session.last_activity = now - timedelta(hours=1)
+        self.dirty.add(username)
+
+    def flush(self, cursor):
+        """Сохраняет измененные сессии в active_chats"""
+        if not self.dirty:
+            return 0
+        cursor.executemany('''
+            INSERT INTO active_chats (username, chat_id, last_activity) VALUES (?, ?, ?)
+            ON CONFLICT(username) DO UPDATE SET chat_id = excluded.chat_id, last_activity = excluded.last_activity
+        ''', [(username, self.sessions[username].chat_id, self.sessions[username].last_activity.isoformat())
+              for username in self.dirty])
+        flushed = len(self.dirty)
+        self.dirty.clear()
+        return flushed
+
+# Трекер сессий процесса слушателя и блокировка для его изменения
+_session_tracker = None
+_session_owner = None
+_session_lock = threading.RLock()
+
+def _get_session_tracker(cursor):
+    """Возвращает трекер сессий, загружая его из БД при первом обращении"""
+    global _session_tracker, _session_owner
+    owner = (os.getpid(), DB_PATH)
+    if _session_tracker is None or _session_owner != owner:
+        tracker = ChatSessionTracker()
+        tracker.load(cursor)
+        _session_tracker, _session_owner = tracker, owner
+    return _session_tracker
+
+def reset_session_tracker():
+    """Сбрасывает трекер, чтобы он перечитал active_chats"""
+    global _session_tracker
+    with _session_lock:
+        _session_tracker = None
+
+def to_epoch_ms(value):
+    """Переводит datetime или ISO строку в миллисекунды от 1970-01-01.
+
+    Считается по тем же локальным часам, что и текстовый timestamp, без
+    перевода в UTC - так же, как _EPOCH_MS_SQL при миграции.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return calendar.timegm(value.timetuple()) * 1000 + value.microsecond // 1000
+
+def from_epoch_ms(value):
+    """Обратное к to_epoch_ms: наивное локальное время без перевода из UTC"""
+    return datetime(1970, 1, 1) + timedelta(milliseconds=value)
+
+# Кэш username -> user_id процесса; сбрасывается при смене БД или откате транзакции
+_user_ids = {}
+_user_ids_owner = None
+
+def intern_users(cursor, usernames):
+    """Возвращает словарь username -> user_id, добавляя новых пользователей в users"""
+    global _user_ids_owner
+    with _session_lock:
+        owner = (os.getpid(), DB_PATH)
+        if _user_ids_owner != owner:
+            _user_ids.clear()
+            _user_ids_owner = owner
+        
+        missing = list({username for username in usernames if username and username not in _user_ids})
+        if missing:
+            cursor.executemany('INSERT OR IGNORE INTO users (username) VALUES (?)', [(name,) for name in missing])
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                cursor.execute(f'''
+                    SELECT user_id, username FROM users WHERE username IN ({','.join('?' * len(chunk))})
+                ''', chunk)
+                _user_ids.update((row['username'], row['user_id']) for row in cursor.fetchall())
+        return _user_ids
+
+def reset_user_ids():
+    """Сбрасывает кэш user_id"""
+    with _session_lock:
+        _user_ids.clear()
+
 def force_close_chat(username):
     """Принудительно закрывает чат пользователя"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        old_time = (datetime.now() - timedelta(hours=1)).isoformat()
-        cursor.execute('UPDATE active_chats SET last_activity = ? WHERE username = ?',
-                     (old_time, username))
-        conn.commit()
-        print(f"Чат с {username} принудительно закрыт")
+    store_messages([('close', None, None, username, datetime.now())])
+    print(f"Чат с {username} принудительно закрыт")
 
 def add_incoming(message, shift, username=None):
-    if should_exclude_message(username or 'unknown', message):
-        print(f"Сообщение от {username} отфильтровано")
-        return
-    
-    chat_id = get_or_create_chat_id(username) if username else None
-    add_message(message, shift, username, 'incoming', chat_id)
+    store_messages([('incoming', message, shift, username, datetime.now())])
 
 def add_outgoing(message, shift, username=None):
-    if should_exclude_message(username or 'unknown', message):
-        print(f"Исходящее для {username} отфильтровано")
+    store_messages([('outgoing', message, shift, username, datetime.now())])
+
+# Id сообщений личных чатов и обычных групп сквозные для всего аккаунта,
+# поэтому Telegram сообщает об их удалении без диалога. У каналов и
+# супергрупп (peer id с префиксом -100) id свои, и диалог известен всегда.
+CHANNEL_PEER_ID_MAX = -1000000000000
+# Длина префикса ISO времени, определяющего корзину сводок аналитики; общая
+# для analytics.py и вычитания удаленных сообщений из сводок
+BUCKET_PREFIX = {"minute": 16, "hour": 13, "day": 10}
+
+def rollup_buckets(timestamp):
+    """Корзины сводок (granularity, bucket), в которые попадает ISO время"""
+    return [(granularity, timestamp[:length]) for granularity, length in BUCKET_PREFIX.items()]
+
+def _known_message_keys(cursor, keys):
+    """Какие из ключей (peer_id, tg_message_id) уже есть в messages"""
+    if not keys:
+        return set()
+    cursor.execute('''
+        SELECT m.peer_id, m.tg_message_id
+        FROM json_each(?) k
+        JOIN messages m ON m.peer_id = json_extract(k.value, '$[0]')
+                       AND m.tg_message_id = json_extract(k.value, '$[1]')
+    ''', (json.dumps(list(keys)),))
+    return {tuple(row) for row in cursor.fetchall()}
+
+def _update_dialog_state(cursor, keys):
+    """Запоминает наибольший увиденный id сообщения по диалогам"""
+    last_ids = {}
+    for peer_id, tg_message_id in keys:
+        last_ids[peer_id] = max(tg_message_id, last_ids.get(peer_id, tg_message_id))
+    cursor.executemany('''
+        INSERT INTO dialog_state (peer_id, last_message_id) VALUES (?, ?)
+        ON CONFLICT(peer_id) DO UPDATE SET last_message_id = MAX(last_message_id, excluded.last_message_id)
+    ''', list(last_ids.items()))
+
+def _edit_telegram_message(cursor, peer_id, tg_message_id, message):
+    """Заменяет текст отредактированного сообщения; поисковый индекс обновит триггер"""
+    cursor.execute('UPDATE messages SET message = ? WHERE tg_message_id = ? AND peer_id = ?',
+                   (message, tg_message_id, peer_id))
+    return cursor.rowcount
+
+def _forget_rollups(cursor, rows):
+    """Вычитает удаленные сообщения из сводок аналитики, если они уже туда попали.
+
+    Очистка старых сообщений сводки не трогает - история нужна и после нее,
+    а удаленное пользователем сообщение не должно считаться вовсе. Открытые
+    чаты и время ответа остаются такими, как были посчитаны.
+    """
+    if not _table_exists(cursor, 'rollup_watermark'):
         return
-    
-    chat_id = get_or_create_chat_id(username) if username else None
-    add_message(message, shift, username, 'outgoing', chat_id)
+    row = cursor.execute("SELECT last_message_id FROM rollup_watermark WHERE name = 'messages'").fetchone()
+    watermark = row[0] if row else 0
+    for row in rows:
+        if row['id'] > watermark:
+            continue
+        field = 'incoming_count' if row['message_type'] == 'incoming' else 'outgoing_count'
+        cursor.executemany(f'''
+            UPDATE message_rollups SET {field} = MAX({field} - 1, 0) WHERE granularity = ? AND bucket = ?
+        ''', rollup_buckets(row['timestamp']))
+
+def _delete_telegram_message(cursor, peer_id, tg_message_id):
+    """Удаляет сообщение, удаленное в Telegram; счетчики смен поправит триггер"""
+    if peer_id is None:
+        where, params = 'tg_message_id = ? AND peer_id > ?', (tg_message_id, CHANNEL_PEER_ID_MAX)
+    else:
+        where, params = 'tg_message_id = ? AND peer_id = ?', (tg_message_id, peer_id)
+    rows = cursor.execute(f'SELECT id, timestamp, message_type FROM messages WHERE {where}', params).fetchall()
+    if rows:
+        cursor.execute(f'DELETE FROM messages WHERE {where}', params)
+        _forget_rollups(cursor, rows)
+    return len(rows)
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def store_messages(items):
+    """Сохраняет пачку событий слушателя одной транзакцией.
+
+    Элементы - кортежи (kind, message, shift, username, timestamp[, peer_id,
+    tg_message_id]), где kind это 'incoming', 'outgoing', 'close', а также
+    'edit' (новый текст в message) и 'delete' для сообщений Telegram - они
+    применяются после вставки пачки в порядке поступления. Сообщение с уже
+    сохраненным ключом (peer_id, tg_message_id) пропускается целиком, не
+    трогая чаты и счетчики.
+    """
+    rows = []
+    closes = []
+    changes = []
+    keys = {tuple(item[5:7]) for item in items
+            if item[0] in ('incoming', 'outgoing') and len(item) > 6 and item[6] is not None}
+    with _session_lock, get_db_connection() as conn:
+        cursor = conn.cursor()
+        tracker = _get_session_tracker(cursor)
+        try:
+            # Блокировка записи до проверки ключей: между проверкой и вставкой
+            # никто не добавит те же сообщения, и id вставленных идут подряд
+            if keys and not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            known = _known_message_keys(cursor, keys)
+            for item in items:
+                kind, message, shift, username, timestamp = item[:5]
+                peer_id, tg_message_id = item[5:7] if len(item) > 6 else (None, None)
+                if kind in ('edit', 'delete'):
+                    changes.append((kind, message, peer_id, tg_message_id))
+                    continue
+                if tg_message_id is not None:
+                    if (peer_id, tg_message_id) in known:
+                        continue
+                    known.add((peer_id, tg_message_id))
+                
+                if kind == 'close':
+                    session = tracker.sessions.get(username)
+                    if session is not None:
+                        closes.append((timestamp.isoformat(), username, session.chat_id))
+                    tracker.close(username, timestamp)
+                    continue
+
+                if should_exclude_message(username or 'unknown', message):
+                    if kind == 'incoming':
+                        print(f"Сообщение от {username} отфильтровано")
+                    else:
+                        print(f"Исходящее для {username} отфильтровано")
+                    continue
+
+                chat_id = tracker.touch(username, timestamp) if username else None
+                rows.append({
+                    "username": username,
+                    "message": message,
+                    "timestamp": timestamp.isoformat(),
+                    "message_type": kind,
+                    "shift_name": shift,
+                    "chat_id": chat_id,
+                    "timestamp_ms": to_epoch_ms(timestamp),
+                    "peer_id": peer_id,
+                    "tg_message_id": tg_message_id
+                })
 
+            if rows:
+                user_ids = intern_users(cursor, [row["username"] for row in rows])
+                for row in rows:
+                    row["user_id"] = user_ids.get(row["username"])
+                cursor.executemany('''
+                    INSERT INTO messages (username, message, timestamp, message_type, shift_name, chat_id,
+                                          timestamp_ms, user_id, peer_id, tg_message_id)
+                    VALUES (:username, :message, :timestamp, :message_type, :shift_name, :chat_id,
+                            :timestamp_ms, :user_id, :peer_id, :tg_message_id)
+                    ON CONFLICT DO NOTHING
+                ''', rows)
+                # Одна транзакция и один писатель: id идут подряд
+                last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+                for offset, row in enumerate(rows):
+                    row["id"] = last_id - len(rows) + 1 + offset
+            for kind, message, peer_id, tg_message_id in changes:
+                if kind == 'edit':
+                    _edit_telegram_message(cursor, peer_id, tg_message_id, message)
+                else:
+                    _delete_telegram_message(cursor, peer_id, tg_message_id)
+            if closes:
+                _close_chat_metrics(cursor, closes)
+            if keys:
+                _update_dialog_state(cursor, keys)
+            tracker.flush(cursor)
+            _flush_filter_hits(cursor, datetime.now())
+            conn.commit()
+        except Exception:
+            # Память могла разойтись с БД - перечитаем сессии и user_id при следующей пачке
+            reset_session_tracker()
+            reset_user_ids()
+            raise
+
+    for row in rows:
+        notifier.publish(dict(row, type="new_message"))
+    return len(rows)
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def get_catchup_state():
+    """Последние сохраненные id сообщений по диалогам и время самого нового сообщения (или None)"""
+    with get_db_connection() as conn:
+        last_ids = dict(conn.execute('SELECT peer_id, last_message_id FROM dialog_state').fetchall())
+        newest = conn.execute('SELECT MAX(timestamp_ms) FROM messages').fetchone()[0]
+    return last_ids, from_epoch_ms(newest) if newest else None
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
 def add_message(message, shift, username, message_type, chat_id):
-    """Добавляет сообщение в БД"""
+    """Добавляет сообщение в БД и возвращает сохраненную строку"""
+    now = datetime.now()
+    row = {
+        "username": username,
+        "message": message,
+        "timestamp": now.isoformat(),
+        "message_type": message_type,
+        "shift_name": shift,
+        "chat_id": chat_id,
+        "timestamp_ms": to_epoch_ms(now)
+    }
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO messages (username, message, timestamp, message_type, shift_name, chat_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (username, message, datetime.now().isoformat(), message_type, shift, chat_id))
-        conn.commit()
+        try:
+            row["user_id"] = intern_users(cursor, [username]).get(username)
+            cursor.execute('''
+                INSERT INTO messages (username, message, timestamp, message_type, shift_name, chat_id,
+                                      timestamp_ms, user_id)
+                VALUES (:username, :message, :timestamp, :message_type, :shift_name, :chat_id,
+                        :timestamp_ms, :user_id)
+            ''', row)
+            conn.commit()
+        except Exception:
+            reset_user_ids()
+            raise
+        row["id"] = cursor.lastrowid
+    return row
 
+@metrics.timed(metrics.DB_QUERY_SECONDS)
 def get_or_create_chat_id(username):
     """Получает или создает ID чата"""
-    with get_db_connection() as conn:
+    with _session_lock, get_db_connection() as conn:
         cursor = conn.cursor()
-        
-        cursor.execute('SELECT chat_id, last_activity FROM active_chats WHERE username = ?', (username,))
-        row = cursor.fetchone()
-        
-        if row:
-            last_activity = datetime.fromisoformat(row['last_activity'])
-            if datetime.now() - last_activity < timedelta(minutes=CHAT_TIMEOUT_MINUTES):
-                cursor.execute('UPDATE active_chats SET last_activity = ? WHERE username = ?',
-                             (datetime.now().isoformat(), username))
-                conn.commit()
-                return row['chat_id']
-            else:
-                new_chat_id = row['chat_id'] + 1
-                cursor.execute('UPDATE active_chats SET chat_id = ?, last_activity = ? WHERE username = ?',
-                             (new_chat_id, datetime.now().isoformat(), username))
-                conn.commit()
-                return new_chat_id
-        else:
-            cursor.execute('INSERT INTO active_chats (username, chat_id, last_activity) VALUES (?, 1, ?)',
-                         (username, datetime.now().isoformat()))
-            conn.commit()
-            return 1
+        tracker = _get_session_tracker(cursor)
+        chat_id = tracker.touch(username, datetime.now())
+        tracker.flush(cursor)
+        conn.commit()
+        return chat_id
 
+@metrics.timed(metrics.DB_QUERY_SECONDS)
 def get_chat_statistics():
     """Возвращает статистику чатов"""
     with get_db_connection() as conn:
@@ -204,8 +1232,9 @@ def get_chat_statistics():
             "total_users": total
         }
 
-def get_detailed_chat_statistics():
-    """Возвращает детальную статистику чатов"""
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def get_detailed_chat_statistics(closed_limit=None):
+    """Возвращает детальную статистику чатов (closed_limit - только последние закрытые в списке)"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
@@ -214,40 +1243,77 @@ def get_detailed_chat_statistics():
         cursor.execute('SELECT username, chat_id, last_activity FROM active_chats WHERE last_activity > ? ORDER BY last_activity DESC', (cutoff,))
         active_chats = [dict(row) for row in cursor.fetchall()]
         
-        cursor.execute('SELECT username, chat_id, last_activity FROM active_chats WHERE last_activity <= ? ORDER BY last_activity DESC', (cutoff,))
+        cursor.execute('SELECT username, chat_id, last_activity FROM active_chats WHERE last_activity <= ? ORDER BY last_activity DESC LIMIT ?',
+                       (cutoff, -1 if closed_limit is None else closed_limit))
         closed_chats = [dict(row) for row in cursor.fetchall()]
         
+        closed_count = len(closed_chats)
+        if closed_limit is not None:
+            cursor.execute('SELECT COUNT(*) FROM active_chats WHERE last_activity <= ?', (cutoff,))
+            closed_count = cursor.fetchone()[0]
+        
         return {
             "active_chats": len(active_chats),
-            "closed_chats": len(closed_chats),
-            "total_users": len(active_chats) + len(closed_chats),
+            "closed_chats": closed_count,
+            "total_users": len(active_chats) + closed_count,
             "active_chat_list": active_chats,
             "closed_chat_list": closed_chats
         }
 
-def get_shift_messages(shift_name):
-    """Получает сообщения смены"""
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def get_shift_feed(shift_name, limit=10):
+    """Лента дашборда: последние limit входящих и исходящих смены одним запросом, новые первыми"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        
+        # Каждая ветка берет limit строк из idx_shift_type_time, общая сортировка - по 2*limit строкам
         cursor.execute('''
-            SELECT username, message, timestamp, chat_id 
-            FROM messages 
-            WHERE shift_name = ? AND message_type = 'incoming'
-            ORDER BY timestamp DESC
-        ''', (shift_name,))
-        incoming = [dict(row) for row in cursor.fetchall()]
-        
+            SELECT * FROM (
+                SELECT id, username, message, timestamp, message_type, message_type AS type, chat_id, timestamp_ms
+                FROM messages
+                WHERE shift_name = ?1 AND message_type = 'incoming'
+                ORDER BY timestamp_ms DESC, id DESC
+                LIMIT ?2
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT id, username, message, timestamp, message_type, message_type AS type, chat_id, timestamp_ms
+                FROM messages
+                WHERE shift_name = ?1 AND message_type = 'outgoing'
+                ORDER BY timestamp_ms DESC, id DESC
+                LIMIT ?2
+            )
+            ORDER BY timestamp_ms DESC, id DESC
+        ''', (shift_name, limit))
+        return [dict(row) for row in cursor.fetchall()]
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def get_shift_counts(shift_name):
+    """Возвращает счетчики смены из shift_totals одной строкой"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute('''
-            SELECT username, message, timestamp, chat_id 
-            FROM messages 
-            WHERE shift_name = ? AND message_type = 'outgoing'
-            ORDER BY timestamp DESC
+            SELECT incoming_count, outgoing_count, user_count, chat_count, first_timestamp, last_timestamp
+            FROM shift_totals
+            WHERE shift_name = ?
         ''', (shift_name,))
-        outgoing = [dict(row) for row in cursor.fetchall()]
-        
-        return incoming, outgoing
+        row = cursor.fetchone()
+    
+    if not row:
+        return {
+            "incoming_count": 0,
+            "outgoing_count": 0,
+            "total_messages": 0,
+            "user_count": 0,
+            "chat_count": 0,
+            "first_timestamp": None,
+            "last_timestamp": None
+        }
+    
+    counts = dict(row)
+    counts["total_messages"] = counts["incoming_count"] + counts["outgoing_count"]
+    return counts
 
+@metrics.timed(metrics.DB_QUERY_SECONDS)
 def get_recent_messages(limit=50):
     """Получает последние сообщения для главной страницы"""
     with get_db_connection() as conn:
@@ -255,20 +1321,375 @@ def get_recent_messages(limit=50):
         cursor.execute('''
             SELECT username, message, timestamp, message_type, chat_id
             FROM messages 
-            ORDER BY timestamp DESC 
+            ORDER BY timestamp_ms DESC, id DESC
             LIMIT ?
         ''', (limit,))
         return [dict(row) for row in cursor.fetchall()]
 
-def cleanup_old_messages(days=30):
-    """Удаляет старые сообщения (старше N дней)"""
-    cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
+CHAT_PAGE_SIZE = 100
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def get_chat_history(username, limit=CHAT_PAGE_SIZE, before=None):
+    """Возвращает страницу истории пользователя и курсор для более старых сообщений.
+
+    Сообщения страницы идут по возрастанию времени; before - курсор
+    "timestamp_ms:id" из предыдущего ответа.
+    """
+    params = [username]
+    keyset = ''
+    if before:
+        before_ms, before_id = before.split(':', 1)
+        keyset = 'AND (timestamp_ms, id) < (?, ?)'
+        params += [int(before_ms), int(before_id)]
+    
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM messages WHERE timestamp < ?', (cutoff_date,))
-        deleted = cursor.rowcount
-        conn.commit()
-        print(f"Удалено {deleted} старых сообщений")
+        cursor.execute(f'''
+            SELECT id, message, timestamp, timestamp_ms, message_type, chat_id
+            FROM messages
+            WHERE user_id = (SELECT user_id FROM users WHERE username = ?) {keyset}
+            ORDER BY timestamp_ms DESC, id DESC
+            LIMIT ?
+        ''', params + [limit + 1])
+        rows = cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['timestamp_ms']}:{rows[-1]['id']}"
+    
+    messages = [{
+        'id': row['id'],
+        'message': row['message'] or '',
+        'timestamp': row['timestamp'] or '',
+        'type': row['message_type'] or 'unknown',
+        'chat_id': row['chat_id'] or 0
+    } for row in reversed(rows)]
+    return messages, next_cursor
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def get_user_message_counts(username):
+    """Считает входящие и исходящие пользователя по агрегатам смен"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT message_type, SUM(message_count) AS total
+            FROM shift_stats
+            WHERE username = ?
+            GROUP BY message_type
+        ''', (username,))
+        counts = {row['message_type']: row['total'] for row in cursor.fetchall()}
+    return counts.get('incoming', 0), counts.get('outgoing', 0)
+
+RESPONSE_METRICS_CHAT_LIMIT = 50
+
+# (таблица, столбец) для перцентилей по смене - только внутренние имена
+_LATENCY_COLUMNS = {
+    "first_response": ("chat_metrics", "first_response_seconds"),
+    "reply_latency": ("reply_latencies", "seconds"),
+    "time_to_close": ("chat_metrics", "close_seconds"),
+}
+
+def _nearest_rank(count, percent):
+    """Позиция перцентиля в отсортированной выборке по методу ближайшего ранга: ceil(p*n)-1"""
+    return (count * percent + 99) // 100 - 1
+
+def _latency_summary(cursor, table, column, shift_name):
+    """Среднее, медиана и p95 столбца по смене; перцентили берутся из индекса по OFFSET"""
+    cursor.execute(f'''
+        SELECT COUNT({column}), AVG({column}) FROM {table}
+        WHERE shift_name = ? AND {column} IS NOT NULL
+    ''', (shift_name,))
+    count, average = cursor.fetchone()
+    summary = {"count": count, "avg": average, "median": None, "p95": None}
+    for name, percent in (("median", 50), ("p95", 95)):
+        if not count:
+            break
+        cursor.execute(f'''
+            SELECT {column} FROM {table}
+            WHERE shift_name = ? AND {column} IS NOT NULL
+            ORDER BY {column}
+            LIMIT 1 OFFSET ?
+        ''', (shift_name, _nearest_rank(count, percent)))
+        summary[name] = cursor.fetchone()[0]
+    return summary
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def get_response_metrics(shift_name, chat_limit=RESPONSE_METRICS_CHAT_LIMIT):
+    """Скорость ответа операторов за смену: итоги и последние чаты"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        metrics = {
+            name: _latency_summary(cursor, table, column, shift_name)
+            for name, (table, column) in _LATENCY_COLUMNS.items()
+        }
+        
+        # Медиана и p95 ответов каждого чата - одним проходом оконной функцией,
+        # позиция считается по ближайшему рангу, как в _nearest_rank
+        cursor.execute('''
+            WITH chats AS (
+                SELECT username, chat_id, opened_at, first_response_seconds, reply_count, reply_seconds,
+                       message_count, closed_at, close_seconds
+                FROM chat_metrics
+                WHERE shift_name = ?
+                ORDER BY opened_at DESC
+                LIMIT ?
+            ), ranked AS (
+                SELECT r.username, r.chat_id, r.seconds,
+                       ROW_NUMBER() OVER (PARTITION BY r.username, r.chat_id ORDER BY r.seconds) - 1 AS position,
+                       COUNT(*) OVER (PARTITION BY r.username, r.chat_id) AS total
+                FROM reply_latencies r
+                JOIN chats c ON c.username = r.username AND c.chat_id = r.chat_id
+            ), percentiles AS (
+                SELECT username, chat_id,
+                       MAX(CASE WHEN position = (total * 50 + 99) / 100 - 1 THEN seconds END) AS median_reply_seconds,
+                       MAX(CASE WHEN position = (total * 95 + 99) / 100 - 1 THEN seconds END) AS p95_reply_seconds
+                FROM ranked
+                GROUP BY username, chat_id
+            )
+            SELECT c.*, p.median_reply_seconds, p.p95_reply_seconds
+            FROM chats c
+            LEFT JOIN percentiles p ON p.username = c.username AND p.chat_id = c.chat_id
+            ORDER BY c.opened_at DESC
+        ''', (shift_name, chat_limit))
+        chats = [dict(row) for row in cursor.fetchall()]
+    
+    metrics["shift_name"] = shift_name
+    metrics["chats"] = chats
+    return metrics
+
+SEARCH_PAGE_SIZE = 50
+_SEARCH_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+def _build_fts_query(query):
+    """Превращает строку поиска в запрос FTS5: все слова, каждое как префикс"""
+    tokens = _SEARCH_TOKEN.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def search_messages(query, limit=SEARCH_PAGE_SIZE, cursor_token=None, archive=False):
+    """Ищет сообщения через FTS5 и возвращает (результаты, курсор следующей страницы).
+
+    Результаты упорядочены по bm25, курсор - пара (rank, id) последней строки.
+    Запросы без слов (например, только эмодзи) ищутся через LIKE по убыванию id.
+    С archive=True поиск идет по архивной БД.
+    """
+    fts_query = _build_fts_query(query)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        schema = _message_schema(conn, archive)
+        
+        if fts_query:
+            params = [fts_query]
+            keyset = ''
+            if cursor_token:
+                last_rank, last_id = cursor_token.split(':')
+                keyset = 'AND (f.rank > ? OR (f.rank = ? AND f.rowid > ?))'
+                params += [float(last_rank), float(last_rank), int(last_id)]
+            cursor.execute(f'''
+                SELECT m.id, m.username, m.message, m.timestamp, m.message_type, m.shift_name, m.chat_id,
+                       f.rank AS rank
+                FROM {schema}.messages_fts f
+                JOIN {schema}.messages m ON m.id = f.rowid
+                WHERE f.messages_fts MATCH ? {keyset}
+                ORDER BY f.rank, f.rowid
+                LIMIT ?
+            ''', params + [limit + 1])
+        else:
+            params = [f"%{query}%"]
+            keyset = ''
+            if cursor_token:
+                keyset = 'AND id < ?'
+                params.append(int(cursor_token.split(':')[-1]))
+            cursor.execute(f'''
+                SELECT id, username, message, timestamp, message_type, shift_name, chat_id, 0.0 AS rank
+                FROM {schema}.messages
+                WHERE message LIKE ? {keyset}
+                ORDER BY id DESC
+                LIMIT ?
+            ''', params + [limit + 1])
+        
+        results = [dict(row) for row in cursor.fetchall()]
+    
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        next_cursor = f"{last['rank']!r}:{last['id']}"
+    for row in results:
+        del row['rank']
+    return results, next_cursor
+
+EXPORT_CHUNK_SIZE = 1000
+
+def iter_messages(date_from=None, date_to=None, shift_name=None, username=None,
+                  message_type=None, chunk_size=EXPORT_CHUNK_SIZE, archive=False):
+    """Перебирает сообщения по возрастанию времени пачками по chunk_size.
+
+    Каждая пачка - отдельный короткий запрос с курсором (timestamp_ms, id),
+    поэтому память не зависит от размера выборки и соединение не держит
+    транзакцию чтения между пачками. С archive=True читается архивная БД.
+    """
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append('timestamp_ms >= ?')
+        params.append(to_epoch_ms(date_from))
+    if date_to:
+        conditions.append('timestamp_ms < ?')
+        params.append(to_epoch_ms(date_to))
+    if shift_name:
+        conditions.append('shift_name = ?')
+        params.append(shift_name)
+    if username:
+        conditions.append('user_id = (SELECT user_id FROM main.users WHERE username = ?)')
+        params.append(username)
+    if message_type:
+        conditions.append('message_type = ?')
+        params.append(message_type)
+    
+    last_key = None
+    while True:
+        page_conditions = list(conditions)
+        page_params = list(params)
+        if last_key:
+            page_conditions.append('(timestamp_ms, id) > (?, ?)')
+            page_params += list(last_key)
+        where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
+        
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            schema = _message_schema(conn, archive)
+            cursor.execute(f'''
+                SELECT id, username, message, timestamp, timestamp_ms, message_type, shift_name, chat_id
+                FROM {schema}.messages
+                {where}
+                ORDER BY timestamp_ms, id
+                LIMIT ?
+            ''', page_params + [chunk_size])
+            rows = [dict(row) for row in cursor.fetchall()]
+        
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_key = (rows[-1]['timestamp_ms'], rows[-1]['id'])
+
+# Сообщения старше срока хранения переносятся в архивную БД пачками,
+# между пачками блокировка записи отпускается для слушателя
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_PAUSE_SECONDS = 0.05
+VACUUM_STEP_PAGES = 1000
+ARCHIVE_COLUMNS = ('id, username, message, timestamp, message_type, shift_name, chat_id, created_at, '
+                   'timestamp_ms, user_id, peer_id, tg_message_id')
+# Выбор пачки и удаление перенесенного; maintenance check-plans проверяет их планы
+ARCHIVE_SELECT_SQL = 'SELECT id FROM main.messages WHERE timestamp_ms < ? ORDER BY timestamp_ms LIMIT ?'
+ARCHIVE_DELETE_SQL = 'DELETE FROM main.messages WHERE id IN (SELECT value FROM json_each(?))'
+
+def archive_db_path():
+    """Путь архивной БД: PULSEAI_ARCHIVE_DB или <имя БД>_archive.db рядом с основной"""
+    return os.environ.get("PULSEAI_ARCHIVE_DB") or os.path.splitext(DB_PATH)[0] + "_archive.db"
+
+def _attach_archive(conn):
+    """Подключает архивную БД к соединению как схему archive, создавая ее при необходимости"""
+    attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+    if 'archive' in attached:
+        return
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_db_path(),))
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive.messages (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            message TEXT,
+            timestamp TEXT,
+            message_type TEXT,
+            shift_name TEXT,
+            chat_id INTEGER,
+            created_at DATETIME,
+            timestamp_ms INTEGER,
+            user_id INTEGER,
+            peer_id INTEGER,
+            tg_message_id INTEGER
+        )
+    ''')
+    # Архивы, созданные до ключа сообщения Telegram (схема v3)
+    columns = _column_names(cursor, 'messages', 'archive')
+    for column in ('peer_id', 'tg_message_id'):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE archive.messages ADD COLUMN {column} INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_time ON messages(timestamp_ms)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_user_time ON messages(user_id, timestamp_ms)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_shift_type_time ON messages(shift_name, message_type, timestamp_ms)')
+    _init_search_index(cursor, 'archive')
+    conn.commit()
+
+def _message_schema(conn, archive):
+    """Возвращает схему для чтения сообщений: main или подключенный архив"""
+    if not archive:
+        return 'main'
+    _attach_archive(conn)
+    return 'archive'
+
+@metrics.timed(metrics.DB_QUERY_SECONDS)
+def cleanup_old_messages(days=30, batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE_SECONDS):
+    """Переносит сообщения старше N дней в архив пачками и возвращает файлу свободное место"""
+    cutoff_ms = to_epoch_ms(datetime.now() - timedelta(days=days))
+    archived = 0
+    while True:
+        with get_db_connection() as conn:
+            _attach_archive(conn)
+            ids = [row[0] for row in conn.execute(ARCHIVE_SELECT_SQL, (cutoff_ms, batch_size))]
+            if not ids:
+                break
+            id_list = json.dumps(ids)
+            
+            # Сначала копия в архиве, потом удаление: после сбоя между ними повтор безопасен
+            conn.execute(f'''
+                INSERT OR IGNORE INTO archive.messages ({ARCHIVE_COLUMNS})
+                SELECT {ARCHIVE_COLUMNS} FROM main.messages WHERE id IN (SELECT value FROM json_each(?))
+            ''', (id_list,))
+            conn.commit()
+            conn.execute(ARCHIVE_DELETE_SQL, (id_list,))
+            conn.commit()
+        
+        archived += len(ids)
+        time.sleep(pause)
+    
+    print(f"Перенесено в архив {archived} старых сообщений")
+    _incremental_vacuum(pause)
+    return archived
+
+def _incremental_vacuum(pause=ARCHIVE_PAUSE_SECONDS):
+    """Возвращает свободные страницы файлу небольшими шагами"""
+    with get_db_connection() as conn:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            print("Файл БД не уменьшится: включите python maintenance.py enable-incremental-vacuum")
+            return 0
+        freed = 0
+        while True:
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free_pages:
+                break
+            # execute() выполняет один шаг прагмы и освобождает одну страницу,
+            # executescript доводит ее до конца
+            conn.executescript(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});')
+            freed += min(free_pages, VACUUM_STEP_PAGES)
+            time.sleep(pause)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    if freed:
+        print(f"Освобождено страниц: {freed}")
+    return freed
+
+def enable_incremental_vacuum():
+    """Однократно переводит существующую БД в auto_vacuum=INCREMENTAL (полный VACUUM)"""
+    with get_db_connection() as conn:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    print(f"auto_vacuum = {mode}")
+    return mode
 
 # Инициализируем БД при импорте
 init_database()
@@ -0,0 +1,126 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import db_handler
+import metrics
+
+# Пачка сбрасывается в БД при наборе N событий или через T миллисекунд
+INGEST_BATCH_SIZE = 200
+INGEST_FLUSH_MS = 50
+# Пачка, которую не удалось записать (например, БД занята очисткой или
+# vacuum), повторяется с нарастающей паузой, а не теряется целиком
+INGEST_RETRY_DELAYS = (0.1, 0.5, 1, 2, 5, 10)
+
+def get_shift_name(timestamp):
+    hour = timestamp.hour
+    date_str = timestamp.strftime("%Y-%m-%d")
+    if 9 <= hour < 21:
+        return f"day_{date_str}"
+    else:
+        return f"night_{date_str}"
+
+class IngestQueue:
+    """Очередь отложенной записи сообщений слушателя.
+
+    Обработчики Telethon только кладут события в очередь, а отдельная задача
+    пишет их пачками через db_handler.store_messages в потоке-писателе,
+    не блокируя цикл событий. Писатель один, поэтому порядок сообщений
+    каждого пользователя сохраняется.
+    """
+    def __init__(self, batch_size=INGEST_BATCH_SIZE, flush_ms=INGEST_FLUSH_MS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="IngestWriter")
+        self.task = None
+        self.rows_written = 0
+        self.batches_written = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    # timestamp - момент получения события обработчиком, до запроса имени собеседника;
+    # от него же считается INGEST_LATENCY_SECONDS
+    def put_incoming(self, message, shift, username=None, peer_id=None, tg_message_id=None, timestamp=None):
+        self.queue.put_nowait(('incoming', message, shift, username, timestamp or datetime.now(),
+                               peer_id, tg_message_id))
+
+    def put_outgoing(self, message, shift, username=None, peer_id=None, tg_message_id=None, timestamp=None):
+        self.queue.put_nowait(('outgoing', message, shift, username, timestamp or datetime.now(),
+                               peer_id, tg_message_id))
+
+    def put_close(self, username):
+        self.queue.put_nowait(('close', None, None, username, datetime.now()))
+
+    def put_edit(self, peer_id, tg_message_id, message):
+        self.queue.put_nowait(('edit', message, None, None, datetime.now(), peer_id, tg_message_id))
+
+    def put_delete(self, peer_id, tg_message_id):
+        self.queue.put_nowait(('delete', None, None, None, datetime.now(), peer_id, tg_message_id))
+
+    async def _collect_batch(self):
+        """Ждет первое событие и добирает пачку до лимита или таймаута"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.flush_interval
+
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _store(self, items):
+        """Записывает пачку в потоке-писателе, повторяя ее при ошибке; после последней попытки ошибка пробрасывается"""
+        loop = asyncio.get_running_loop()
+        for delay in INGEST_RETRY_DELAYS + (None,):
+            try:
+                stored = await loop.run_in_executor(self.executor, db_handler.store_messages, items)
+                break
+            except Exception:
+                metrics.INGEST_WRITE_ERRORS.inc()
+                if delay is None:
+                    raise
+                # store_messages пишет пачку одной транзакцией и откатывает ее при ошибке
+                await asyncio.sleep(delay)
+        self.rows_written += stored
+        self.batches_written += 1
+        return stored
+
+    async def write(self, items):
+        """Пишет готовую пачку (догрузка после перезапуска) тем же писателем, в обход очереди"""
+        return await self._store(items)
+
+    async def run(self):
+        while True:
+            batch = await self._collect_batch()
+            stop = batch[-1] is None
+            items = [item for item in batch if item is not None]
+
+            if items:
+                try:
+                    await self._store(items)
+                    committed = datetime.now()
+                    for item in items:
+                        metrics.INGEST_LATENCY_SECONDS.observe((committed - item[4]).total_seconds())
+                except Exception as e:
+                    metrics.INGEST_DROPPED_ITEMS.inc(len(items))
+                    print(f"Пачка из {len(items)} сообщений не записана после {len(INGEST_RETRY_DELAYS)} повторов: {e}")
+
+            if stop:
+                break
+
+    async def close(self):
+        """Дописывает все накопленные события и останавливает писателя"""
+        if self.task is None:
+            return
+        self.queue.put_nowait(None)
+        await self.task
+        self.task = None
+        self.executor.shutdown(wait=True)
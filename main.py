@@ -5,22 +5,34 @@ import signal
 import sys
 from telegram_listener import start_listener
 import uvicorn
+import notifier
 
-def run_listener():
+# Максимум событий в очереди уведомлений между процессами
+NOTIFY_QUEUE_SIZE = 1000
+# Процессы веб-сервера: сессии общие (в БД), поэтому можно занять несколько ядер
+WEB_WORKERS = max(1, int(os.environ.get("PULSEAI_WEB_WORKERS", "1")))
+
+def run_listener(channel=None):
     """Запускает Telegram слушатель"""
     try:
         print("Запуск Telegram слушателя...")
+        if channel is not None:
+            notifier.attach_queue(channel)
         start_listener()
     except KeyboardInterrupt:
         print("Telegram слушатель остановлен пользователем")
     except Exception as e:
         print(f"Ошибка Telegram слушателя: {e}")
 
-def run_web():
+def run_web(channel=None):
     """Запускает веб-сервер"""
     try:
         print("Запуск веб-сервера...")
-        uvicorn.run("web_app:app", host="127.0.0.1", port=8000, reload=False, log_level="info")
+        if channel is not None:
+            notifier.attach_queue(channel)
+        # permessage-deflate сжимает кадры /ws, если браузер его поддерживает
+        uvicorn.run("web_app:app", host="127.0.0.1", port=8000, reload=False, log_level="info",
+                    ws_per_message_deflate=True, workers=WEB_WORKERS)
     except KeyboardInterrupt:
         print("Веб-сервер остановлен пользователем")
     except Exception as e:
@@ -78,9 +90,14 @@ def main():
     # Запускаем процессы
     processes = []
     
+    # Канал уведомлений о новых сообщениях от слушателя к веб-серверу.
+    # Очередь читает только один процесс, поэтому нескольким процессам
+    # веб-сервера события рассылаются через Unix сокеты notifier
+    channel = multiprocessing.Queue(maxsize=NOTIFY_QUEUE_SIZE) if WEB_WORKERS == 1 else None
+    
     try:
         # Процесс для Telegram слушателя
-        p1 = multiprocessing.Process(target=run_listener, name="TelegramListener")
+        p1 = multiprocessing.Process(target=run_listener, args=(channel,), name="TelegramListener")
         p1.start()
         processes.append(p1)
         print(f"Telegram слушатель запущен (PID: {p1.pid})")
@@ -89,7 +106,7 @@ def main():
         time.sleep(2)
         
         # Процесс для веб-сервера
-        p2 = multiprocessing.Process(target=run_web, name="WebServer")
+        p2 = multiprocessing.Process(target=run_web, args=(channel,), name="WebServer")
         p2.start()
         processes.append(p2)
         print(f"Веб-сервер запущен (PID: {p2.pid})")
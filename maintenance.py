@@ -0,0 +1,134 @@
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+import db_handler
+import analytics
+
+def rebuild_stats():
+    """Пересчитывает агрегаты смен из сообщений"""
+    db_handler.rebuild_shift_stats()
+
+def rebuild_metrics():
+    """Пересчитывает метрики скорости ответа из сообщений"""
+    db_handler.rebuild_chat_metrics()
+
+def rebuild_analytics():
+    """Пересчитывает сводные таблицы аналитики из сообщений"""
+    analytics.rebuild_analytics()
+
+def retention(days="30"):
+    """Переносит сообщения старше N дней (по умолчанию 30) в архив и сжимает БД"""
+    db_handler.cleanup_old_messages(int(days))
+
+def enable_incremental_vacuum():
+    """Однократно включает incremental vacuum (полный VACUUM, БД блокируется)"""
+    db_handler.enable_incremental_vacuum()
+
+def _known_telegram_keys():
+    with db_handler.get_db_connection() as conn:
+        return db_handler._known_message_keys(conn.cursor(), {(1, 1), (1, 2)})
+
+def _delete_missing_telegram_message():
+    # Несуществующий id: выполняется только поиск, удалять нечего
+    with db_handler.get_db_connection() as conn:
+        return db_handler._delete_telegram_message(conn.cursor(), None, -1)
+
+def _hot_queries(username, shift_name):
+    """Вызовы db_handler (или запросы с параметрами), которые выполняются на каждый запрос страницы или сообщение"""
+    now = datetime.now()
+    return {
+        "дашборд: лента смены": lambda: db_handler.get_shift_feed(shift_name),
+        "последние сообщения": lambda: db_handler.get_recent_messages(20),
+        "история чата": lambda: db_handler.get_chat_history(username),
+        "история чата, следующая страница": lambda: db_handler.get_chat_history(
+            username, before=f"{db_handler.to_epoch_ms(now)}:{2 ** 62}"),
+        "экспорт за период": lambda: next(db_handler.iter_messages(now - timedelta(days=1), now), None),
+        "экспорт пользователя": lambda: next(db_handler.iter_messages(username=username), None),
+        "экспорт смены по типу": lambda: next(db_handler.iter_messages(shift_name=shift_name,
+                                                                       message_type='incoming'), None),
+        "поиск": lambda: db_handler.search_messages("оплата"),
+        "запись: проверка дублей Telegram": _known_telegram_keys,
+        "запись: удаление сообщения Telegram": _delete_missing_telegram_message,
+        # Очистка не запускается (она пишет в архив и сжимает файл) - проверяются только ее запросы
+        "очистка: выбор старых сообщений": (db_handler.ARCHIVE_SELECT_SQL, (0, db_handler.ARCHIVE_BATCH_SIZE)),
+        "очистка: удаление перенесенных": (db_handler.ARCHIVE_DELETE_SQL, ('[]',)),
+    }
+
+def _archive_queries():
+    """Чтения из архива; проверяются, только если архивная БД уже есть, чтобы не создавать ее"""
+    now = datetime.now()
+    return {
+        "поиск в архиве": lambda: db_handler.search_messages("оплата", archive=True),
+        "экспорт архива за период": lambda: next(db_handler.iter_messages(now - timedelta(days=60), now,
+                                                                          archive=True), None),
+    }
+
+def _messages_aliases(statement):
+    """Имена, под которыми таблица messages встречается в плане запроса"""
+    aliases = {"messages"}
+    aliases.update(re.findall(r'\bmessages\s+(?:AS\s+)?(?!WHERE|ORDER|LIMIT|JOIN|ON|GROUP)(\w+)', statement, re.I))
+    return aliases
+
+def check_plans():
+    """Проверяет, что горячие запросы не сканируют таблицу messages целиком"""
+    with db_handler.get_db_connection() as conn:
+        row = conn.execute('SELECT username, shift_name FROM messages ORDER BY id DESC LIMIT 1').fetchone()
+    username, shift_name = (row['username'], row['shift_name']) if row else ('user', 'day_2025-01-01')
+    
+    queries = _hot_queries(username, shift_name)
+    if os.path.exists(db_handler.archive_db_path()):
+        queries.update(_archive_queries())
+    else:
+        print("Архивной БД нет - запросы к архиву не проверяются")
+    
+    failures = 0
+    for name, run in queries.items():
+        statements = []
+        with db_handler.get_db_connection() as conn:
+            if isinstance(run, tuple):
+                statements.append(run)
+            else:
+                conn.set_trace_callback(lambda statement: statements.append((statement, ())))
+                try:
+                    run()
+                finally:
+                    conn.set_trace_callback(None)
+            
+            for statement, params in statements:
+                if not statement.lstrip().upper().startswith(('SELECT', 'WITH', 'DELETE', 'UPDATE')):
+                    continue
+                plan = [row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {statement}', params)]
+                aliases = _messages_aliases(statement)
+                scans = [detail for detail in plan
+                         if re.fullmatch(r'SCAN ([\w.]+)', detail) and detail.split()[1].split('.')[-1] in aliases]
+                status = "СКАН" if scans else "ok"
+                failures += bool(scans)
+                print(f"[{status:>4}] {name}: {'; '.join(plan)}")
+    
+    if failures:
+        print(f"Полное сканирование messages в {failures} запросах")
+        return 1
+    print("Все горячие запросы используют индексы")
+    return 0
+
+COMMANDS = {
+    "rebuild-stats": rebuild_stats,
+    "rebuild-metrics": rebuild_metrics,
+    "rebuild-analytics": rebuild_analytics,
+    "check-plans": check_plans,
+    "retention": retention,
+    "enable-incremental-vacuum": enable_incremental_vacuum,
+}
+
+def main(argv):
+    if not argv or argv[0] not in COMMANDS:
+        print("Использование: python maintenance.py <команда>")
+        for name, command in COMMANDS.items():
+            print(f"   {name:<26} {command.__doc__}")
+        return 1
+    return COMMANDS[argv[0]](*argv[1:]) or 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
\ No newline at end of file
@@ -0,0 +1,169 @@
+import time
+import bisect
+import asyncio
+from functools import wraps
+
+import notifier
+
+# Метрики процесса в текстовом формате Prometheus.
+# Счетчики - обычные списки чисел без блокировок: под GIL одновременные
+# увеличения из разных потоков могут изредка потеряться, что для метрик
+# допустимо, зато запись не аллоцирует и не ждет. Процесс слушателя
+# отправляет снимок своих метрик веб-серверу через notifier, и /metrics
+# показывает оба процесса с меткой process.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = 0.5
+METRICS_PUBLISH_SECONDS = 15
+
+PROCESS = "web"
+
+_histograms = []
+_counters = []
+_gauges = []
+_remote = {}
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и одной необязательной меткой"""
+    def __init__(self, name, help_text, label=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        # значение метки -> [счетчики корзин..., +Inf, сумма]
+        self.series = {}
+        _histograms.append(self)
+
+    def observe(self, value, label_value=""):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series.setdefault(label_value, [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+class Counter:
+    """Счетчик с одной необязательной меткой; в отличие от gauge передается из слушателя"""
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        # значение метки -> [значение]
+        self.series = {}
+        _counters.append(self)
+
+    def inc(self, value=1, label_value=""):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series.setdefault(label_value, [0])
+        series[0] += value
+
+def gauge(name, help_text, callback, metric_type="gauge"):
+    """Регистрирует значение, которое считается при выдаче /metrics.
+
+    callback возвращает число или словарь {значение метки: число}, тогда
+    имя метки передается как name:label.
+    """
+    _gauges.append((name, help_text, metric_type, callback))
+
+def timed(histogram):
+    """Декоратор: время вызова функции в гистограмме с меткой по ее имени"""
+    def decorator(func):
+        name = func.__name__
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
+
+DB_QUERY_SECONDS = Histogram("pulseai_db_query_seconds", "Время вызова функций db_handler", "function")
+INGEST_LATENCY_SECONDS = Histogram("pulseai_ingest_latency_seconds",
+                                   "Время от получения события Telegram обработчиком до фиксации в БД")
+LOOP_LAG_SECONDS = Histogram("pulseai_event_loop_lag_seconds", "Опоздание пробуждения цикла событий")
+WS_FANOUT_SECONDS = Histogram("pulseai_ws_fanout_seconds", "Время рассылки сообщения всем WebSocket клиентам")
+PEER_LOOKUP_SECONDS = Histogram("pulseai_peer_lookup_seconds", "Запросы сущностей Telegram при промахе кэша имен")
+INGEST_WRITE_ERRORS = Counter("pulseai_ingest_write_errors_total", "Неудачные попытки записи пачки слушателя")
+INGEST_DROPPED_ITEMS = Counter("pulseai_ingest_dropped_total", "События, потерянные после всех повторов записи пачки")
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """Замеряет, насколько позже положенного просыпается цикл событий"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(loop.time() - expected, 0.0))
+
+def snapshot():
+    """Текущие значения гистограмм и счетчиков процесса для передачи другому процессу"""
+    return {metric.name: {label: list(series) for label, series in list(metric.series.items())}
+            for metric in _histograms + _counters}
+
+async def publish_periodically(interval=METRICS_PUBLISH_SECONDS):
+    """Отправляет снимок метрик веб-серверу через notifier"""
+    while True:
+        await asyncio.sleep(interval)
+        notifier.publish({"type": "metrics", "process": PROCESS, "metrics": snapshot()})
+
+def merge_remote(event):
+    """Запоминает снимок метрик другого процесса"""
+    _remote[event["process"]] = event["metrics"]
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(pairs):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    """Возвращает метрики в текстовом формате Prometheus"""
+    lines = []
+    for histogram in _histograms:
+        lines.append(f"# HELP {histogram.name} {histogram.help}")
+        lines.append(f"# TYPE {histogram.name} histogram")
+        sources = [(PROCESS, histogram.series)]
+        sources += [(process, values.get(histogram.name, {})) for process, values in sorted(list(_remote.items()))]
+        for process, all_series in sources:
+            # observe() может добавить метку из другого потока - перебираем копию, как snapshot()
+            for label_value, series in sorted(list(all_series.items())):
+                pairs = [("process", process)]
+                if histogram.label:
+                    pairs.append((histogram.label, label_value))
+                total = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), series[:-1]):
+                    total += count
+                    lines.append(f"{histogram.name}_bucket{_labels(pairs + [('le', bound)])} {total}")
+                lines.append(f"{histogram.name}_sum{_labels(pairs)} {_format_number(series[-1])}")
+                lines.append(f"{histogram.name}_count{_labels(pairs)} {total}")
+
+    for counter in _counters:
+        lines.append(f"# HELP {counter.name} {counter.help}")
+        lines.append(f"# TYPE {counter.name} counter")
+        sources = [(PROCESS, counter.series)]
+        sources += [(process, values.get(counter.name, {})) for process, values in sorted(list(_remote.items()))]
+        for process, all_series in sources:
+            for label_value, series in sorted(list(all_series.items())):
+                pairs = [("process", process)]
+                if counter.label:
+                    pairs.append((counter.label, label_value))
+                lines.append(f"{counter.name}{_labels(pairs)} {_format_number(series[0])}")
+
+    for name, help_text, metric_type, callback in _gauges:
+        name, _, label = name.partition(":")
+        try:
+            value = callback()
+        except Exception as e:
+            print(f"Ошибка метрики {name}: {e}")
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if isinstance(value, dict):
+            for label_value, number in sorted(value.items()):
+                lines.append(f"{name}{_labels([(label, label_value)])} {_format_number(number)}")
+        else:
+            lines.append(f"{name} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
\ No newline at end of file
@@ -1,63 +1,181 @@
 import json
 import os
-import sqlite3
+import sys
+import time
+import hashlib
 from datetime import datetime
-from db_handler import init_database, add_message
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from db_handler import init_database, get_db_connection, intern_users, reset_user_ids, to_epoch_ms
 
-def migrate_json_to_sqlite():
+# Файлы разбираются параллельно в процессах, а пишутся в БД по одному:
+# у SQLite один писатель, поэтому каждый файл - одна транзакция с executemany
+IMPORT_WORKERS = max(1, min(4, os.cpu_count() or 1))
+IMPORT_HASH_CHUNK = 500
+
+def init_import_tables():
+    """Создает таблицы учета импорта, по которым повторный запуск пропускает уже перенесенное"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        # Хэш содержимого файла: неизменный файл не разбирается повторно
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS imported_files (
+                filename TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                imported_at TEXT NOT NULL
+            )
+        ''')
+
+        # Хэш каждого сообщения: дописанный файл добавляет только новые строки
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS imported_messages (
+                hash BLOB PRIMARY KEY
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+
+def _message_hash(shift_name, message_type, msg):
+    key = json.dumps([shift_name, message_type, msg.get('username'), msg.get('chat_id'),
+                      msg.get('timestamp'), msg.get('message', '')], ensure_ascii=False)
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+def read_shift_file(filepath, imported_sha256=None):
+    """Разбирает JSON файл смены: (имя файла, sha256, строки для messages в порядке времени).
+
+    Файл читается один раз: если его sha256 совпал с imported_sha256, разбор
+    пропускается и вместо строк возвращается None.
+    """
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    filename = os.path.basename(filepath)
+    sha256 = hashlib.sha256(content).hexdigest()
+    if sha256 == imported_sha256:
+        return filename, sha256, None
+    data = json.loads(content)
+    shift_name = filename[:-5]  # убираем .json
+    fallback = datetime.fromtimestamp(os.path.getmtime(filepath)).isoformat()
+
+    rows = []
+    for message_type in ('incoming', 'outgoing'):
+        for msg in data.get(message_type, []):
+            # Время сообщения берется из файла, а не момента импорта
+            timestamp = msg.get('timestamp') or fallback
+            rows.append((
+                msg.get('username'),
+                msg.get('message', ''),
+                timestamp,
+                message_type,
+                shift_name,
+                msg.get('chat_id'),
+                to_epoch_ms(timestamp),
+                _message_hash(shift_name, message_type, msg)
+            ))
+    rows.sort(key=lambda row: row[6])
+    return filename, sha256, rows
+
+def _import_rows(cursor, filename, sha256, rows):
+    """Пишет строки одного файла, пропуская уже импортированные; возвращает число новых"""
+    hashes = [row[7] for row in rows]
+    known = set()
+    for start in range(0, len(hashes), IMPORT_HASH_CHUNK):
+        chunk = hashes[start:start + IMPORT_HASH_CHUNK]
+        cursor.execute(f'''
+            SELECT hash FROM imported_messages WHERE hash IN ({','.join('?' * len(chunk))})
+        ''', chunk)
+        known.update(row[0] for row in cursor.fetchall())
+
+    seen = set()
+    new_rows = []
+    for row in rows:
+        if row[7] not in known and row[7] not in seen:
+            seen.add(row[7])
+            new_rows.append(row)
+
+    user_ids = intern_users(cursor, [row[0] for row in new_rows])
+    cursor.executemany('''
+        INSERT INTO messages (username, message, timestamp, message_type, shift_name, chat_id,
+                              timestamp_ms, user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [row[:7] + (user_ids.get(row[0]),) for row in new_rows])
+    cursor.executemany('INSERT INTO imported_messages (hash) VALUES (?)', [(row[7],) for row in new_rows])
+    cursor.execute('''
+        INSERT INTO imported_files (filename, sha256, message_count, imported_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(filename) DO UPDATE SET
+            sha256 = excluded.sha256,
+            message_count = excluded.message_count,
+            imported_at = excluded.imported_at
+    ''', (filename, sha256, len(rows), datetime.now().isoformat()))
+    return len(new_rows)
+
+def migrate_json_to_sqlite(learning_dir="Learning", workers=IMPORT_WORKERS):
     """Переносит данные из JSON файлов в SQLite"""
     print("Начинаем миграцию данных из JSON в SQLite...")
-    
+
     init_database()
-    total_messages = 0
-    
-    learning_dir = "Learning"
+    init_import_tables()
+
     if not os.path.exists(learning_dir):
-        print("Папка Learning не найдена")
-        return
-    
-    for filename in os.listdir(learning_dir):
-        if filename.endswith('.json'):
-            print(f"Обрабатываем файл: {filename}")
-            shift_name = filename[:-5]  # убираем .json
-            
-            filepath = os.path.join(learning_dir, filename)
+        print(f"Папка {learning_dir} не найдена")
+        return 0
+
+    with get_db_connection() as conn:
+        imported = dict(conn.execute('SELECT filename, sha256 FROM imported_files').fetchall())
+
+    # Неизменные файлы отсеивает сам разбор по sha256 - каждый файл читается один раз
+    paths = [os.path.join(learning_dir, filename)
+             for filename in sorted(os.listdir(learning_dir)) if filename.endswith('.json')]
+
+    total_messages = 0
+    total_rows = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor, get_db_connection() as conn:
+        cursor = conn.cursor()
+        queued = iter(paths)
+
+        def submit(path):
+            return path, executor.submit(read_shift_file, path, imported.get(os.path.basename(path)))
+
+        # Разбор идет не дальше чем на несколько файлов вперед записи, чтобы не держать в памяти весь архив
+        pending = deque(submit(path) for path in islice(queued, workers * 2))
+        while pending:
+            path, future = pending.popleft()
+            for next_path in islice(queued, 1):
+                pending.append(submit(next_path))
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # Переносим входящие сообщения
-                for msg in data.get('incoming', []):
-                    add_message(
-                        message=msg.get('message', ''),
-                        shift=shift_name,
-                        username=msg.get('username'),
-                        message_type='incoming',
-                        chat_id=msg.get('chat_id')
-                    )
-                    total_messages += 1
-                
-                # Переносим исходящие сообщения
-                for msg in data.get('outgoing', []):
-                    add_message(
-                        message=msg.get('message', ''),
-                        shift=shift_name,
-                        username=msg.get('username'),
-                        message_type='outgoing',
-                        chat_id=msg.get('chat_id')
-                    )
-                    total_messages += 1
-                    
+                filename, sha256, rows = future.result()
+                if rows is None:
+                    print(f"Пропускаем без изменений: {filename}")
+                    continue
+                file_started = time.perf_counter()
+                conn.execute('BEGIN IMMEDIATE')
+                added = _import_rows(cursor, filename, sha256, rows)
+                conn.commit()
             except Exception as e:
-                print(f"Ошибка обработки файла {filename}: {e}")
-    
-    print(f"Миграция завершена. Перенесено сообщений: {total_messages}")
-    
+                if conn.in_transaction:
+                    conn.rollback()
+                reset_user_ids()
+                print(f"Ошибка обработки файла {os.path.basename(path)}: {e}")
+                continue
+
+            elapsed = time.perf_counter() - file_started
+            total_messages += added
+            total_rows += len(rows)
+            print(f"Обработан файл: {filename} - новых {added} из {len(rows)}, "
+                  f"{len(rows) / elapsed if elapsed else 0:.0f} строк/с")
+
+    elapsed = time.perf_counter() - started
+    print(f"Миграция завершена. Перенесено сообщений: {total_messages} из {total_rows} "
+          f"за {elapsed:.1f} с ({total_rows / elapsed if elapsed else 0:.0f} строк/с)")
+
     # Создаем резервную копию JSON файлов
-    backup_dir = "Learning_backup"
+    backup_dir = learning_dir.rstrip(os.sep) + "_backup"
     if not os.path.exists(backup_dir):
         os.makedirs(backup_dir)
         print(f"Создана резервная копия в {backup_dir}")
+    return total_messages
 
 if __name__ == "__main__":
-    migrate_json_to_sqlite()
\ No newline at end of file
+    migrate_json_to_sqlite(*sys.argv[1:2])
\ No newline at end of file
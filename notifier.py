@@ -0,0 +1,113 @@
+import os
+import glob
+import json
+import time
+import queue
+import socket
+import threading
+
+# Канал уведомлений между процессом слушателя и веб-сервером.
+# Если процессы запущены из main.py, используется multiprocessing.Queue,
+# если по отдельности или веб-сервер запущен в нескольких процессах -
+# локальные Unix сокеты (датаграммы): каждый подписчик слушает свой сокет
+# <NOTIFY_SOCKET_PATH>.<pid>, а публикация рассылает событие во все.
+# По умолчанию сокеты лежат рядом с БД (PULSEAI_DB, как в db_handler), а не
+# в текущем каталоге: процессы, запущенные из разных мест, но пишущие в одну
+# БД, находят друг друга.
+_DB_DIR = os.path.dirname(os.path.abspath(os.environ.get("PULSEAI_DB", "pulseai.db")))
+NOTIFY_SOCKET_PATH = os.environ.get("PULSEAI_NOTIFY_SOCKET", os.path.join(_DB_DIR, "pulseai_notify.sock"))
+NOTIFY_MAX_DATAGRAM = 256 * 1024
+NOTIFY_RESCAN_SECONDS = 1.0
+
+_queue = None
+_socket = None
+_subscribers = []
+_scanned_at = 0.0
+
+def attach_queue(channel):
+    """Подключает очередь, созданную в main.main"""
+    global _queue
+    _queue = channel
+
+def _subscriber_paths():
+    """Сокеты подписчиков; список перечитывается не чаще раза в NOTIFY_RESCAN_SECONDS"""
+    global _subscribers, _scanned_at
+    now = time.monotonic()
+    if now - _scanned_at > NOTIFY_RESCAN_SECONDS:
+        _subscribers = glob.glob(glob.escape(NOTIFY_SOCKET_PATH) + ".*")
+        _scanned_at = now
+    return _subscribers
+
+def publish(event):
+    """Отправляет событие веб-серверу, не блокируя вызывающего"""
+    global _socket
+
+    if _queue is not None:
+        try:
+            _queue.put_nowait(event)
+        except queue.Full:
+            pass
+        return
+
+    if not hasattr(socket, "AF_UNIX"):
+        return
+
+    paths = _subscriber_paths()
+    if not paths:
+        return
+    if _socket is None:
+        _socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        _socket.setblocking(False)
+    data = json.dumps(event, ensure_ascii=False).encode("utf-8")
+    for path in paths:
+        try:
+            _socket.sendto(data, path)
+        except ConnectionRefusedError:
+            # Сокет остался от завершившегося процесса
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        except OSError:
+            # Подписчик не успевает читать - событие не критично
+            pass
+
+def _read_queue(callback):
+    while True:
+        event = _queue.get()
+        if event is None:
+            break
+        callback(event)
+
+def _read_socket(sock, callback):
+    while True:
+        try:
+            data = sock.recv(NOTIFY_MAX_DATAGRAM)
+        except OSError:
+            break
+        try:
+            callback(json.loads(data.decode("utf-8")))
+        except ValueError:
+            continue
+
+def subscribe(callback):
+    """Запускает фоновый поток, вызывающий callback для каждого события"""
+    global _scanned_at
+    if _queue is not None:
+        target, args = _read_queue, (callback,)
+    elif hasattr(socket, "AF_UNIX"):
+        path = f"{NOTIFY_SOCKET_PATH}.{os.getpid()}"
+        if os.path.exists(path):
+            os.remove(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        # Публикации из этого же процесса сразу увидят новый сокет
+        _scanned_at = 0.0
+        target, args = _read_socket, (sock, callback)
+    else:
+        print("Канал уведомлений недоступен: обновления только по таймеру")
+        return None
+
+    thread = threading.Thread(target=target, args=args, name="NotifyReader", daemon=True)
+    thread.start()
+    return thread
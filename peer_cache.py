@@ -0,0 +1,122 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+import db_handler
+import metrics
+
+# Имена собеседников по peer id для обработчиков слушателя. Без кэша каждое
+# сообщение стоило get_sender()/get_chat(), а перезапуск - запроса на каждого
+# клиента. Устаревшее имя (старше PEER_REFRESH_SECONDS) отдается сразу и
+# обновляется в фоне. Новые имена сохраняются в peer_names пачкой раз в
+# PEER_FLUSH_SECONDS, чтобы не добавлять писателей к очереди записи.
+PEER_CACHE_SIZE = 10000
+PEER_REFRESH_SECONDS = 24 * 3600
+PEER_FLUSH_SECONDS = 30
+PEER_RETENTION_DAYS = 30
+
+def display_name(entity):
+    """Имя собеседника, под которым хранятся его сообщения"""
+    return getattr(entity, 'username', None) or getattr(entity, 'first_name', None) or f"user_{entity.id}"
+
+class PeerCache:
+    """LRU кэш peer id -> имя с сохранением в БД и ленивым обновлением"""
+    def __init__(self, size=PEER_CACHE_SIZE, refresh_seconds=PEER_REFRESH_SECONDS):
+        self.size = size
+        self.refresh_seconds = refresh_seconds
+        # peer id -> (имя, когда получено)
+        self.entries = OrderedDict()
+        # peer id -> задача запроса сущности, одна на собеседника
+        self.pending = {}
+        self.dirty = {}
+        self.hits = 0
+        self.lookups = 0
+
+    def load(self):
+        """Загружает сохраненные имена; вызывается до подключения к Telegram"""
+        for peer_id, name, resolved_at in db_handler.load_peer_names(self.size):
+            self.entries[peer_id] = (name, resolved_at)
+        return len(self.entries)
+
+    def _remember(self, peer_id, name, resolved_at):
+        self.entries[peer_id] = (name, resolved_at)
+        self.entries.move_to_end(peer_id)
+        self.dirty[peer_id] = (peer_id, name, resolved_at)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return name
+
+    async def _lookup(self, peer_id, fetch):
+        self.lookups += 1
+        started = time.perf_counter()
+        try:
+            entity = await fetch()
+        finally:
+            metrics.PEER_LOOKUP_SECONDS.observe(time.perf_counter() - started)
+        return self._remember(peer_id, display_name(entity), time.time())
+
+    async def _refresh(self, peer_id, fetch):
+        try:
+            return await self._lookup(peer_id, fetch)
+        except Exception as e:
+            print(f"Ошибка обновления собеседника {peer_id}: {e}")
+            return None
+
+    def _start(self, peer_id, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.pending[peer_id] = task
+        task.add_done_callback(lambda _: self.pending.pop(peer_id, None))
+        return task
+
+    async def resolve(self, peer_id, entity, fetch):
+        """Имя собеседника.
+
+        entity - сущность, пришедшая вместе с обновлением (event.sender или
+        event.chat), или None; fetch - корутинная функция запроса сущности
+        (event.get_sender или event.get_chat), вызывается только при промахе.
+        """
+        now = time.time()
+        entry = self.entries.get(peer_id)
+        if entity is not None:
+            # Сущность из обновления ничего не стоит - сразу освежаем по ней
+            self.hits += 1
+            name = display_name(entity)
+            if entry is None or entry[0] != name or now - entry[1] > self.refresh_seconds:
+                return self._remember(peer_id, name, now)
+            self.entries.move_to_end(peer_id)
+            return name
+
+        if entry is None:
+            # Пачка сообщений нового клиента ждет один общий запрос
+            task = self.pending.get(peer_id) or self._start(peer_id, self._lookup(peer_id, fetch))
+            name = await asyncio.shield(task)
+            # None - неудачное фоновое обновление вытесненной записи
+            return name if name is not None else await self._lookup(peer_id, fetch)
+
+        self.hits += 1
+        self.entries.move_to_end(peer_id)
+        if now - entry[1] > self.refresh_seconds and peer_id not in self.pending:
+            self._start(peer_id, self._refresh(peer_id, fetch))
+        return entry[0]
+
+    def flush(self):
+        """Сохраняет новые и обновленные имена в БД"""
+        if not self.dirty:
+            return 0
+        dirty, self.dirty = self.dirty, {}
+        try:
+            db_handler.save_peer_names(list(dirty.values()), PEER_RETENTION_DAYS)
+        except Exception:
+            # Не сохраненное попробуем записать при следующем сбросе
+            self.dirty = {**dirty, **self.dirty}
+            raise
+        return len(dirty)
+
+    async def flush_periodically(self, interval=PEER_FLUSH_SECONDS):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                print(f"Ошибка сохранения имен собеседников: {e}")
@@ -9,9 +9,15 @@ except ImportError as e:
     print("Ошибка импорта Telethon!")
     exit(1)
 
-from db_handler import add_incoming, add_outgoing
+from db_handler import is_greeting_message
+from ingest import IngestQueue, get_shift_name
+from peer_cache import PeerCache
+from catchup import catch_up
+import analytics
+import metrics
 from datetime import datetime
 import asyncio
+import signal
 
 api_id = 20971051
 api_hash = '24e5cd5f0fd8c083cdb49f2bc7f46992'
@@ -31,58 +37,105 @@ except Exception as e:
     print(f"Ошибка создания клиента: {e}")
     exit(1)
 
-def get_shift_name(timestamp):
-    hour = timestamp.hour
-    date_str = timestamp.strftime("%Y-%m-%d")
-    if 9 <= hour < 21:
-        return f"day_{date_str}"
-    else:
-        return f"night_{date_str}"
-
 async def start_listener_async():
     print("Запуск Telegram слушателя...")
+    # Очередь начинает писать после догрузки пропущенного: так сообщения
+    # каждого чата попадают в БД по порядку, а живые дубли отбрасываются по id
+    ingest = IngestQueue()
+    peers = PeerCache()
+    print(f"Загружено имен собеседников: {peers.load()}")
+
+    # Метрики слушателя веб-сервер получает через notifier и показывает в /metrics
+    metrics.PROCESS = "listener"
+    background = [asyncio.create_task(metrics.monitor_loop_lag()),
+                  asyncio.create_task(metrics.publish_periodically()),
+                  asyncio.create_task(peers.flush_periodically()),
+                  # Сводки аналитики пишет тот же поток, что и сообщения, - без второго писателя
+                  asyncio.create_task(analytics.refresh_periodically(ingest.executor))]
 
     @client.on(events.NewMessage(incoming=True))
     async def handle_incoming(event):
+        # Время получения, а не event.message.date: у Telegram оно с точностью до секунды
+        received = datetime.now()
         try:
-            sender = await event.get_sender()
-            username = sender.username or sender.first_name or f"user_{sender.id}"
+            username = await peers.resolve(event.sender_id, event.sender, event.get_sender)
             message = event.message.message or ""
             
             print(f"[ВХОДЯЩЕЕ] {username}: {message[:50]}...")
-            add_incoming(message, get_shift_name(datetime.now()), username)
+            ingest.put_incoming(message, get_shift_name(received), username, event.chat_id, event.message.id,
+                                received)
             
         except Exception as e:
             print(f"Ошибка обработки входящего: {e}")
 
     @client.on(events.NewMessage(outgoing=True))
     async def handle_outgoing(event):
+        received = datetime.now()
         try:
-            chat = await event.get_chat()
-            username = getattr(chat, 'username', None) or getattr(chat, 'first_name', None) or f"user_{chat.id}"
+            username = await peers.resolve(event.chat_id, event.chat, event.get_chat)
             message = event.message.message or ""
             
             print(f"[ИСХОДЯЩЕЕ] для {username}: {message[:50]}...")
-            add_outgoing(message, get_shift_name(datetime.now()), username)
+            ingest.put_outgoing(message, get_shift_name(received), username, event.chat_id, event.message.id,
+                                received)
             
             # Проверяем, является ли сообщение прощальным
-            from db_handler import is_greeting_message, force_close_chat
             if is_greeting_message(message):
-                force_close_chat(username)
+                ingest.put_close(username)
                 print(f"Чат с {username} автоматически закрыт (прощальное сообщение)")
             
         except Exception as e:
             print(f"Ошибка обработки исходящего: {e}")
 
+    # Правки и удаления идут через ту же очередь, поэтому применяются после записи самого сообщения
+    @client.on(events.MessageEdited())
+    async def handle_edited(event):
+        try:
+            ingest.put_edit(event.chat_id, event.message.id, event.message.message or "")
+        except Exception as e:
+            print(f"Ошибка обработки правки: {e}")
+
+    @client.on(events.MessageDeleted())
+    async def handle_deleted(event):
+        try:
+            # В личных чатах Telegram не сообщает диалог - chat_id тогда None
+            for message_id in event.deleted_ids:
+                ingest.put_delete(event.chat_id, message_id)
+        except Exception as e:
+            print(f"Ошибка обработки удаления: {e}")
+
+    # SIGTERM от main.py отключает клиента, чтобы очередь успела дописаться
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, lambda: asyncio.ensure_future(client.disconnect()))
+    except (NotImplementedError, AttributeError):
+        pass
+
     try:
         print("Подключение к Telegram...")
         await client.start()
+        try:
+            dialogs, stored = await catch_up(client, peers, ingest.write)
+            print(f"Догружено пропущенных сообщений: {stored} из {dialogs} диалогов")
+        except Exception as e:
+            print(f"Ошибка догрузки пропущенных сообщений: {e}")
+        ingest.start()
         print("Telegram слушатель успешно запущен!")
         await client.run_until_disconnected()
         
     except Exception as e:
         print(f"Ошибка запуска: {e}")
         raise
+    finally:
+        for task in background:
+            task.cancel()
+        await ingest.close()
+        print(f"Очередь записи сброшена: {ingest.rows_written} сообщений, {ingest.batches_written} пачек")
+        try:
+            peers.flush()
+        except Exception as e:
+            print(f"Ошибка сохранения имен собеседников: {e}")
+        print(f"Имена собеседников: {peers.hits} из кэша, {peers.lookups} запросов к Telegram")
 
 def start_listener():
     try:
@@ -130,53 +130,115 @@ const Notifications = {
     }
 };
 
-const WebSocketManager = {
-    init() {
-        this.connect();
+// Живые обновления /ws: снимок при подключении, дальше только изменения с номером seq.
+// При переподключении сервер досылает пропущенное по since=epoch:seq.
+// Страница передает в connect свои обработчики: onStats(данные в формате /api/stats),
+// onMessage(новое сообщение) и onStatus(подключено, текст).
+const LiveUpdates = {
+    state: { epoch: null, seq: 0, counters: {}, chats: new Map() },
+    handlers: {},
+
+    url() {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const since = this.state.epoch ? `?since=${this.state.epoch}:${this.state.seq}` : '';
+        return `${protocol}//${window.location.host}/ws${since}`;
+    },
+
+    // Возвращает 'stats', тип сообщения, 'gap' при пропуске seq или null для повтора
+    apply(data) {
+        const live = this.state;
+        if (data.type === 'snapshot') {
+            live.epoch = data.epoch;
+            live.seq = data.seq;
+            live.counters = data.counters || {};
+            live.chats = new Map((data.chats || []).map(chat => [chat.username, chat]));
+            return 'stats';
+        }
+        if (data.seq <= live.seq) return null;
+        if (data.seq !== live.seq + 1) return 'gap';
+        live.seq = data.seq;
+        if (data.type === 'delta') {
+            Object.assign(live.counters, data.counters);
+            data.chats.upsert.forEach(chat => live.chats.set(chat.username, chat));
+            data.chats.remove.forEach(username => live.chats.delete(username));
+            return 'stats';
+        }
+        return data.type;
     },
 
-    connect() {
+    // Статистика в прежнем формате /api/stats
+    stats() {
+        const live = this.state;
+        const chats = Array.from(live.chats.values())
+            .sort((a, b) => (b.last_activity || '').localeCompare(a.last_activity || ''));
+        return {
+            chat_stats: {
+                active_chats: live.counters.active_chats,
+                closed_chats: live.counters.closed_chats,
+                total_users: live.counters.total_users,
+                active_chat_list: chats.filter(chat => chat.state === 'active'),
+                closed_chat_list: chats.filter(chat => chat.state === 'closed')
+            },
+            incoming_count: live.counters.incoming_count,
+            outgoing_count: live.counters.outgoing_count,
+            total_messages: live.counters.total_messages,
+            shift: live.counters.shift,
+            timestamp: new Date().toLocaleTimeString('uk-UA')
+        };
+    },
+
+    connect(handlers) {
+        if (handlers) {
+            this.handlers = handlers;
+        }
+        const onStatus = this.handlers.onStatus || updateConnectionStatus;
+
         if (window.PulseAI.reconnectAttempts >= window.PulseAI.maxReconnectAttempts) {
             console.error('Максимальное количество попыток переподключения достигнуто');
-            this.updateConnectionStatus(false, 'Помилка підключення');
+            onStatus(false, 'Помилка підключення');
             return;
         }
 
-        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws`;
-
         try {
-            window.PulseAI.ws = new WebSocket(wsUrl);
+            const ws = window.PulseAI.ws = new WebSocket(this.url());
 
-            window.PulseAI.ws.onopen = () => {
+            ws.onopen = () => {
                 console.log('WebSocket підключено');
                 window.PulseAI.reconnectAttempts = 0;
-                this.updateConnectionStatus(true, 'Онлайн');
+                onStatus(true, 'Онлайн');
             };
 
-            window.PulseAI.ws.onmessage = (event) => {
+            ws.onmessage = (event) => {
                 try {
                     const data = JSON.parse(event.data);
-                    this.handleMessage(data);
+                    const kind = this.apply(data);
+                    if (kind === 'gap') {
+                        // Часть сообщений выброшена - переподключаемся и досылаем по seq
+                        ws.close();
+                    } else if (kind === 'stats' && this.handlers.onStats) {
+                        this.handlers.onStats(this.stats());
+                    } else if (kind === 'new_message' && this.handlers.onMessage) {
+                        this.handlers.onMessage(data);
+                    }
                 } catch (error) {
                     console.error('Помилка обробки повідомлення:', error);
                 }
             };
 
-            window.PulseAI.ws.onclose = () => {
+            ws.onclose = () => {
                 console.log('WebSocket відключено');
-                this.updateConnectionStatus(false, 'Відключено');
+                onStatus(false, 'Відключено');
                 this.scheduleReconnect();
             };
 
-            window.PulseAI.ws.onerror = (error) => {
+            ws.onerror = (error) => {
                 console.error('WebSocket помилка:', error);
-                this.updateConnectionStatus(false, 'Помилка підключення');
+                onStatus(false, 'Помилка підключення');
             };
 
         } catch (error) {
             console.error('Не вдалося створити WebSocket:', error);
-            this.updateConnectionStatus(false, 'WebSocket недоступний');
+            onStatus(false, 'WebSocket недоступний');
             this.scheduleReconnect();
         }
     },
@@ -185,64 +247,33 @@ const WebSocketManager = {
         if (window.PulseAI.reconnectAttempts < window.PulseAI.maxReconnectAttempts) {
             window.PulseAI.reconnectAttempts++;
             const delay = window.PulseAI.config.wsReconnectDelay * window.PulseAI.reconnectAttempts;
-            
-            this.updateConnectionStatus(false, `Переподключення ${window.PulseAI.reconnectAttempts}/${window.PulseAI.maxReconnectAttempts}`);
-            
+            const onStatus = this.handlers.onStatus || updateConnectionStatus;
+
+            onStatus(false, `Переподключення ${window.PulseAI.reconnectAttempts}/${window.PulseAI.maxReconnectAttempts}`);
+
             setTimeout(() => {
                 this.connect();
             }, delay);
         }
-    },
+    }
+};
 
-    handleMessage(data) {
-        switch (data.type) {
-            case 'update':
-                if (window.updateStats) {
-                    window.updateStats(data.data);
-                }
-                break;
-            case 'new_message':
-                this.handleNewMessage(data);
-                break;
-            case 'ping':
-                break;
-            default:
-                console.log('Неизвестный тип сообщения:', data.type);
-        }
-    },
+function updateConnectionStatus(connected, text) {
+    const indicators = document.querySelectorAll('.status-indicator');
+    const statusTexts = document.querySelectorAll('#connection-text');
 
-    handleNewMessage(data) {
-        Notifications.info(`Нове повідомлення від ${data.username || 'невідомого'}`);
-        
-        if ('Notification' in window && Notification.permission === 'granted') {
-            new Notification('Нове повідомлення PulseAi', {
-                body: `${data.username}: ${Utils.truncateText(data.message, 50)}`,
-                icon: '/favicon.ico'
-            });
-        }
+    indicators.forEach(indicator => {
+        indicator.className = connected ? 
+            'status-indicator status-online' : 
+            'status-indicator status-offline';
+    });
 
-        if (window.refreshMessages) {
-            window.refreshMessages();
+    statusTexts.forEach(textElement => {
+        if (textElement) {
+            textElement.textContent = text;
         }
-    },
-
-    updateConnectionStatus(connected, text) {
-        const indicators = document.querySelectorAll('.status-indicator');
-        const statusTexts = document.querySelectorAll('#connection-text');
-
-        indicators.forEach(indicator => {
-            indicator.className = connected ? 
-                'status-indicator status-online' : 
-                'status-indicator status-offline';
-        });
-
-        statusTexts.forEach(textElement => {
-            if (textElement) {
-                textElement.textContent = text;
-            }
-        });
-    }
-};
+    });
+}
 
 const ApiClient = {
     async request(url, options = {}) {
@@ -356,7 +387,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     Notifications.init();
     SearchManager.init();
-    WebSocketManager.init();
+    // WebSocket страница открывает сама: LiveUpdates.connect({ onStats, onMessage, onStatus })
 
     // Запрашиваем разрешение на уведомления
     if ('Notification' in window && Notification.permission === 'default') {
@@ -376,4 +407,5 @@ document.addEventListener('DOMContentLoaded', function() {
 // Глобальные функции
 window.showNotification = Notifications.show.bind(Notifications);
 window.apiClient = ApiClient;
+window.LiveUpdates = LiveUpdates;
 window.utils = Utils;
\ No newline at end of file
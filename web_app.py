@@ -1,16 +1,30 @@
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Depends, Query, HTTPException, Form, Cookie
-from fastapi.responses import HTMLResponse, Response, RedirectResponse
+from fastapi.responses import HTMLResponse, Response, RedirectResponse, StreamingResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from db_handler import get_shift_messages, get_chat_statistics, get_detailed_chat_statistics
-from datetime import datetime
+from db_handler import get_shift_feed, get_shift_counts, get_chat_statistics, get_detailed_chat_statistics
+from db_handler import search_messages as search_message_index, SEARCH_PAGE_SIZE
+from db_handler import get_chat_history, get_user_message_counts, CHAT_PAGE_SIZE, iter_messages
+from db_handler import get_filter_hits, get_response_metrics, open_connection_count
+from db_handler import get_recent_messages, data_version
+from db_handler import create_web_session, get_web_session, delete_web_session, count_web_sessions
+import notifier
+import metrics
+from analytics import get_analytics, ANALYTICS_PERIODS
+from datetime import datetime, timedelta
 import json
+import os
 import asyncio
-from typing import List, Optional
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional
+from collections import deque, OrderedDict
 import csv
 import io
 import secrets
+import hashlib
+import time
+import zlib
 from urllib.parse import unquote
 
 app = FastAPI()
@@ -38,34 +52,120 @@ USERS = {
     }
 }
 
-# Активные сессии
-active_sessions = {}
+# Все обращения к БД из обработчиков идут через отдельный пул потоков, а не
+# в цикле событий: медленный поиск или экспорт занимает поток пула, а
+# /health, WebSocket и остальные запросы продолжают обслуживаться. Каждый
+# поток пула держит свое соединение из пула db_handler (по одному на поток),
+# поэтому число потоков - это и число одновременных запросов к SQLite.
+# Потоков больше, чем ядер, не нужно: поиск упирается в процессор.
+DB_EXECUTOR_WORKERS = max(1, int(os.environ.get("PULSEAI_DB_WORKERS", min(4, os.cpu_count() or 1))))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="pulseai-db")
+db_pending = 0
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с БД в пуле потоков БД"""
+    global db_pending
+    db_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(db_executor, partial(func, *args, **kwargs))
+    finally:
+        db_pending -= 1
+
+async def iterate_in_db_executor(iterator):
+    """Отдает элементы синхронного итератора, получая каждый в пуле потоков БД"""
+    done = object()
+    while True:
+        item = await run_db(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+# Сессии хранятся в таблице web_sessions, поэтому их видят все процессы
+# веб-сервера (uvicorn --workers). Перед таблицей стоит LRU кэш процесса;
+# запись кэша перепроверяется по БД не реже SESSION_RECHECK_SECONDS, так что
+# выход в одном процессе доходит до остальных не позже чем через это время.
+SESSION_TTL_SECONDS = 86400
+SESSION_CACHE_SIZE = 1024
+SESSION_RECHECK_SECONDS = 10
 
 def create_session_token():
     """Создает токен сессии"""
     return secrets.token_urlsafe(32)
 
+def user_info(username: str):
+    """Данные пользователя для шаблонов и проверок прав"""
+    user_data = USERS[username]
+    return {
+        "username": username,
+        "role": user_data["role"],
+        "display_name": user_data["display_name"]
+    }
+
 def verify_user(username: str, password: str):
     """Проверяет данные пользователя"""
-    if username in USERS:
-        user_data = USERS[username]
-        if password == user_data["password"]:
-            return {
-                "username": username,
-                "role": user_data["role"],
-                "display_name": user_data["display_name"]
-            }
+    if username in USERS and password == USERS[username]["password"]:
+        return user_info(username)
     return None
 
-def get_current_user(session_token: Optional[str] = Cookie(None)):
+class SessionStore:
+    """Сессии веб-интерфейса: таблица в БД с TTL и LRU кэш процесса перед ней"""
+    def __init__(self, ttl: int = SESSION_TTL_SECONDS, cache_size: int = SESSION_CACHE_SIZE,
+                 recheck_seconds: float = SESSION_RECHECK_SECONDS):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.recheck_seconds = recheck_seconds
+        # токен -> (пользователь, срок сессии, когда проверено по БД)
+        self.cache = OrderedDict()
+
+    def _remember(self, token: str, user: dict, expires_at: float):
+        self.cache[token] = (user, expires_at, time.time())
+        self.cache.move_to_end(token)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def create(self, user: dict):
+        """Открывает сессию и возвращает ее токен"""
+        token = create_session_token()
+        expires_at = time.time() + self.ttl
+        await run_db(create_web_session, token, user["username"], expires_at)
+        self._remember(token, user, expires_at)
+        return token
+
+    async def get(self, token: str):
+        """Пользователь действующей сессии или None"""
+        now = time.time()
+        entry = self.cache.get(token)
+        if entry and entry[2] + self.recheck_seconds > now:
+            if entry[1] <= now:
+                del self.cache[token]
+                return None
+            self.cache.move_to_end(token)
+            return entry[0]
+
+        session = await run_db(get_web_session, token)
+        if session is None or session["username"] not in USERS:
+            self.cache.pop(token, None)
+            return None
+        user = user_info(session["username"])
+        self._remember(token, user, session["expires_at"])
+        return user
+
+    async def delete(self, token: str):
+        self.cache.pop(token, None)
+        await run_db(delete_web_session, token)
+
+sessions = SessionStore()
+
+async def get_current_user(session_token: Optional[str] = Cookie(None)):
     """Получает текущего пользователя из сессии"""
-    if not session_token or session_token not in active_sessions:
+    if not session_token:
         return None
-    return active_sessions[session_token]
+    return await sessions.get(session_token)
 
-def require_auth(session_token: Optional[str] = Cookie(None)):
+async def require_auth(session_token: Optional[str] = Cookie(None)):
     """Требует аутентификации"""
-    user = get_current_user(session_token)
+    user = await get_current_user(session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Требуется вход в систему")
     return user
@@ -76,32 +176,155 @@ def require_admin(user=Depends(require_auth)):
         raise HTTPException(status_code=403, detail="Недостаточно прав")
     return user
 
+# Интервал проверки статистики для рассылки изменений и размер очереди отправки на клиента
+WS_UPDATE_INTERVAL = 5
+WS_SEND_QUEUE_SIZE = 8
+# Сколько последних рассылок хранится для переподключения и сколько закрытых чатов в снимке
+WS_HISTORY_SIZE = 1000
+WS_CLOSED_CHAT_LIMIT = 100
+
+def current_shift_name():
+    """Возвращает имя текущей смены"""
+    now = datetime.now()
+    return "day_" + now.strftime("%Y-%m-%d") if 9 <= now.hour < 21 else "night_" + now.strftime("%Y-%m-%d")
+
+# Кэш чтения для дашборда: результат живет RESPONSE_CACHE_TTL секунд и
+# сбрасывается раньше, как только в БД что-то зафиксировано (PRAGMA data_version).
+# TTL нужен, потому что активные чаты становятся закрытыми и без записи.
+RESPONSE_CACHE_TTL = 2.0
+RESPONSE_CACHE_MAX_ENTRIES = 64
+# Браузер хранит ответ, но каждый раз переспрашивает сервер с If-None-Match
+CACHE_CONTROL = "private, no-cache"
+
+class ResponseCache:
+    """Кэш результатов функций чтения по ключу (эндпоинт, смена, параметры)"""
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # ключ -> (версия данных, срок, значение, хэш содержимого), от давно не нужных к свежим
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # ключ -> задача, которая сейчас считает значение
+        self.loading = {}
+
+    @staticmethod
+    def _load(compute, args):
+        value = compute(*args)
+        digest = hashlib.blake2b(json.dumps(value, sort_keys=True, default=str).encode("utf-8"),
+                                 digest_size=8).hexdigest()
+        return value, digest
+
+    async def get(self, key, compute, *args):
+        """Возвращает (значение, хэш содержимого), вызывая compute(*args) в пуле БД только при промахе"""
+        # PRAGMA data_version - тоже обращение к БД, ждет блокировку соединения версий
+        version = await run_db(data_version)
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry and entry[0] == version and entry[1] > now:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[2], entry[3]
+
+        # Одновременные промахи по одному ключу ждут один и тот же расчет
+        loading = self.loading.get(key)
+        if loading is not None:
+            self.hits += 1
+            return await asyncio.shield(loading)
+
+        self.misses += 1
+        loading = asyncio.ensure_future(run_db(self._load, compute, args))
+        self.loading[key] = loading
+        try:
+            value, digest = await asyncio.shield(loading)
+        finally:
+            if self.loading.get(key) is loading:
+                del self.loading[key]
+        now = time.monotonic()
+        self.entries.pop(key, None)
+        if len(self.entries) >= self.max_entries:
+            self.entries = OrderedDict((k, v) for k, v in self.entries.items() if v[1] > now)
+            # Ключи зависят от параметров запроса: если живы все, вытесняем самые давние
+            while len(self.entries) >= self.max_entries:
+                self.entries.popitem(last=False)
+        self.entries[key] = (version, now + self.ttl, value, digest)
+        return value, digest
+
+    def clear(self):
+        self.entries.clear()
+
+response_cache = ResponseCache()
+
+def make_etag(*parts):
+    """Слабый ETag из хэшей данных, из которых собран ответ"""
+    return 'W/"' + hashlib.blake2b("|".join(map(str, parts)).encode("utf-8"), digest_size=8).hexdigest() + '"'
+
+def etag_matches(request: Request, etag: str):
+    """Проверяет If-None-Match: браузер уже имеет эту версию ответа"""
+    header = request.headers.get("if-none-match")
+    return bool(header) and (header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")])
+
+def not_modified(etag: str):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+async def cached_shift_feed(shift_name, limit):
+    return await response_cache.get(("shift_feed", shift_name, limit), get_shift_feed, shift_name, limit)
+
+async def cached_shift_counts(shift_name):
+    return await response_cache.get(("shift_counts", shift_name), get_shift_counts, shift_name)
+
+async def cached_chat_statistics():
+    return await response_cache.get(("chat_statistics",), get_detailed_chat_statistics)
+
+async def cached_live_chat_statistics():
+    return await response_cache.get(("chat_statistics", WS_CLOSED_CHAT_LIMIT), get_detailed_chat_statistics,
+                              WS_CLOSED_CHAT_LIMIT)
+
+async def cached_recent_messages(limit):
+    return await response_cache.get(("recent_messages", limit), get_recent_messages, limit)
+
 # Список активных WebSocket соединений
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE):
         self.active_connections: List[WebSocket] = []
+        self.send_queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.queue_size = queue_size
+        self.dropped_messages = 0
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
+        self.send_queues[websocket] = asyncio.Queue(maxsize=self.queue_size)
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        self.send_queues.pop(websocket, None)
 
-    async def broadcast(self, message: dict):
+    def broadcast(self, text: str):
+        """Кладет сообщение в очередь каждого клиента, не дожидаясь отправки"""
         if not self.active_connections:
             return
-            
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except Exception:
-                disconnected.append(connection)
-        
-        for connection in disconnected:
-            self.disconnect(connection)
+
+        started = time.perf_counter()
+        for connection in list(self.active_connections):
+            queue = self.send_queues.get(connection)
+            if queue is None:
+                continue
+            if queue.full():
+                # Медленный клиент: выбрасываем самое старое сообщение,
+                # клиент заметит пропуск seq и переподключится с since
+                queue.get_nowait()
+                self.dropped_messages += 1
+            queue.put_nowait(text)
+        metrics.WS_FANOUT_SECONDS.observe(time.perf_counter() - started)
+
+    async def sender(self, websocket: WebSocket):
+        """Отправляет клиенту сообщения из его очереди"""
+        queue = self.send_queues[websocket]
+        while True:
+            text = await queue.get()
+            await websocket.send_text(text)
 
 manager = ConnectionManager()
 
@@ -127,15 +350,14 @@ async def login_post(request: Request, username: str = Form(...), password: str
     """Обработка входа"""
     user = verify_user(username, password)
     if user:
-        session_token = create_session_token()
-        active_sessions[session_token] = user
+        session_token = await sessions.create(user)
         
         response = RedirectResponse(url="/", status_code=302)
         response.set_cookie(
             key="session_token", 
             value=session_token, 
             httponly=True,
-            max_age=86400
+            max_age=SESSION_TTL_SECONDS
         )
         return response
     else:
@@ -147,8 +369,8 @@ async def login_post(request: Request, username: str = Form(...), password: str
 @app.get("/logout")
 async def logout(session_token: Optional[str] = Cookie(None)):
     """Выход из системы"""
-    if session_token and session_token in active_sessions:
-        del active_sessions[session_token]
+    if session_token:
+        await sessions.delete(session_token)
     
     response = RedirectResponse(url="/login")
     response.delete_cookie("session_token")
@@ -158,26 +380,25 @@ async def logout(session_token: Optional[str] = Cookie(None)):
 async def dashboard(request: Request, user=Depends(require_auth)):
     """Главная страница дашборда"""
     try:
-        now = datetime.now()
-        shift_name = "day_" + now.strftime("%Y-%m-%d") if 9 <= now.hour < 21 else "night_" + now.strftime("%Y-%m-%d")
-        incoming, outgoing = get_shift_messages(shift_name)
-        chat_stats = get_detailed_chat_statistics()
-        
-        recent_messages = []
-        for msg in (incoming + outgoing)[-20:]:
-            msg['type'] = 'incoming' if msg in incoming else 'outgoing'
-            recent_messages.append(msg)
-        recent_messages.sort(key=lambda x: x['timestamp'], reverse=True)
+        shift_name = current_shift_name()
+        # Лента уже упорядочена запросом и не зависит от размера смены
+        recent_messages, feed_etag = await cached_shift_feed(shift_name, 10)
+        counts, counts_etag = await cached_shift_counts(shift_name)
+        chat_stats, stats_etag = await cached_chat_statistics()
+        etag = make_etag("dashboard", user["username"], shift_name, feed_etag, counts_etag, stats_etag)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         
         return templates.TemplateResponse("dashboard.html", {
             "request": request, 
-            "incoming": incoming[:10],
-            "outgoing": outgoing[:10],
-            "recent_messages": recent_messages[:20],
+            "incoming": [msg for msg in recent_messages if msg['type'] == 'incoming'],
+            "outgoing": [msg for msg in recent_messages if msg['type'] == 'outgoing'],
+            "recent_messages": recent_messages,
+            "total_messages": counts["total_messages"],
             "shift": shift_name,
             "chat_stats": chat_stats,
             "user": user
-        })
+        }, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
     except Exception as e:
         print(f"Ошибка загрузки дашборда: {e}")
         return RedirectResponse(url="/login")
@@ -186,12 +407,15 @@ async def dashboard(request: Request, user=Depends(require_auth)):
 async def chat_statistics(request: Request, user=Depends(require_auth)):
     """Отдельная страница со статистикой чатов"""
     try:
-        chat_stats = get_detailed_chat_statistics()
+        chat_stats, stats_etag = await cached_chat_statistics()
+        etag = make_etag("stats", user["username"], stats_etag)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         return templates.TemplateResponse("stats.html", {
             "request": request,
             "chat_stats": chat_stats,
             "user": user
-        })
+        }, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
     except Exception as e:
         print(f"Ошибка загрузки статистики: {e}")
         return RedirectResponse(url="/login")
@@ -220,119 +444,249 @@ async def filters_page(request: Request, user=Depends(require_admin)):
         print(f"Ошибка загрузки фильтров: {e}")
         return RedirectResponse(url="/login")
 
+@app.get("/api/filters/stats")
+async def filters_stats_api(user=Depends(require_admin)):
+    """Счетчики срабатываний правил фильтрации (только для админов)"""
+    try:
+        rules = await run_db(get_filter_hits)
+        return {
+            "rules": rules,
+            "total_hits": sum(rule["hits"] for rule in rules)
+        }
+    except Exception as e:
+        print(f"Ошибка API filters stats: {e}")
+        return {"rules": [], "total_hits": 0}
+
 @app.get("/chat/{username}", response_class=HTMLResponse)
 async def chat_detail(request: Request, username: str, user=Depends(require_auth)):
     """Детальный просмотр чата пользователя"""
     try:
         decoded_username = unquote(username)
         
-        with sqlite3.connect("pulseai.db") as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT message, timestamp, message_type, chat_id
-                FROM messages 
-                WHERE username = ? 
-                ORDER BY timestamp ASC
-            ''', (decoded_username,))
-            
-            raw_messages = cursor.fetchall()
-            messages = []
-            
-            for msg in raw_messages:
-                messages.append({
-                    'message': msg['message'] or '',
-                    'timestamp': msg['timestamp'] or '',
-                    'type': msg['message_type'] or 'unknown',
-                    'chat_id': msg['chat_id'] or 0
-                })
-            
-            if messages:
-                try:
-                    last_message_time = datetime.fromisoformat(messages[-1]['timestamp']) if messages[-1]['timestamp'] else datetime.now()
-                    time_diff = datetime.now() - last_message_time
-                    chat_status = "Активний" if time_diff.total_seconds() < 300 else "Закритий"
-                except (ValueError, TypeError):
-                    chat_status = "Невідомий"
-            else:
-                chat_status = "Порожній"
-            
-            incoming_count = sum(1 for msg in messages if msg['type'] == 'incoming')
-            outgoing_count = sum(1 for msg in messages if msg['type'] == 'outgoing')
-            
-            return templates.TemplateResponse("chat_detail.html", {
-                "request": request,
-                "user": user,
-                "username": decoded_username,
-                "messages": messages,
-                "chat_id": messages[-1]['chat_id'] if messages else 1,
-                "chat_status": chat_status,
-                "incoming_count": incoming_count,
-                "outgoing_count": outgoing_count
-            })
+        messages, next_cursor = await run_db(get_chat_history, decoded_username)
+        
+        if messages:
+            try:
+                last_message_time = datetime.fromisoformat(messages[-1]['timestamp']) if messages[-1]['timestamp'] else datetime.now()
+                time_diff = datetime.now() - last_message_time
+                chat_status = "Активний" if time_diff.total_seconds() < 300 else "Закритий"
+            except (ValueError, TypeError):
+                chat_status = "Невідомий"
+        else:
+            chat_status = "Порожній"
+        
+        incoming_count, outgoing_count = await run_db(get_user_message_counts, decoded_username)
+        
+        return templates.TemplateResponse("chat_detail.html", {
+            "request": request,
+            "user": user,
+            "username": decoded_username,
+            "messages": messages,
+            "next_cursor": next_cursor,
+            "chat_id": messages[-1]['chat_id'] if messages else 1,
+            "chat_status": chat_status,
+            "incoming_count": incoming_count,
+            "outgoing_count": outgoing_count,
+            "total_count": incoming_count + outgoing_count
+        })
             
     except Exception as e:
         print(f"Ошибка загрузки чата для '{username}': {e}")
         return RedirectResponse(url="/")
 
+@app.get("/api/chat/{username}/messages")
+async def chat_history_api(username: str, before: Optional[str] = Query(None),
+                           limit: int = Query(CHAT_PAGE_SIZE, ge=1, le=500), user=Depends(require_auth)):
+    """API для подгрузки более старых сообщений чата"""
+    try:
+        messages, next_cursor = await run_db(get_chat_history, unquote(username), limit, before)
+        return {"messages": messages, "next_cursor": next_cursor}
+    except Exception as e:
+        print(f"Ошибка получения истории '{username}': {e}")
+        return {"messages": [], "next_cursor": None}
+
+class LiveState:
+    """Состояние живых обновлений /ws: номер последовательности и история рассылок.
+
+    Клиент получает снимок, а дальше только изменения: новые сообщения,
+    открытые/закрытые чаты и изменившиеся счетчики. Каждое сообщение
+    несет seq; переподключившийся клиент передает epoch:seq и получает
+    пропущенное из истории, а если история уже ушла дальше - новый снимок.
+    """
+    def __init__(self, history_size: int = WS_HISTORY_SIZE, closed_limit: int = WS_CLOSED_CHAT_LIMIT):
+        # epoch меняется при перезапуске сервера, номера seq тогда начинаются заново
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.closed_limit = closed_limit
+        self.counters = None
+        self.chats = {}
+        self.history = deque(maxlen=history_size)
+
+    def _publish(self, message: dict):
+        self.seq += 1
+        message["seq"] = self.seq
+        text = json.dumps(message, ensure_ascii=False)
+        self.history.append((self.seq, text))
+        return text
+
+    def update(self, counts: dict, chat_stats: dict, shift_name: str):
+        """Сравнивает свежие данные с прошлыми и возвращает текст дельты или None"""
+        counters = {
+            "incoming_count": counts["incoming_count"],
+            "outgoing_count": counts["outgoing_count"],
+            "total_messages": counts["total_messages"],
+            "active_chats": chat_stats["active_chats"],
+            "closed_chats": chat_stats["closed_chats"],
+            "total_users": chat_stats["total_users"],
+            "shift": shift_name
+        }
+        chats = {}
+        for state in ("active", "closed"):
+            for chat in chat_stats[f"{state}_chat_list"]:
+                chats[chat["username"]] = dict(chat, state=state)
+
+        first = self.counters is None
+        changed = {key: value for key, value in counters.items() if first or self.counters[key] != value}
+        upsert = [chat for username, chat in chats.items() if self.chats.get(username) != chat]
+        remove = [username for username in self.chats if username not in chats]
+        self.counters = counters
+        self.chats = chats
+        if first or not (changed or upsert or remove):
+            return None
+        return self._publish({"type": "delta", "counters": changed, "chats": {"upsert": upsert, "remove": remove}})
+
+    def message(self, event: dict):
+        """Нумерует новое сообщение слушателя и возвращает его текст"""
+        return self._publish(dict(event))
+
+    def snapshot(self):
+        return json.dumps({
+            "type": "snapshot",
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "counters": self.counters,
+            "chats": list(self.chats.values())
+        }, ensure_ascii=False)
+
+    def resume(self, since: Optional[str]):
+        """Что отправить подключившемуся клиенту: пропущенные сообщения или снимок"""
+        epoch, _, seq = (since or "").partition(":")
+        if epoch == self.epoch and seq.isdigit() and int(seq) <= self.seq:
+            seq = int(seq)
+            if seq == self.seq:
+                return []
+            if self.history and self.history[0][0] <= seq + 1:
+                return [text for number, text in self.history if number > seq]
+        return [self.snapshot()]
+
+live_state = LiveState()
+
+async def refresh_live_state():
+    """Перечитывает статистику (через кэш чтения) и возвращает дельту для рассылки или None"""
+    shift_name = current_shift_name()
+    counts, _ = await cached_shift_counts(shift_name)
+    chat_stats, _ = await cached_live_chat_statistics()
+    return live_state.update(counts, chat_stats, shift_name)
+
+async def snapshot_producer(interval: float = WS_UPDATE_INTERVAL):
+    """Раз в тик сравнивает статистику с прошлой и рассылает только изменения"""
+    while True:
+        await asyncio.sleep(interval)
+
+        if not manager.active_connections:
+            continue
+
+        try:
+            delta = await refresh_live_state()
+            if delta:
+                manager.broadcast(delta)
+        except Exception as e:
+            print(f"Ошибка рассылки WebSocket: {e}")
+
+@app.on_event("startup")
+async def start_snapshot_producer():
+    """Запускает фоновую рассылку снимков"""
+    app.state.snapshot_task = asyncio.create_task(snapshot_producer())
+
+def push_new_message(event: dict):
+    """Рассылает клиентам новое сообщение, полученное от слушателя"""
+    manager.broadcast(live_state.message(event))
+
+@app.on_event("startup")
+async def start_notify_reader():
+    """Подписывается на новые сообщения из процесса слушателя"""
+    loop = asyncio.get_running_loop()
+
+    def on_event(event):
+        # Снимки метрик слушателя не рассылаются клиентам, а попадают в /metrics
+        if event.get("type") == "metrics":
+            metrics.merge_remote(event)
+        else:
+            loop.call_soon_threadsafe(push_new_message, event)
+
+    notifier.subscribe(on_event)
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    """Запускает замер задержки цикла событий веб-сервера"""
+    app.state.loop_lag_task = asyncio.create_task(metrics.monitor_loop_lag())
+
+@app.on_event("shutdown")
+async def stop_snapshot_producer():
+    """Останавливает фоновую рассылку снимков"""
+    for name in ("snapshot_task", "loop_lag_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket соединение для обновлений в реальном времени"""
+async def websocket_endpoint(websocket: WebSocket, since: Optional[str] = Query(None)):
+    """WebSocket соединение для обновлений в реальном времени (since=epoch:seq - продолжить с места обрыва)"""
     await manager.connect(websocket)
     try:
-        while True:
-            await asyncio.sleep(10)
-            
-            if websocket.client_state.name != "CONNECTED":
-                break
-            
-            try:
-                now = datetime.now()
-                shift_name = "day_" + now.strftime("%Y-%m-%d") if 9 <= now.hour < 21 else "night_" + now.strftime("%Y-%m-%d")
-                incoming, outgoing = get_shift_messages(shift_name)
-                detailed_stats = get_detailed_chat_statistics()
-                
-                update_data = {
-                    "type": "update",
-                    "data": {
-                        "chat_stats": detailed_stats,
-                        "incoming_count": len(incoming),
-                        "outgoing_count": len(outgoing),
-                        "total_messages": len(incoming) + len(outgoing),
-                        "shift": shift_name,
-                        "timestamp": datetime.now().strftime("%H:%M:%S")
-                    }
-                }
-                
-                await websocket.send_text(json.dumps(update_data))
-                
-            except Exception as e:
-                print(f"Ошибка WebSocket: {e}")
-                break
-            
+        # Свежая дельта уходит всем, в том числе в очередь нового клиента - он отбросит ее по seq
+        delta = await refresh_live_state()
+        if delta:
+            manager.broadcast(delta)
+        initial = live_state.resume(since)
+        for text in initial:
+            await websocket.send_text(text)
+    except Exception as e:
+        print(f"Ошибка WebSocket: {e}")
+        manager.disconnect(websocket)
+        return
+    sender = asyncio.create_task(manager.sender(websocket))
+    try:
+        # Читаем входящие кадры, чтобы сразу заметить отключение клиента
+        while not sender.done():
+            await websocket.receive_text()
     except WebSocketDisconnect:
         pass
+    except Exception as e:
+        print(f"Ошибка WebSocket: {e}")
     finally:
+        sender.cancel()
         manager.disconnect(websocket)
 
 @app.get("/api/stats")
-async def get_stats_api(user=Depends(require_auth)):
+async def get_stats_api(request: Request, user=Depends(require_auth)):
     """API для получения статистики"""
     try:
-        now = datetime.now()
-        shift_name = "day_" + now.strftime("%Y-%m-%d") if 9 <= now.hour < 21 else "night_" + now.strftime("%Y-%m-%d")
-        incoming, outgoing = get_shift_messages(shift_name)
-        detailed_stats = get_detailed_chat_statistics()
+        shift_name = current_shift_name()
+        counts, counts_etag = await cached_shift_counts(shift_name)
+        detailed_stats, stats_etag = await cached_chat_statistics()
+        etag = make_etag("api_stats", shift_name, counts_etag, stats_etag)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         
-        return {
+        return JSONResponse({
             "chat_stats": detailed_stats,
-            "incoming_count": len(incoming),
-            "outgoing_count": len(outgoing),
-            "total_messages": len(incoming) + len(outgoing),
+            "incoming_count": counts["incoming_count"],
+            "outgoing_count": counts["outgoing_count"],
+            "total_messages": counts["total_messages"],
             "shift": shift_name,
             "timestamp": datetime.now().strftime("%H:%M:%S")
-        }
+        }, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
     except Exception as e:
         print(f"Ошибка API stats: {e}")
         return {
@@ -344,85 +698,176 @@ async def get_stats_api(user=Depends(require_auth)):
             "timestamp": datetime.now().strftime("%H:%M:%S")
         }
 
+def format_duration(seconds):
+    """Форматирует длительность для карточек аналитики"""
+    if seconds is None:
+        return "—"
+    if seconds < 60:
+        return f"{seconds:.0f} с"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} хв"
+    return f"{seconds / 3600:.1f} год"
+
+@app.get("/api/analytics")
+async def get_analytics_api(period: str = Query("today"), user=Depends(require_auth)):
+    """API аналитики из сводных таблиц по корзинам времени"""
+    if period not in ANALYTICS_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный период: {period}")
+    try:
+        data = await run_db(get_analytics, period)
+        data["avg_response_time"] = format_duration(data["avg_response_seconds"])
+        return data
+    except Exception as e:
+        print(f"Ошибка API analytics: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка расчета аналитики")
+
+@app.get("/api/metrics/response")
+async def response_metrics_api(shift_name: Optional[str] = Query(None), user=Depends(require_auth)):
+    """Первый ответ, задержка ответов и время до закрытия чатов за смену"""
+    try:
+        return await run_db(get_response_metrics, shift_name or current_shift_name())
+    except Exception as e:
+        print(f"Ошибка API response metrics: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка расчета метрик")
+
 @app.get("/api/recent-messages")
-async def get_recent_messages_api(user=Depends(require_auth)):
+async def get_recent_messages_api(request: Request, user=Depends(require_auth)):
     """API для получения последних сообщений"""
     try:
-        from db_handler import get_recent_messages
-        messages = get_recent_messages(20)
+        messages, messages_etag = await cached_recent_messages(20)
+        etag = make_etag("recent_messages", messages_etag)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         
-        for msg in messages:
-            msg['type'] = msg['message_type']
-            
-        return {"messages": messages}
+        messages = [dict(msg, type=msg['message_type']) for msg in messages]
+        return JSONResponse({"messages": messages}, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
     except Exception as e:
         print(f"Ошибка получения сообщений: {e}")
         return {"messages": []}
 
 @app.get("/search")
-async def search_messages(q: str = Query(...), user=Depends(require_auth)):
-    """Поиск по сообщениям"""
+async def search_messages(q: str = Query(...), cursor: Optional[str] = Query(None),
+                          limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=200), archive: bool = Query(False),
+                          user=Depends(require_auth)):
+    """Поиск по сообщениям (archive=true - по архиву старых сообщений)"""
     try:
-        with sqlite3.connect("pulseai.db") as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT username, message, timestamp, message_type, shift_name, chat_id
-                FROM messages 
-                WHERE message LIKE ? 
-                ORDER BY timestamp DESC 
-                LIMIT 100
-            ''', (f"%{q}%",))
-            
-            results = [dict(row) for row in cursor.fetchall()]
-        
-        return {"results": results, "total": len(results)}
+        results, next_cursor = await run_db(search_message_index, q, limit, cursor, archive)
+        return {"results": results, "total": len(results), "next_cursor": next_cursor}
     except Exception as e:
         print(f"Ошибка поиска: {e}")
-        return {"results": [], "total": 0}
+        return {"results": [], "total": 0, "next_cursor": None}
 
-@app.get("/export/csv")
-async def export_csv(shift_name: str = Query(None), user=Depends(require_auth)):
-    """Экспорт данных в CSV"""
-    try:
-        if not shift_name:
-            shift_name = f"day_{datetime.now().strftime('%Y-%m-%d')}"
-        
-        incoming, outgoing = get_shift_messages(shift_name)
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"
+}
+EXPORT_TYPE_LABELS = {
+    "incoming": "Входящее",
+    "outgoing": "Исходящее"
+}
+
+def parse_export_date(value: Optional[str], end_of_range: bool = False):
+    """Приводит дату или дату-время из запроса к ISO строке для сравнения с timestamp"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    # Дата без времени в конце диапазона включает весь день
+    if end_of_range and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.isoformat()
+
+def export_chunks(export_format: str, chunks):
+    """Превращает пачки строк из iter_messages в куски CSV или NDJSON"""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
         writer.writerow(['Тип', 'Пользователь', 'Сообщение', 'Время', 'ID чата'])
-        
-        for msg in incoming:
-            writer.writerow([
-                'Входящее',
-                msg.get('username', ''),
-                msg.get('message', ''),
-                msg.get('timestamp', ''),
-                msg.get('chat_id', '')
-            ])
-        
-        for msg in outgoing:
-            writer.writerow([
-                'Исходящее',
-                msg.get('username', ''),
-                msg.get('message', ''),
-                msg.get('timestamp', ''),
-                msg.get('chat_id', '')
-            ])
-        
-        output.seek(0)
-        return Response(
-            content=output.getvalue(),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={shift_name}.csv"}
-        )
-    except Exception as e:
-        print(f"Ошибка экспорта: {e}")
-        return {"error": "Ошибка экспорта данных"}
+        yield buffer.getvalue()
+        for rows in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            for msg in rows:
+                writer.writerow([
+                    EXPORT_TYPE_LABELS.get(msg['message_type'], msg['message_type']),
+                    msg['username'] or '',
+                    msg['message'] or '',
+                    msg['timestamp'] or '',
+                    msg['chat_id'] or ''
+                ])
+            yield buffer.getvalue()
+    else:
+        for rows in chunks:
+            yield "".join(json.dumps(msg, ensure_ascii=False) + "\n" for msg in rows)
+
+def encode_stream(parts, compress: bool):
+    """Кодирует куски в UTF-8 и при необходимости сжимает их gzip на лету"""
+    if not compress:
+        for part in parts:
+            yield part.encode("utf-8")
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for part in parts:
+        data = compressor.compress(part.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.get("/export/{export_format}")
+async def export_messages(export_format: str, shift_name: str = Query(None), date_from: str = Query(None),
+                          date_to: str = Query(None), username: str = Query(None),
+                          message_type: str = Query(None), gzip: bool = Query(False),
+                          archive: bool = Query(False), user=Depends(require_auth)):
+    """Потоковый экспорт сообщений в CSV или NDJSON (archive=true - из архива)"""
+    if export_format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="Неизвестный формат экспорта")
+    
+    try:
+        range_from = parse_export_date(date_from)
+        range_to = parse_export_date(date_to, end_of_range=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат даты")
+    
+    if not (shift_name or range_from or range_to):
+        shift_name = current_shift_name()
+    
+    filename = shift_name or f"messages_{date_from or 'start'}_{date_to or 'now'}"
+    filename += f".{export_format}"
+    media_type = EXPORT_MEDIA_TYPES[export_format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    chunks = iter_messages(range_from, range_to, shift_name, username, message_type, archive=archive)
+    # Пачки читаются и кодируются в пуле потоков БД, как и остальные запросы
+    return StreamingResponse(
+        iterate_in_db_executor(encode_stream(export_chunks(export_format, chunks), gzip)),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+metrics.gauge("pulseai_websocket_connections", "Открытые WebSocket соединения",
+              lambda: len(manager.active_connections))
+metrics.gauge("pulseai_ws_dropped_messages_total", "Сообщения, выброшенные из очередей медленных клиентов",
+              lambda: manager.dropped_messages, "counter")
+metrics.gauge("pulseai_active_sessions", "Активные сессии веб-интерфейса (все процессы)", count_web_sessions)
+metrics.gauge("pulseai_db_connections", "Открытые соединения с БД в веб-процессе", open_connection_count)
+metrics.gauge("pulseai_db_executor_workers", "Потоки пула запросов к БД", lambda: DB_EXECUTOR_WORKERS)
+metrics.gauge("pulseai_db_executor_pending", "Запросы к БД, выполняемые или ждущие потока пула",
+              lambda: db_pending)
+metrics.gauge("pulseai_response_cache_hits_total", "Ответы дашборда из кэша чтения",
+              lambda: response_cache.hits, "counter")
+metrics.gauge("pulseai_response_cache_misses_total", "Промахи кэша чтения дашборда",
+              lambda: response_cache.misses, "counter")
+# /metrics открыт без входа, поэтому наружу только сумма: правила содержат ключевые слова и
+# имена пользователей, по правилам срабатывания видны на странице фильтров
+metrics.gauge("pulseai_filter_hits_total", "Срабатывания правил фильтрации (все процессы)",
+              lambda: sum(hit["hits"] for hit in get_filter_hits()), "counter")
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus"""
+    # Часть значений (срабатывания фильтров) читается из БД
+    return Response(await run_db(metrics.render), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/health")
 async def health_check():